@@ -42,6 +42,8 @@ class ProductionConfig:
     # Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 60
     RATE_LIMIT_PER_HOUR: int = 1000
+    RATE_LIMIT_DB_PATH: Optional[str] = os.getenv("RATE_LIMIT_DB_PATH")  # Shared SQLite state when REDIS_URL is unset
+    RATE_LIMIT_LEASE_SIZE: int = int(os.getenv("RATE_LIMIT_LEASE_SIZE", "5"))  # Permits a worker may take per shared-store round trip
     
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
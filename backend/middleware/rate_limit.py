@@ -0,0 +1,406 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (requests allowed, period in seconds)
+Rule = Tuple[int, float]
+
+class GCRA:
+    """Generic cell rate algorithm: a token bucket stored as one float per key
+
+    Each key keeps only its theoretical arrival time (TAT). A request is allowed
+    when pushing the TAT one emission interval forward keeps it within `period`
+    of now, which admits `limit` requests per `period` with bursts up to `limit`.
+    Keys whose TAT has passed hold no information and are evicted first.
+    """
+
+    def __init__(self, limit: int, period: float, max_keys: int = 100_000):
+        self.limit = limit
+        self.period = period
+        self.interval = period / limit
+        self.max_keys = max_keys
+        self._tats: "OrderedDict[str, float]" = OrderedDict()
+
+    def peek(self, key: str, now: float, permits: int = 1) -> Tuple[float, float]:
+        """Returns (TAT after `permits` more requests, seconds until they would be allowed or 0)"""
+        new_tat = max(self._tats.get(key, now), now) + self.interval * permits
+        return new_tat, max(0.0, new_tat - self.period - now)
+
+    def commit(self, key: str, new_tat: float, now: float):
+        self._tats[key] = new_tat
+        self._tats.move_to_end(key)
+        self._evict(now)
+
+    def hit(self, key: str, now: Optional[float] = None) -> float:
+        """Record a request; returns 0 if allowed, otherwise seconds until one would be"""
+        now = time.monotonic() if now is None else now
+        new_tat, retry_after = self.peek(key, now)
+        if retry_after:
+            # Rejected requests don't consume capacity
+            return retry_after
+        self.commit(key, new_tat, now)
+        return 0.0
+
+    def _evict(self, now: float):
+        # Least recently used first; idle keys at the front have usually expired anyway
+        tats = self._tats
+        while tats:
+            key, tat = next(iter(tats.items()))
+            if tat > now and len(tats) <= self.max_keys:
+                break
+            del tats[key]
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+class MemoryRateLimitBackend:
+    """Per-process GCRA state; limits apply to each worker separately"""
+
+    name = "memory"
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._rules: Dict[Rule, GCRA] = {}
+        self._blocked: "OrderedDict[str, float]" = OrderedDict()
+
+    async def acquire(self, key: str, rules: List[Rule], permits: int = 1) -> float:
+        """Take `permits` from every rule atomically; returns 0 or the seconds to wait"""
+        now = time.monotonic()
+        pending = []
+        for rule in rules:
+            gcra = self._rules.get(rule)
+            if gcra is None:
+                gcra = self._rules[rule] = GCRA(rule[0], rule[1], self.max_keys)
+            new_tat, retry_after = gcra.peek(key, now, permits)
+            if retry_after:
+                return retry_after
+            pending.append((gcra, new_tat))
+        for gcra, new_tat in pending:
+            gcra.commit(key, new_tat, now)
+        return 0.0
+
+    async def block(self, key: str, duration: float):
+        now = time.monotonic()
+        self._blocked[key] = now + duration
+        self._blocked.move_to_end(key)
+        while self._blocked:
+            oldest, until = next(iter(self._blocked.items()))
+            if until > now and len(self._blocked) <= self.max_keys:
+                break
+            del self._blocked[oldest]
+
+    async def blocked_for(self, key: str) -> float:
+        until = self._blocked.get(key)
+        if until is None:
+            return 0.0
+        remaining = until - time.monotonic()
+        if remaining <= 0:
+            del self._blocked[key]
+            return 0.0
+        return remaining
+
+    async def close(self):
+        pass
+
+# Multi-rule GCRA evaluated atomically on the Redis server, using its clock
+# KEYS: one TAT key per rule; ARGV: permits, then (interval ms, period ms) per rule
+GCRA_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local permits = tonumber(ARGV[1])
+local wait = 0
+local new_tats = {}
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[i * 2])
+    local period = tonumber(ARGV[i * 2 + 1])
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then tat = now end
+    new_tats[i] = tat + interval * permits
+    local rule_wait = new_tats[i] - period - now
+    if rule_wait > wait then wait = rule_wait end
+end
+if wait > 0 then return math.ceil(wait) end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, new_tats[i], 'PX', math.ceil(new_tats[i] - now))
+end
+return 0
+"""
+
+class RedisRateLimitBackend:
+    """GCRA state in Redis, shared by every worker and host (requires the `redis` package)"""
+
+    name = "redis"
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(GCRA_SCRIPT)
+
+    async def acquire(self, key: str, rules: List[Rule], permits: int = 1) -> float:
+        keys = [f"{self.prefix}{key}:{period:g}" for _, period in rules]
+        args: List[Any] = [permits]
+        for limit, period in rules:
+            args.extend([period * 1000 / limit, period * 1000])
+        wait_ms = await self._script(keys=keys, args=args)
+        return int(wait_ms) / 1000
+
+    async def block(self, key: str, duration: float):
+        await self.client.set(f"{self.prefix}block:{key}", 1, px=int(duration * 1000))
+
+    async def blocked_for(self, key: str) -> float:
+        remaining_ms = await self.client.pttl(f"{self.prefix}block:{key}")
+        return remaining_ms / 1000 if remaining_ms > 0 else 0.0
+
+    async def close(self):
+        await self.client.aclose()
+
+class SQLiteRateLimitBackend:
+    """GCRA state in a local SQLite file, shared by the workers of a single host
+
+    A stand-in for Redis on single-host deployments and in tests. Each acquire is
+    one IMMEDIATE transaction, run in a thread so the event loop isn't blocked.
+    """
+
+    name = "sqlite"
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS rate_limit_blocks (key TEXT PRIMARY KEY, until REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _acquire(self, key: str, rules: List[Rule], permits: int) -> float:
+        connection = self._connect()
+        now = time.time()
+        keys = [f"{key}:{period:g}" for _, period in rules]
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            new_tats = []
+            wait = 0.0
+            for rule_key, (limit, period) in zip(keys, rules):
+                row = connection.execute("SELECT tat FROM rate_limits WHERE key = ?", (rule_key,)).fetchone()
+                new_tat = max(row[0] if row else now, now) + period / limit * permits
+                wait = max(wait, new_tat - period - now)
+                new_tats.append(new_tat)
+            if wait <= 0:
+                connection.executemany("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)",
+                                       zip(keys, new_tats))
+            self._calls += 1
+            if self._calls % self.PURGE_EVERY == 0:
+                connection.execute("DELETE FROM rate_limits WHERE tat < ?", (now,))
+                connection.execute("DELETE FROM rate_limit_blocks WHERE until < ?", (now,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return max(wait, 0.0)
+
+    async def acquire(self, key: str, rules: List[Rule], permits: int = 1) -> float:
+        return await asyncio.to_thread(self._acquire, key, rules, permits)
+
+    def _block(self, key: str, duration: float):
+        self._connect().execute("INSERT OR REPLACE INTO rate_limit_blocks (key, until) VALUES (?, ?)",
+                                (key, time.time() + duration))
+
+    async def block(self, key: str, duration: float):
+        await asyncio.to_thread(self._block, key, duration)
+
+    def _blocked_for(self, key: str) -> float:
+        row = self._connect().execute("SELECT until FROM rate_limit_blocks WHERE key = ?", (key,)).fetchone()
+        return max(0.0, row[0] - time.time()) if row else 0.0
+
+    async def blocked_for(self, key: str) -> float:
+        return await asyncio.to_thread(self._blocked_for, key)
+
+    async def close(self):
+        pass
+
+def create_rate_limit_backend(redis_url: Optional[str] = None, sqlite_path: Optional[str] = None,
+                              max_keys: int = 100_000):
+    """Redis when configured and importable, else a shared SQLite file, else per-process memory"""
+    if redis_url:
+        try:
+            return RedisRateLimitBackend(redis_url)
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; rate limits are not shared via Redis")
+    if sqlite_path:
+        return SQLiteRateLimitBackend(sqlite_path)
+    return MemoryRateLimitBackend(max_keys)
+
+class _LocalState:
+    __slots__ = ("permits", "expires_at", "lease", "denied_until", "blocked", "violations")
+
+    def __init__(self):
+        self.permits = 0
+        self.expires_at = 0.0
+        self.lease = 1
+        self.denied_until = 0.0
+        self.blocked = False
+        self.violations = 0 # Locally denied requests not yet charged to the backend
+
+class RateLimiter:
+    """Per-key request limits over several windows, with expiring blocks for persistent offenders
+
+    A key that keeps sending requests after being limited (more rejected requests than
+    its per-minute allowance within a minute) is blocked for `block_duration` seconds.
+
+    With a shared backend, busy keys lease permits in batches (doubling up to
+    `max_lease`) and spend them locally, and denials are remembered until their
+    retry time, so most requests never leave the process. Leased permits that go
+    unused within `lease_ttl` are forfeited, which errs on the strict side. Requests
+    denied from that local memory still count as violations; they are charged to the
+    backend in batches of up to `max_lease`.
+    """
+
+    def __init__(self, per_minute: int, per_hour: Optional[int] = None, block_duration: float = 900,
+                 max_keys: int = 100_000, backend=None, max_lease: int = 1, lease_ttl: float = 1.0):
+        self.rules: List[Rule] = [(per_minute, 60)]
+        if per_hour:
+            self.rules.append((per_hour, 3600))
+        self.violation_rules: List[Rule] = [(per_minute, 60)]
+        self.block_duration = block_duration
+        self.max_keys = max_keys
+        self.backend = backend or MemoryRateLimitBackend(max_keys)
+        # Overshoot across workers is bounded by (workers - 1) * max_lease; keep it to ~10% of the limit
+        self.max_lease = max(1, min(max_lease, min(limit for limit, _ in self.rules) // 10))
+        self.lease_ttl = lease_ttl
+        self._local: "OrderedDict[str, _LocalState]" = OrderedDict()
+        self.limited = 0
+        self.blocks = 0
+        self.local_hits = 0
+        self.backend_calls = 0
+
+    def _state(self, key: str) -> _LocalState:
+        state = self._local.get(key)
+        if state is None:
+            state = self._local[key] = _LocalState()
+            if len(self._local) > self.max_keys:
+                self._local.popitem(last=False)
+        else:
+            self._local.move_to_end(key)
+        return state
+
+    async def check(self, key: str) -> Tuple[bool, float, bool]:
+        """Returns (allowed, retry_after seconds, blocked)"""
+        now = time.monotonic()
+        state = self._local.get(key)
+        if state is not None:
+            if state.denied_until > now:
+                self.local_hits += 1
+                if not state.blocked:
+                    state.violations += 1
+                    if state.violations >= self.max_lease:
+                        self.backend_calls += 1
+                        if await self._charge_violations(key, state, 0):
+                            return self._block(state, now)
+                return False, state.denied_until - now, state.blocked
+            if state.permits > 0 and state.expires_at > now:
+                self.local_hits += 1
+                state.permits -= 1
+                return True, 0.0, False
+
+        self.backend_calls += 1
+        state = self._state(key)
+        remaining_block = await self.backend.blocked_for(key)
+        if remaining_block:
+            return self._deny(state, now, remaining_block, True)
+
+        # Busy keys that used up their last lease in time get a bigger one
+        lease = min(state.lease * 2, self.max_lease) if state.expires_at > now else 1
+        retry_after = await self.backend.acquire(key, self.rules, lease)
+        if retry_after and lease > 1:
+            lease = 1
+            retry_after = await self.backend.acquire(key, self.rules, 1)
+        if retry_after:
+            self.limited += 1
+            if await self._charge_violations(key, state, 1):
+                return self._block(state, now)
+            return self._deny(state, now, retry_after, False)
+        if state.violations and await self._charge_violations(key, state, 0):
+            return self._block(state, now)
+
+        state.lease = lease
+        state.permits = lease - 1
+        state.expires_at = now + self.lease_ttl
+        return True, 0.0, False
+
+    async def _charge_violations(self, key: str, state: _LocalState, extra: int) -> bool:
+        """Count the key's pending and `extra` rejected requests; True if that blocks it"""
+        count = state.violations + extra
+        state.violations = 0
+        if not await self.backend.acquire(f"violations:{key}", self.violation_rules, count):
+            return False
+        self.blocks += 1
+        await self.backend.block(key, self.block_duration)
+        return True
+
+    def _block(self, state: _LocalState, now: float) -> Tuple[bool, float, bool]:
+        return self._deny(state, now, self.block_duration, True)
+
+    @staticmethod
+    def _deny(state: _LocalState, now: float, retry_after: float, blocked: bool) -> Tuple[bool, float, bool]:
+        state.permits = 0
+        state.denied_until = now + retry_after
+        state.blocked = blocked
+        return False, retry_after, blocked
+
+    async def close(self):
+        await self.backend.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "tracked_keys": len(self._local),
+            "max_lease": self.max_lease,
+            "local_hits": self.local_hits,
+            "backend_calls": self.backend_calls,
+            "limited": self.limited,
+            "blocks": self.blocks,
+        }
+
+async def _benchmark(backend, requests: int) -> float:
+    limiter = RateLimiter(per_minute=60, per_hour=1000, max_keys=100_000, backend=backend, max_lease=10)
+    started_at = time.perf_counter()
+    for i in range(requests):
+        await limiter.check(f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}")
+        await limiter.check("203.0.113.7")
+    elapsed = time.perf_counter() - started_at
+    print(f"{backend.name}: {requests * 2:,} checks in {elapsed:.2f}s "
+          f"({requests * 2 / elapsed:,.0f}/s, {elapsed / (requests * 2) * 1e6:.2f} us/check)")
+    print(f"  {limiter.get_stats()}")
+    await limiter.close()
+    return elapsed
+
+if __name__ == "__main__":
+    # python -m middleware.rate_limit [requests] [sqlite path]; one request from each of N distinct IPs plus a hot key
+    import sys
+    import tracemalloc
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tracemalloc.start()
+    asyncio.run(_benchmark(MemoryRateLimitBackend(), count))
+    current, peak = tracemalloc.get_traced_memory()
+    print(f"  memory: {current / 2**20:.1f} MiB current, {peak / 2**20:.1f} MiB peak")
+    tracemalloc.stop()
+    if len(sys.argv) > 2:
+        asyncio.run(_benchmark(SQLiteRateLimitBackend(sys.argv[2]), min(count, 50_000)))
@@ -1,24 +1,106 @@
-from fastapi import Request, HTTPException, status
+from fastapi import Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from starlette.middleware.sessions import SessionMiddleware
-import time
+import math
 import hashlib
-from collections import defaultdict
-from typing import Dict, List
+from typing import List, Optional
 import logging
 
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from middleware.rate_limit import RateLimiter, create_rate_limit_backend
+from utils import validation
+
 logger = logging.getLogger(__name__)
 
+# Added to every response; encoded once at import
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"x-xss-protection", b"1; mode=block"),
+    (b"strict-transport-security", b"max-age=31536000; includeSubDomains"),
+    (b"referrer-policy", b"strict-origin-when-cross-origin"),
+    (b"permissions-policy", b"geolocation=(), microphone=(), camera=()"),
+]
+RATE_LIMITED_BODY = b'{"detail":"Rate limit exceeded"}'
+BLOCKED_BODY = b'{"detail":"IP address blocked due to excessive requests"}'
+
+def scope_client_ip(scope: Scope) -> str:
+    """Client address from raw ASGI headers, honouring the proxy headers set by our load balancer"""
+    real_ip = None
+    for name, value in scope["headers"]:
+        if name == b"x-forwarded-for":
+            return value.split(b",", 1)[0].strip().decode("latin-1")
+        if name == b"x-real-ip":
+            real_ip = value
+    if real_ip:
+        return real_ip.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class SecurityASGIMiddleware:
+    """Rate limiting and security headers as plain ASGI
+
+    Unlike @app.middleware("http") this adds no per-request task or body stream
+    wrapping, so streaming responses pass straight through. Rejections are sent
+    as complete 429 responses from here instead of raising.
+    """
+
+    def __init__(self, app: ASGIApp, security: "SecurityMiddleware"):
+        self.app = app
+        self.security = security
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client_ip = scope_client_ip(scope)
+        allowed, retry_after, blocked = await self.security.check_rate_limit(client_ip)
+        if not allowed:
+            if not blocked:
+                logger.warning(f"Rate limit exceeded for IP: {client_ip}")
+            await self._reject(send, BLOCKED_BODY if blocked else RATE_LIMITED_BODY, retry_after)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *SECURITY_HEADERS]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    async def _reject(send: Send, body: bytes, retry_after: float):
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+                *SECURITY_HEADERS,
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
 class SecurityMiddleware:
     def __init__(self):
-        self.rate_limits: Dict[str, List[float]] = defaultdict(list)
-        self.blocked_ips: set = set()
+        self.limiter: Optional[RateLimiter] = None
         
     def add_security_middleware(self, app, config):
         """Add all security middleware to the FastAPI app"""
         
+        # Shared across workers via Redis (or a local SQLite file) so limits aren't multiplied by WORKERS
+        self.limiter = RateLimiter(
+            config.RATE_LIMIT_PER_MINUTE,
+            config.RATE_LIMIT_PER_HOUR,
+            backend=create_rate_limit_backend(config.REDIS_URL, config.RATE_LIMIT_DB_PATH),
+            max_lease=config.RATE_LIMIT_LEASE_SIZE,
+        )
+        
         # CORS middleware
         app.add_middleware(
             CORSMiddleware,
@@ -43,36 +125,8 @@ class SecurityMiddleware:
             https_only=True
         )
         
-        # Custom security middleware
-        @app.middleware("http")
-        async def security_middleware(request: Request, call_next):
-            # Rate limiting
-            client_ip = self.get_client_ip(request)
-            
-            if client_ip in self.blocked_ips:
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="IP address blocked due to excessive requests"
-                )
-            
-            if not self.check_rate_limit(client_ip, config.RATE_LIMIT_PER_MINUTE):
-                logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Rate limit exceeded"
-                )
-            
-            # Security headers
-            response = await call_next(request)
-            
-            response.headers["X-Content-Type-Options"] = "nosniff"
-            response.headers["X-Frame-Options"] = "DENY"
-            response.headers["X-XSS-Protection"] = "1; mode=block"
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-            response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-            response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
-            
-            return response
+        # Custom security middleware (outermost): rate limiting and security headers
+        app.add_middleware(SecurityASGIMiddleware, security=self)
     
     def get_client_ip(self, request: Request) -> str:
         """Get the real client IP address"""
@@ -86,95 +140,53 @@ class SecurityMiddleware:
         
         return request.client.host if request.client else "unknown"
     
-    def check_rate_limit(self, client_ip: str, limit_per_minute: int) -> bool:
-        """Check if client IP is within rate limits"""
-        current_time = time.time()
-        minute_ago = current_time - 60
-        
-        # Clean old entries
-        self.rate_limits[client_ip] = [
-            timestamp for timestamp in self.rate_limits[client_ip]
-            if timestamp > minute_ago
-        ]
-        
-        # Check current rate
-        if len(self.rate_limits[client_ip]) >= limit_per_minute:
-            # Block IP if consistently exceeding limits
-            if len(self.rate_limits[client_ip]) > limit_per_minute * 2:
-                self.blocked_ips.add(client_ip)
-                logger.error(f"IP {client_ip} blocked for excessive requests")
-            return False
-        
-        # Add current request
-        self.rate_limits[client_ip].append(current_time)
-        return True
+    async def check_rate_limit(self, client_ip: str):
+        """Check if client IP is within rate limits; returns (allowed, retry_after, blocked)"""
+        blocks = self.limiter.blocks
+        allowed, retry_after, blocked = await self.limiter.check(client_ip)
+        if self.limiter.blocks > blocks:
+            logger.error(f"IP {client_ip} blocked for {retry_after:.0f}s for excessive requests")
+        return allowed, retry_after, blocked
 
 class InputValidation:
-    """Input validation and sanitization"""
+    """Input validation and sanitization (see utils.validation for the pydantic types)"""
     
     @staticmethod
     def sanitize_string(value: str, max_length: int = 1000) -> str:
         """Sanitize string input"""
-        if not isinstance(value, str):
-            raise ValueError("Input must be a string")
-        
-        # Remove null bytes and control characters
-        sanitized = ''.join(char for char in value if ord(char) >= 32 or char in '\n\r\t')
-        
-        # Limit length
-        if len(sanitized) > max_length:
-            raise ValueError(f"Input too long. Maximum {max_length} characters allowed")
-        
-        return sanitized.strip()
+        return validation.sanitize_string(value, max_length)
+    
+    @staticmethod
+    def sanitize_batch(values: List[str], max_length: int = 1000) -> List[str]:
+        """Sanitize many strings; raises on the first invalid one"""
+        return [validation.sanitize_string(value, max_length) for value in values]
     
     @staticmethod
     def validate_email(email: str) -> str:
         """Validate and sanitize email"""
-        import re
-        
-        email = InputValidation.sanitize_string(email, 254)
-        
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if not re.match(email_pattern, email):
-            raise ValueError("Invalid email format")
-        
-        return email.lower()
+        return validation.validate_email(email)
     
     @staticmethod
     def validate_phone(phone: str) -> str:
         """Validate and sanitize phone number"""
-        import re
-        
-        phone = InputValidation.sanitize_string(phone, 20)
-        
-        # Remove all non-digit characters except +
-        phone = re.sub(r'[^\d+]', '', phone)
-        
-        # Basic phone validation (adjust pattern as needed)
-        phone_pattern = r'^\+?[1-9]\d{1,14}$'
-        if not re.match(phone_pattern, phone):
-            raise ValueError("Invalid phone number format")
-        
-        return phone
+        return validation.validate_phone(phone)
 
 class PasswordSecurity:
     """Password hashing and validation"""
     
     @staticmethod
     def hash_password(password: str) -> str:
-        """Hash password using bcrypt"""
-        from passlib.context import CryptContext
+        """Hash password using bcrypt (synchronous; async code should await the shared hasher)"""
+        from utils.passwords import get_shared_hasher
         
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        return pwd_context.hash(password)
+        return get_shared_hasher().context.hash(password)
     
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         """Verify password against hash"""
-        from passlib.context import CryptContext
+        from utils.passwords import get_shared_hasher
         
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-        return pwd_context.verify(plain_password, hashed_password)
+        return get_shared_hasher().context.verify(plain_password, hashed_password)
     
     @staticmethod
     def validate_password_strength(password: str) -> bool:
@@ -199,4 +211,40 @@ class PasswordSecurity:
         return True
 
 # Create global security instance
-security = SecurityMiddleware()
\ No newline at end of file
+security = SecurityMiddleware()
+
+async def _benchmark(requests: int):
+    import time
+    from starlette.applications import Starlette
+    from starlette.responses import PlainTextResponse
+    from starlette.routing import Route
+
+    async def ok(request):
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/", ok)])
+    security = SecurityMiddleware()
+    security.limiter = RateLimiter(per_minute=10**9)
+    scope = {"type": "http", "method": "GET", "path": "/", "raw_path": b"/", "root_path": "", "scheme": "http",
+             "query_string": b"", "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 1234),
+             "server": ("localhost", 80), "http_version": "1.1", "asgi": {"version": "3.0"}}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    for name, stack in [("bare app", app), ("with security middleware", SecurityASGIMiddleware(app, security))]:
+        started_at = time.perf_counter()
+        for _ in range(requests):
+            await stack(dict(scope), receive, send)
+        elapsed = time.perf_counter() - started_at
+        print(f"{name}: {requests / elapsed:,.0f} req/s ({elapsed / requests * 1e6:.1f} us/req)")
+
+if __name__ == "__main__":
+    # python -m middleware.security [requests]; in-process ASGI throughput, no network
+    import asyncio
+    import sys
+
+    asyncio.run(_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000))
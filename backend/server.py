@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -6,13 +7,48 @@ from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import Annotated, List, Optional
+import re
+import json
 import uuid
 from datetime import datetime, timedelta
 
-# Password Hashing
-from passlib.context import CryptContext
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from config.production import ProductionConfig
+from utils.category_cache import CategoryCache
+from utils.indexes import (
+    BLOG_POST_LIST_SORT, ORDER_LIST_SORT, PRODUCT_LIST_SORT, PROJECT_LIST_SORT,
+    audit_indexes, ensure_indexes,
+)
+from utils.search_index import InvertedIndex
+from utils.facets import TTLCache, build_facet_pipeline, parse_facets
+from utils.bulk_io import batched, iter_csv, iter_ndjson, product_csv_header, product_csv_row
+from utils.streaming import DEFAULT_BATCH_SIZE, stream_cursor, wants_ndjson
+from utils.serialization import ModelSerializer
+from utils.pagination import NEXT_CURSOR_HEADER, apply_cursor, decode_cursor, next_cursor
+from utils.response_cache import ResponseCacheMiddleware, create_response_cache
+from utils.principal_cache import PrincipalCache
+from utils.login_guard import LoginGuard, LoginThrottled, client_ip
+from utils.tokens import ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE, RevocationList, session_revocation_key
+from utils.stock import InsufficientStock, ProductNotFound, StockLedger, merge_quantities
+from utils.reservations import StockReservations
+from utils.payment_gateways import (
+    FLUTTERWAVE_BASE_URL as DEFAULT_FLUTTERWAVE_BASE_URL, PAYSTACK_BASE_URL as DEFAULT_PAYSTACK_BASE_URL,
+    FlutterwaveClient, GatewayClient, GatewayError, PaystackClient, create_http_client,
+)
+from utils.payment_events import PaymentEventQueue
+from utils.reconciliation import PaymentReconciler
+from utils.idempotency import (
+    IDEMPOTENCY_KEY_HEADER, NOT_REPLAYABLE_HEADERS, IdempotencyInFlight, IdempotencyKeyInvalid, IdempotencyKeyReused,
+    IdempotencyStore, request_fingerprint,
+)
+from utils.validation import Email, LowercaseEmail, Message, Name, Phone, ShortText, sanitize_records
+from utils.passwords import (
+    DEFAULT_CONCURRENCY as DEFAULT_PASSWORD_HASH_CONCURRENCY, PasswordHasher, PasswordHasherBusy, set_shared_hasher,
+)
 
 # JWT
 from jose import JWTError, jwt
@@ -26,16 +62,61 @@ DB_NAME = os.environ['DB_NAME']
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', "default_super_secret_key_for_dev_only") # Use a strong key in .env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', "14"))
+REFRESH_TOKEN_REUSE_GRACE = int(os.environ.get('REFRESH_TOKEN_REUSE_GRACE', "30")) # Seconds a rotated-out refresh token still gets its successor
+CATEGORY_CACHE_TTL = int(os.environ.get('CATEGORY_CACHE_TTL', "300")) # Seconds
+PRODUCT_SEARCH_ENGINE = os.environ.get('PRODUCT_SEARCH_ENGINE', "text") # text, memory or regex
+PRODUCT_FACET_CACHE_TTL = int(os.environ.get('PRODUCT_FACET_CACHE_TTL', "60")) # Seconds
+PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY', str(DEFAULT_PASSWORD_HASH_CONCURRENCY))) # bcrypt worker threads
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', "30")) # Seconds
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', "100")) # Waiting calls before 503
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', "250")) # bcrypt cost is calibrated to this at startup
+PASSWORD_HASH_ROUNDS = os.environ.get('PASSWORD_HASH_ROUNDS') # Pin the bcrypt cost instead of calibrating
+LOGIN_FAILURES_PER_IP = int(os.environ.get('LOGIN_FAILURES_PER_IP', "50")) # Per LOGIN_FAILURE_WINDOW
+LOGIN_FAILURES_PER_ACCOUNT = int(os.environ.get('LOGIN_FAILURES_PER_ACCOUNT', "10")) # Per LOGIN_FAILURE_WINDOW
+LOGIN_FAILURE_WINDOW = int(os.environ.get('LOGIN_FAILURE_WINDOW', "900")) # Seconds
+STOCK_RESERVATION_TTL = int(os.environ.get('STOCK_RESERVATION_TTL', "1800")) # Seconds an unpaid order holds its stock
+STOCK_RESERVATION_SWEEP_INTERVAL = int(os.environ.get('STOCK_RESERVATION_SWEEP_INTERVAL', "30")) # Seconds
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', "86400")) # Seconds a response is replayed for
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.environ.get('IDEMPOTENCY_WAIT_TIMEOUT', "10")) # Seconds a duplicate waits for the first request
 
 # MongoDB connection
 client = AsyncIOMotorClient(MONGO_URL)
 db = client[DB_NAME]
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Response cache for anonymous catalog GETs, purged per namespace on writes. Purges only
+# reach every worker through Redis; the in-memory fallback keeps entries for seconds.
+response_cache = create_response_cache(
+    ProductionConfig.REDIS_URL,
+    ttl=ProductionConfig.CACHE_TTL,
+    prefixes={"/api/products": "products", "/api/blog": "blog", "/api/projects": "projects"},
+)
+
+# Password hashing; bcrypt runs in the hasher's thread pool, off the event loop
+password_hasher = PasswordHasher(concurrency=PASSWORD_HASH_CONCURRENCY, max_queue=PASSWORD_HASH_MAX_QUEUE)
+set_shared_hasher(password_hasher)
+# Failed-login counters checked before any bcrypt work is spent on an attempt
+login_guard = LoginGuard(ip_limit=LOGIN_FAILURES_PER_IP, account_limit=LOGIN_FAILURES_PER_ACCOUNT,
+                         window=LOGIN_FAILURE_WINDOW)
 
 # OAuth2 Scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login") # Adjusted to match frontend
+# Verified tokens -> user snapshot, so authenticated requests skip jwt.decode and the users lookup
+principal_cache = PrincipalCache(ttl=PRINCIPAL_CACHE_TTL)
+# Revoked token IDs and sessions, mirrored in memory on every worker
+revoked_tokens = RevocationList(db.revoked_tokens)
+# Responses of retried order/payment requests, keyed by the client's Idempotency-Key
+idempotency_store = IdempotencyStore(db.idempotency_keys, ttl=IDEMPOTENCY_KEY_TTL, wait_timeout=IDEMPOTENCY_WAIT_TIMEOUT)
+
+async def run_idempotent(idempotency_key: Optional[str], scope: str, principal_id, body: BaseModel, handler):
+    # Keys are scoped per user and endpoint, so one client can't replay another's response
+    try:
+        return await idempotency_store.run(idempotency_key, f"{principal_id}:{scope}", request_fingerprint(body), handler)
+    except (IdempotencyKeyInvalid, IdempotencyKeyReused) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except IdempotencyInFlight as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
 
 # Create the main app without a prefix
 app = FastAPI(title="EINSPOT API", version="1.0.0")
@@ -64,7 +145,7 @@ class PyObjectId(uuid.UUID):
 
 
 class UserBase(BaseModel):
-    email: EmailStr
+    email: Annotated[EmailStr, LowercaseEmail] # Lowercased, like the login lookup
     firstName: Optional[str] = None
     lastName: Optional[str] = None
     # Add other fields as per your frontend's registration form
@@ -77,6 +158,7 @@ class UserInDB(UserBase):
     hashed_password: str
     disabled: Optional[bool] = False
     isAdmin: Optional[bool] = Field(default=False) # New admin field
+    token_version: int = 0 # Bumped to revoke every token issued so far
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
@@ -107,36 +189,111 @@ class UserPublic(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
     user: UserPublic # Include user details in the token response
 
 class TokenData(BaseModel):
     email: Optional[str] = None
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
-# --- Utility Functions ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+class Principal(BaseModel):
+    """The caller as described by their access token's claims, without a database lookup"""
+    id: PyObjectId
+    email: EmailStr
+    isAdmin: bool = False
+    disabled: bool = False
+    token_version: int = 0
+
+user_public_serializer = ModelSerializer(UserPublic)
+token_serializer = ModelSerializer(Token)
+
+
+# --- Utility Functions ---
+async def verify_password(plain_password, hashed_password):
+    """Returns (verified, replacement hash if the stored one is below the current bcrypt cost)"""
+    try:
+        if hashed_password is None:
+            # Unknown account: spend the same bcrypt cost so timing doesn't reveal which emails exist
+            return await password_hasher.verify_dummy(plain_password), None
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many sign-in attempts in progress, please retry", headers={"Retry-After": "1"})
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many sign-in attempts in progress, please retry", headers={"Retry-After": "1"})
 
 async def get_user_by_email(email: EmailStr) -> Optional[UserInDB]:
-    user_doc = await db.users.find_one({"email": email})
+    # Emails are stored lowercased (see lowercase_user_emails for older accounts)
+    user_doc = await db.users.find_one({"email": email.lower()})
     if user_doc:
         return UserInDB(**user_doc)
     return None
 
+async def lowercase_user_emails() -> int:
+    """Lowercase emails stored with their original case before logins became case-insensitive
+
+    Returns how many accounts changed. An account whose lowercased email already
+    belongs to another account is left as it is and logged for a manual merge.
+    """
+    changed = 0
+    async for user_doc in db.users.find({"email": {"$regex": "[A-Z]"}}, {"email": 1}):
+        email = user_doc["email"].lower()
+        if await db.users.find_one({"email": email, "_id": {"$ne": user_doc["_id"]}}, {"_id": 1}):
+            logger.error(f"Not lowercasing the email of user {user_doc['_id']}: {email} belongs to another account")
+            continue
+        try:
+            await db.users.update_one({"_id": user_doc["_id"]}, {"$set": {"email": email, "updatedAt": datetime.utcnow()}})
+        except DuplicateKeyError:
+            # Registered by another request since the check above
+            logger.error(f"Not lowercasing the email of user {user_doc['_id']}: {email} belongs to another account")
+            continue
+        changed += 1
+    return changed
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.setdefault("type", ACCESS_TOKEN_TYPE)
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
+def user_claims(user: UserInDB) -> dict:
+    # Enough for authorization without a users lookup; stale claims are cut off by revocation
+    return {
+        "sub": user.email,
+        "uid": str(user.id),
+        "adm": bool(user.isAdmin),
+        "dis": bool(user.disabled),
+        "ver": user.token_version,
+    }
+
+def issue_tokens(user: UserInDB) -> dict:
+    claims = user_claims(user)
+    return {
+        "access_token": create_access_token(claims, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "refresh_token": create_access_token({**claims, "type": REFRESH_TOKEN_TYPE},
+                                             timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)),
+        "token_type": "bearer",
+        "user": user.model_dump(by_alias=True),
+    }
+
+def decode_token(token: str, token_type: str = ACCESS_TOKEN_TYPE) -> dict:
+    """Verify signature, expiry, type and revocation; raises 401 otherwise"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -144,17 +301,92 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
     )
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
+    if payload.get("sub") is None or payload.get("type", ACCESS_TOKEN_TYPE) != token_type:
+        raise credentials_exception
+    if is_token_revoked(payload):
+        raise credentials_exception
+    return payload
+
+def is_token_revoked(payload: dict) -> bool:
+    session_key = None
+    if "uid" in payload:
+        session_key = session_revocation_key(payload["uid"], payload.get("ver", 0))
+    return revoked_tokens.is_revoked(payload.get("jti"), session_key)
+
+async def revoke_token(payload: dict):
+    if payload.get("jti"):
+        await revoked_tokens.revoke(payload["jti"], datetime.utcfromtimestamp(payload["exp"]))
+
+async def rotate_refresh_token(payload: dict, user: UserInDB, rotated: bool) -> Optional[dict]:
+    """Exchange a refresh token for a new pair; None if it was rotated out before the grace window
+
+    A client whose refresh response was lost (e.g. a network timeout) retries with the same
+    token; within REFRESH_TOKEN_REUSE_GRACE it gets the same successor pair back instead of
+    tripping reuse detection. Concurrent refreshes with one token also share one successor.
+    """
+    if not rotated:
+        tokens = issue_tokens(user)
+        try:
+            await db.refresh_rotations.insert_one({
+                "_id": payload["jti"],
+                "access_token": tokens["access_token"],
+                "refresh_token": tokens["refresh_token"],
+                "expiresAt": datetime.utcnow() + timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE),
+            })
+        except DuplicateKeyError:
+            pass # Rotated meanwhile by another request or worker
+        else:
+            await revoke_token(payload)
+            return tokens
+
+    rotation = await db.refresh_rotations.find_one({"_id": payload["jti"], "expiresAt": {"$gt": datetime.utcnow()}})
+    if rotation is None:
+        return None
+    return {
+        "access_token": rotation["access_token"],
+        "refresh_token": rotation["refresh_token"],
+        "token_type": "bearer",
+        "user": user.model_dump(by_alias=True),
+    }
+
+async def revoke_user_sessions(user: UserInDB):
+    """Invalidate every access and refresh token issued to a user so far"""
+    await db.users.update_one({"_id": user.id}, {"$inc": {"token_version": 1}, "$set": {"updatedAt": datetime.utcnow()}})
+    # Refresh tokens are the longest-lived tokens that can carry the old version
+    await revoked_tokens.revoke(session_revocation_key(user.id, user.token_version),
+                                datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    principal_cache.invalidate_user(user.email)
+
+def paginated_filter(query_filter: dict, sort: list, after: Optional[str]) -> dict:
+    # Keyset pagination: `after` is an opaque token for the last item of the previous page
+    try:
+        return apply_cursor(query_filter, sort, after)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+def next_cursor_headers(documents: List[dict], sort: list, limit: int) -> dict:
+    token = next_cursor(documents, sort, limit)
+    return {NEXT_CURSOR_HEADER: token} if token else {}
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
+    cached = principal_cache.get(token)
+    if cached and not is_token_revoked(cached[0]):
+        return cached[1]
+
+    payload = decode_token(token)
+    token_data = TokenData(email=payload["sub"])
     user = await get_user_by_email(email=token_data.email)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     if user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
+    principal_cache.set(token, payload, user, user.email)
     return user
 
 async def get_current_active_user(current_user: UserInDB = Depends(get_current_user)):
@@ -162,7 +394,23 @@ async def get_current_active_user(current_user: UserInDB = Depends(get_current_u
     # get_current_user already checks for disabled status.
     return current_user
 
-async def get_current_admin_user(current_user: UserInDB = Depends(get_current_active_user)):
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    # Authorizes from the token's claims alone; use get_current_user when the full record is needed
+    payload = decode_token(token)
+    if "uid" not in payload:
+        # Issued before claims were embedded; the client must log in or refresh again
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    principal = Principal(id=payload["uid"], email=payload["sub"], isAdmin=payload.get("adm", False),
+                          disabled=payload.get("dis", False), token_version=payload.get("ver", 0))
+    if principal.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return principal
+
+async def get_current_admin_user(current_user: Principal = Depends(get_current_principal)):
     if not current_user.isAdmin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -182,50 +430,108 @@ async def register_user(user_in: UserCreate):
             detail="Email already registered"
         )
 
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await get_password_hash(user_in.password)
     user_db_data = user_in.model_dump(exclude={"password"})
     user_db_data["_id"] = uuid.uuid4() # Ensure _id is a UUID
     user_db_data["hashed_password"] = hashed_password
 
     new_user = UserInDB(**user_db_data)
 
-    await db.users.insert_one(new_user.model_dump(by_alias=True))
+    user_doc = new_user.model_dump(by_alias=True)
+    await db.users.insert_one(user_doc)
 
-    # Prepare public user data for response, ensuring _id is correctly aliased
-    public_user_data = new_user.model_dump(exclude={"hashed_password", "disabled"})
-    public_user_data["id"] = public_user_data.pop("_id") # Ensure 'id' is the key in response
-    return UserPublic(**public_user_data)
+    # UserPublic ignores hashed_password/disabled; _id maps to the aliased id field
+    return user_public_serializer.response(user_doc, status_code=status.HTTP_201_CREATED)
 
 
 @auth_router.post("/login", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await get_user_by_email(EmailStr(form_data.username)) # FastAPI OAuth2PasswordRequestForm uses 'username'
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    ip = client_ip(request)
+    # FastAPI OAuth2PasswordRequestForm uses 'username'; emails are stored lowercased
+    email = form_data.username.strip().lower()
+    try:
+        await login_guard.check(ip, email)
+    except LoginThrottled as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+
+    try:
+        user = await get_user_by_email(email)
+        verified, new_hash = await verify_password(form_data.password, user.hashed_password if user else None)
+    except BaseException:
+        # No verdict (e.g. the hashing pool was full); don't leave the attempt counted as in flight
+        login_guard.release(ip, email)
+        raise
+    if not verified:
+        login_guard.record_failure(ip, email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    login_guard.record_success(ip, email)
     if user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
+    if new_hash:
+        # Stored hash predates the current bcrypt cost; upgrade it while we have the plaintext
+        await db.users.update_one(
+            {"_id": user.id, "hashed_password": user.hashed_password},
+            {"$set": {"hashed_password": new_hash, "updatedAt": datetime.utcnow()}},
+        )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+    return token_serializer.response(issue_tokens(user))
+
+@auth_router.post("/refresh", response_model=Token)
+async def refresh_access_token(refresh_in: RefreshTokenRequest):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
     )
+    try:
+        payload = jwt.decode(refresh_in.refresh_token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("type") != REFRESH_TOKEN_TYPE or "uid" not in payload:
+        raise credentials_exception
+
+    user = await get_user_by_email(payload["sub"])
+    if user is None or str(user.id) != payload["uid"] or payload.get("ver") != user.token_version:
+        raise credentials_exception
+    rotated = revoked_tokens.is_revoked(payload.get("jti"))
+    if not rotated and is_token_revoked(payload):
+        raise credentials_exception
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
 
-    # Prepare public user data for response
-    public_user_data = user.model_dump(exclude={"hashed_password", "disabled"})
-    public_user_data["id"] = public_user_data.pop("_id")
-    user_public_info = UserPublic(**public_user_data)
+    # Rotation: each refresh token is single-use, apart from retries within the grace window
+    tokens = await rotate_refresh_token(payload, user, rotated)
+    if tokens is None:
+        # A rotated-out refresh token was replayed, so it may have leaked; end every session
+        logger.warning(f"Refresh token reuse detected for {user.email}")
+        await revoke_user_sessions(user)
+        raise credentials_exception
+    return token_serializer.response(tokens)
 
-    return {"access_token": access_token, "token_type": "bearer", "user": user_public_info}
+@auth_router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(logout_in: Optional[LogoutRequest] = None, token: str = Depends(oauth2_scheme)):
+    payload = decode_token(token)
+    await revoke_token(payload)
+    if logout_in and logout_in.refresh_token:
+        try:
+            refresh_payload = decode_token(logout_in.refresh_token, REFRESH_TOKEN_TYPE)
+        except HTTPException:
+            return # Already expired or revoked
+        if refresh_payload["sub"] == payload["sub"]:
+            await revoke_token(refresh_payload)
+
+@auth_router.post("/logout-all", status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(current_user: UserInDB = Depends(get_current_active_user)):
+    await revoke_user_sessions(current_user)
 
 @auth_router.get("/me", response_model=UserPublic)
 async def read_users_me(current_user: UserInDB = Depends(get_current_active_user)):
-    public_user_data = current_user.model_dump(exclude={"hashed_password", "disabled"})
-    public_user_data["id"] = public_user_data.pop("_id")
-    return UserPublic(**public_user_data)
+    return user_public_serializer.response(current_user.model_dump(by_alias=True))
 
 # Include auth router in the main API router
 api_router.include_router(auth_router)
@@ -254,6 +560,9 @@ class CategoryInDB(CategoryBase):
 class CategoryPublic(CategoryInDB): # For now, public is same as InDB
     pass
 
+# Cached batch resolver shared by every endpoint that populates ProductPublic.category
+product_category_resolver = CategoryCache(db.categories, CategoryPublic, ttl=CATEGORY_CACHE_TTL)
+
 
 class ProductBase(BaseModel):
     name: str
@@ -285,6 +594,47 @@ class ProductPublic(ProductInDB): # For now, public is same as InDB, can be cust
         json_encoders = {PyObjectId: str, datetime: lambda dt: dt.isoformat()}
         arbitrary_types_allowed = True
 
+class ProductSearchResult(ProductPublic):
+    score: Optional[float] = None # Relevance score, None when no query was given
+
+class CategoryFacet(BaseModel):
+    category_id: Optional[PyObjectId] = None # None counts uncategorized products
+    name: Optional[str] = None
+    count: int
+
+class PriceBucketFacet(BaseModel):
+    min: float
+    max: Optional[float] = None # None for the open-ended top bucket
+    count: int
+
+class AvailabilityFacet(BaseModel):
+    in_stock: int = 0
+    out_of_stock: int = 0
+
+class ProductFacets(BaseModel):
+    categories: List[CategoryFacet] = []
+    price: List[PriceBucketFacet] = []
+    availability: AvailabilityFacet = AvailabilityFacet()
+
+class FacetedSearchResponse(BaseModel):
+    hits: List[ProductSearchResult]
+    total: int
+    facets: ProductFacets
+
+category_public_serializer = ModelSerializer(CategoryPublic)
+product_public_serializer = ModelSerializer(ProductPublic)
+product_search_serializer = ModelSerializer(ProductSearchResult)
+faceted_search_serializer = ModelSerializer(FacetedSearchResponse)
+
+# Facets only depend on the query text, so they are cached per normalized query
+product_facet_cache = TTLCache(ttl=PRODUCT_FACET_CACHE_TTL)
+
+# Keyset sort for ranked search results (list sorts live with their indexes in utils.indexes)
+PRODUCT_SEARCH_SORT = [("score", -1), ("_id", -1)]
+
+# Optional in-memory search index, used when PRODUCT_SEARCH_ENGINE=memory
+product_search_index = InvertedIndex()
+
 
 # --- Products and Categories Routes ---
 products_router = APIRouter(prefix="/products", tags=["Products & Categories"])
@@ -296,17 +646,16 @@ async def create_category(category_in: CategoryCreate, current_user: UserInDB =
     category_doc["_id"] = uuid.uuid4()
 
     new_category = CategoryInDB(**category_doc)
-    await db.categories.insert_one(new_category.model_dump(by_alias=True))
+    new_category_doc = new_category.model_dump(by_alias=True)
+    await db.categories.insert_one(new_category_doc)
+    product_category_resolver.invalidate()
+    await response_cache.purge("products")
 
-    public_category_data = new_category.model_dump()
-    public_category_data["id"] = public_category_data.pop("_id")
-    return CategoryPublic(**public_category_data)
+    return category_public_serializer.response(new_category_doc, status_code=status.HTTP_201_CREATED)
 
 @products_router.get("/categories", response_model=List[CategoryPublic])
 async def get_all_categories():
-    categories_cursor = db.categories.find()
-    categories_list = await categories_cursor.to_list(length=1000) # Adjust length as needed
-    return [CategoryPublic(**{**cat, "id": cat["_id"]}) for cat in categories_list]
+    return await product_category_resolver.get_all()
 
 # Product Endpoints
 @products_router.post("/", response_model=ProductPublic, status_code=status.HTTP_201_CREATED)
@@ -315,38 +664,33 @@ async def create_product(product_in: ProductCreate, current_user: UserInDB = Dep
     product_doc["_id"] = uuid.uuid4()
     # product_doc["owner_id"] = current_user.id # If linking product to user
 
+    category = None
     if product_in.category_id:
-        category = await db.categories.find_one({"_id": product_in.category_id})
+        category = await product_category_resolver.get(product_in.category_id)
         if not category:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
     new_product = ProductInDB(**product_doc)
-    await db.products.insert_one(new_product.model_dump(by_alias=True))
+    new_product_doc = new_product.model_dump(by_alias=True)
+    await db.products.insert_one(new_product_doc)
+    if PRODUCT_SEARCH_ENGINE == "memory":
+        product_search_index.upsert(new_product_doc)
+    product_facet_cache.clear()
+    await response_cache.purge("products")
 
-    # Prepare public product data
-    public_product_data = new_product.model_dump()
-    public_product_data["id"] = public_product_data.pop("_id")
-    if new_product.category_id:
-        category_data = await db.categories.find_one({"_id": new_product.category_id})
-        if category_data:
-             public_product_data["category"] = CategoryPublic(**{**category_data, "id": category_data["_id"]})
-
-    return ProductPublic(**public_product_data)
+    # Reuse the category resolved above
+    return product_public_serializer.response({**new_product_doc, "category": category}, status_code=status.HTTP_201_CREATED)
 
 @products_router.get("/", response_model=List[ProductPublic])
-async def get_all_products(skip: int = 0, limit: int = 100): # Basic pagination
-    products_cursor = db.products.find().skip(skip).limit(limit)
+async def get_all_products(skip: int = 0, limit: int = 100, after: Optional[str] = None): # skip kept for backward compatibility
+    query_filter = paginated_filter({}, PRODUCT_LIST_SORT, after)
+    products_cursor = db.products.find(query_filter).sort(PRODUCT_LIST_SORT).skip(0 if after else skip).limit(limit)
     products_list = await products_cursor.to_list(length=limit)
 
-    populated_products = []
-    for prod_data in products_list:
-        prod_data["id"] = prod_data["_id"]
-        if prod_data.get("category_id"):
-            category_data = await db.categories.find_one({"_id": prod_data["category_id"]})
-            if category_data:
-                prod_data["category"] = CategoryPublic(**{**category_data, "id": category_data["_id"]})
-        populated_products.append(ProductPublic(**prod_data))
-    return populated_products
+    await product_category_resolver.populate(products_list)
+    return product_public_serializer.response_many(
+        products_list, headers=next_cursor_headers(products_list, PRODUCT_LIST_SORT, limit)
+    )
 
 @products_router.get("/{product_id}", response_model=ProductPublic)
 async def get_product_by_id(product_id: PyObjectId):
@@ -354,29 +698,64 @@ async def get_product_by_id(product_id: PyObjectId):
     if not product_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-    product_data["id"] = product_data["_id"]
-    if product_data.get("category_id"):
-        category_data = await db.categories.find_one({"_id": product_data["category_id"]})
-        if category_data:
-            product_data["category"] = CategoryPublic(**{**category_data, "id": category_data["_id"]})
-
-    return ProductPublic(**product_data)
-
-
-# TODO: Implement search endpoint /products/search as per frontend api.js
-@products_router.get("/search/", response_model=List[ProductPublic]) # Changed path to end with /
-async def search_products(q: Optional[str] = None, category: Optional[str] = None, skip: int = 0, limit: int = 20):
+    await product_category_resolver.populate([product_data])
+    return product_public_serializer.response(product_data)
+
+
+async def _search_products_text(q: str, query_filter: dict, skip: int, limit: int, after: Optional[str] = None) -> List[dict]:
+    # Uses the name/description text index; results are ranked by textScore
+    pipeline = [
+        {"$match": {**query_filter, "$text": {"$search": q}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if after:
+        pipeline.append({"$match": paginated_filter({}, PRODUCT_SEARCH_SORT, after)})
+    pipeline += [
+        {"$sort": dict(PRODUCT_SEARCH_SORT)},
+        {"$skip": 0 if after else skip},
+        {"$limit": limit},
+    ]
+    return await db.products.aggregate(pipeline).to_list(length=limit)
+
+async def _search_products_memory(q: str, query_filter: dict, skip: int, limit: int, after: Optional[str] = None) -> List[dict]:
+    await product_search_index.sync(db.products)
+    if after:
+        try:
+            after_score, after_id = decode_cursor(after)
+            # Same (-score, id) ordering the index ranks by
+            after_key = (-float(after_score), str(after_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+        ranked = product_search_index.search(q, category_id=query_filter.get("category_id"))
+        ranked = [item for item in ranked if (-item[1], str(item[0])) > after_key][:limit]
+    else:
+        ranked = product_search_index.search(q, category_id=query_filter.get("category_id"), limit=skip + limit)[skip:]
+    if not ranked:
+        return []
+    products_list = await db.products.find({"_id": {"$in": [doc_id for doc_id, _ in ranked]}}).to_list(length=limit)
+    products_by_id = {prod["_id"]: prod for prod in products_list}
+    # Products deleted by another worker drop out here
+    return [
+        {**products_by_id[doc_id], "score": score}
+        for doc_id, score in ranked if doc_id in products_by_id
+    ]
+
+def _product_regex_match(q: str) -> dict:
+    # Unindexed fallback: case-insensitive substring match on name and description
+    pattern = re.escape(q)
+    return {"$or": [
+        {"name": {"$regex": pattern, "$options": "i"}},
+        {"description": {"$regex": pattern, "$options": "i"}}
+    ]}
+
+async def _search_products_regex(q: str, query_filter: dict, skip: int, limit: int, after: Optional[str] = None) -> List[dict]:
+    regex_filter = paginated_filter({**query_filter, **_product_regex_match(q)}, PRODUCT_LIST_SORT, after)
+    products_cursor = db.products.find(regex_filter).sort(PRODUCT_LIST_SORT).skip(0 if after else skip).limit(limit)
+    return await products_cursor.to_list(length=limit)
+
+@products_router.get("/search/", response_model=List[ProductSearchResult]) # Changed path to end with /
+async def search_products(q: Optional[str] = None, category: Optional[str] = None, skip: int = 0, limit: int = 20, after: Optional[str] = None):
     query_filter = {}
-    if q:
-        # Using regex for a simple case-insensitive partial match on name and description
-        # For more advanced search, MongoDB's $text operator and text indexes are better.
-        # This requires creating a text index e.g., db.products.create_index([("name", "text"), ("description", "text")])
-        # query_filter["$text"] = {"$search": q}
-        query_filter["$or"] = [
-            {"name": {"$regex": q, "$options": "i"}},
-            {"description": {"$regex": q, "$options": "i"}}
-        ]
-
     if category:
         # Assuming category is passed as ID string, convert to PyObjectId
         try:
@@ -388,18 +767,90 @@ async def search_products(q: Optional[str] = None, category: Optional[str] = Non
             # For simplicity, we'll assume ID is passed or ignore if invalid.
             pass
 
-    products_cursor = db.products.find(query_filter).skip(skip).limit(limit)
-    products_list = await products_cursor.to_list(length=limit)
+    q = q.strip() if q else None
+    sort = PRODUCT_SEARCH_SORT
+    if not q:
+        sort = PRODUCT_LIST_SORT
+        products_cursor = db.products.find(paginated_filter(query_filter, sort, after)).sort(sort).skip(0 if after else skip).limit(limit)
+        products_list = await products_cursor.to_list(length=limit)
+    elif PRODUCT_SEARCH_ENGINE == "memory":
+        products_list = await _search_products_memory(q, query_filter, skip, limit, after)
+    elif PRODUCT_SEARCH_ENGINE == "regex":
+        sort = PRODUCT_LIST_SORT
+        products_list = await _search_products_regex(q, query_filter, skip, limit, after)
+    else:
+        try:
+            products_list = await _search_products_text(q, query_filter, skip, limit, after)
+        except OperationFailure as e:
+            logger.warning(f"Text search failed, falling back to regex search: {e}")
+            sort = PRODUCT_LIST_SORT
+            products_list = await _search_products_regex(q, query_filter, skip, limit, after)
+
+    await product_category_resolver.populate(products_list)
+    return product_search_serializer.response_many(products_list, headers=next_cursor_headers(products_list, sort, limit))
+
+@products_router.get("/search/facets", response_model=FacetedSearchResponse)
+async def search_products_faceted(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock: Optional[bool] = None,
+    skip: int = 0,
+    limit: int = 20,
+):
+    q = q.strip() if q else None
+    text_score = bool(q) and PRODUCT_SEARCH_ENGINE != "regex"
+    if not q:
+        base_match, sort = {}, PRODUCT_LIST_SORT
+    elif text_score:
+        base_match, sort = {"$text": {"$search": q}}, PRODUCT_SEARCH_SORT
+    else:
+        base_match, sort = _product_regex_match(q), PRODUCT_LIST_SORT
 
-    populated_products = []
-    for prod_data in products_list:
-        prod_data["id"] = prod_data["_id"]
-        if prod_data.get("category_id"):
-            category_data = await db.categories.find_one({"_id": prod_data["category_id"]})
-            if category_data:
-                prod_data["category"] = CategoryPublic(**{**category_data, "id": category_data["_id"]})
-        populated_products.append(ProductPublic(**prod_data))
-    return populated_products
+    refinements = {}
+    if category:
+        try:
+            refinements["category_id"] = PyObjectId.validate(category, None)
+        except ValueError:
+            pass # Same leniency as search_products
+    price_range = {}
+    if min_price is not None:
+        price_range["$gte"] = min_price
+    if max_price is not None:
+        price_range["$lt"] = max_price
+    if price_range:
+        refinements["price"] = price_range
+    if in_stock is not None:
+        refinements["stock_quantity"] = {"$gt": 0} if in_stock else 0
+
+    facet_key = " ".join(q.lower().split()) if q else ""
+    facets = product_facet_cache.get(facet_key)
+    pipeline = build_facet_pipeline(base_match, refinements, sort, skip, limit, text_score, include_facets=facets is None)
+    try:
+        results = await db.products.aggregate(pipeline).to_list(length=1)
+    except OperationFailure as e:
+        if not text_score:
+            raise
+        # Same fallback as search_products, e.g. while the text index is missing
+        logger.warning(f"Text search failed, falling back to regex search: {e}")
+        text_score, base_match, sort = False, _product_regex_match(q), PRODUCT_LIST_SORT
+        pipeline = build_facet_pipeline(base_match, refinements, sort, skip, limit, text_score, include_facets=facets is None)
+        results = await db.products.aggregate(pipeline).to_list(length=1)
+    result = results[0] if results else {}
+
+    if facets is None:
+        facets = parse_facets(result)
+        categories = await product_category_resolver.resolve(facet["category_id"] for facet in facets["categories"])
+        for facet in facets["categories"]:
+            category_public = categories.get(facet["category_id"])
+            facet["name"] = category_public.name if category_public else None
+        product_facet_cache.set(facet_key, facets)
+
+    hits = result.get("hits", [])
+    await product_category_resolver.populate(hits)
+    total = result["total"][0]["count"] if result.get("total") else 0
+    return faceted_search_serializer.response({"hits": hits, "total": total, "facets": facets})
 
 api_router.include_router(products_router)
 
@@ -433,6 +884,8 @@ class OrderInDB(OrderBase):
     id: PyObjectId = Field(default_factory=uuid.uuid4, alias="_id")
     customer_id: PyObjectId
     items: List[OrderItemPublic] # Store resolved items
+    payment_reference: Optional[str] = None # Gateway reference of the last verification attempt
+    payment_provider: Optional[str] = None # paystack or flutterwave
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
@@ -444,24 +897,55 @@ class OrderInDB(OrderBase):
 class OrderPublic(OrderInDB): # For now, public is same as InDB
     pass
 
+order_public_serializer = ModelSerializer(OrderPublic)
+# Conditional stock decrements, in a transaction when the deployment supports them
+stock_ledger = StockLedger(client, db.products)
+
+async def cancel_unpaid_orders(order_ids: List[PyObjectId]):
+    # Their stock reservations expired; a late payment can still revive them
+    await db.orders.update_many(
+        {"_id": {"$in": order_ids}, "status": "pending", "payment_status": {"$ne": "paid"}},
+        {"$set": {"status": "cancelled", "updatedAt": datetime.utcnow()}},
+    )
+    # Released stock may put products back in stock
+    product_facet_cache.clear()
+    await response_cache.purge("products")
+
+# Unpaid orders hold their stock for STOCK_RESERVATION_TTL; the sweeper gives it back after
+stock_reservations = StockReservations(
+    stock_ledger, db.stock_reservations,
+    ttl=STOCK_RESERVATION_TTL,
+    sweep_interval=STOCK_RESERVATION_SWEEP_INTERVAL,
+    on_released=cancel_unpaid_orders,
+)
+
 
 # --- Orders Routes ---
 orders_router = APIRouter(prefix="/orders", tags=["Orders"])
 
 @orders_router.post("/", response_model=OrderPublic, status_code=status.HTTP_201_CREATED)
-async def create_order(order_in: OrderCreate, current_user: UserInDB = Depends(get_current_active_user)):
+async def create_order(order_in: OrderCreate, current_user: Principal = Depends(get_current_principal),
+                       idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER)):
+    # A retry with the same key gets the first response instead of placing a second order
+    return await run_idempotent(idempotency_key, "orders", current_user.id, order_in,
+                                lambda: _place_order(order_in, current_user))
+
+async def _place_order(order_in: OrderCreate, current_user: Principal):
     order_items_data = []
     calculated_total_amount = 0.0
 
-    for item_in in order_in.items:
-        product = await db.products.find_one({"_id": item_in.product_id})
-        if not product:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product with ID {item_in.product_id} not found.")
-
-        # Basic check for stock, can be more complex (e.g., decrement stock)
-        if product["stock_quantity"] < item_in.quantity:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Not enough stock for product {product['name']}.")
+    # Duplicate lines for one product are checked and decremented as a single quantity
+    quantities = merge_quantities((item_in.product_id, item_in.quantity) for item_in in order_in.items)
+    try:
+        products = await stock_ledger.load_products(quantities)
+        stock_ledger.check_available(products, quantities)
+    except ProductNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except InsufficientStock as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    for item_in in order_in.items:
+        product = products[item_in.product_id]
         item_data = item_in.model_dump()
         item_data["price_at_purchase"] = product["price"] # Use current product price
         order_items_data.append(OrderItemPublic(**item_data))
@@ -487,28 +971,35 @@ async def create_order(order_in: OrderCreate, current_user: UserInDB = Depends(g
     order_doc["total_amount"] = final_total_amount # Use server-calculated final total
 
     new_order = OrderInDB(**order_doc)
-    await db.orders.insert_one(new_order.model_dump(by_alias=True))
+    new_order_doc = new_order.model_dump(by_alias=True)
+
+    # The stock check above is advisory; the conditional decrement is what prevents overselling.
+    # The stock stays reserved until the order is paid or the reservation expires.
+    try:
+        await stock_reservations.reserve(
+            new_order.id, quantities,
+            lambda session: db.orders.insert_one(new_order_doc, session=session),
+        )
+    except InsufficientStock as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # TODO: Potentially decrement stock quantities here after successful order creation
-    # for item_in in order_in.items:
-    #     await db.products.update_one(
-    #         {"_id": item_in.product_id},
-    #         {"$inc": {"stock_quantity": -item_in.quantity}}
-    #     )
+    # Cached listings may now show a product as in stock that isn't
+    if any(products[product_id].get("stock_quantity", 0) <= quantity for product_id, quantity in quantities.items()):
+        product_facet_cache.clear()
+        await response_cache.purge("products")
 
-    public_order_data = new_order.model_dump()
-    public_order_data["id"] = public_order_data.pop("_id")
-    return OrderPublic(**public_order_data)
+    return order_public_serializer.response(new_order_doc, status_code=status.HTTP_201_CREATED)
 
 
 @orders_router.get("/my-orders", response_model=List[OrderPublic])
-async def get_my_orders(current_user: UserInDB = Depends(get_current_active_user), skip: int = 0, limit: int = 50):
-    orders_cursor = db.orders.find({"customer_id": current_user.id}).sort("createdAt", -1).skip(skip).limit(limit)
+async def get_my_orders(current_user: Principal = Depends(get_current_principal), skip: int = 0, limit: int = 50, after: Optional[str] = None):
+    query_filter = paginated_filter({"customer_id": current_user.id}, ORDER_LIST_SORT, after)
+    orders_cursor = db.orders.find(query_filter).sort(ORDER_LIST_SORT).skip(0 if after else skip).limit(limit)
     orders_list = await orders_cursor.to_list(length=limit)
-    return [OrderPublic(**{**order, "id": order["_id"]}) for order in orders_list]
+    return order_public_serializer.response_many(orders_list, headers=next_cursor_headers(orders_list, ORDER_LIST_SORT, limit))
 
 @orders_router.get("/{order_id}", response_model=OrderPublic)
-async def get_order_by_id_for_customer(order_id: PyObjectId, current_user: UserInDB = Depends(get_current_active_user)):
+async def get_order_by_id_for_customer(order_id: PyObjectId, current_user: Principal = Depends(get_current_principal)):
     order_data = await db.orders.find_one({"_id": order_id})
     if not order_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
@@ -517,8 +1008,7 @@ async def get_order_by_id_for_customer(order_id: PyObjectId, current_user: UserI
         # Basic ownership check. Admins might need different logic.
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this order")
 
-    order_data["id"] = order_data["_id"]
-    return OrderPublic(**order_data)
+    return order_public_serializer.response(order_data)
 
 api_router.include_router(orders_router)
 
@@ -541,12 +1031,15 @@ class ContactFormSubmission(BaseModel):
         arbitrary_types_allowed = True
 
 class ContactFormCreate(BaseModel):
-    name: str
-    email: EmailStr
-    phone: Optional[str] = None
-    company: Optional[str] = None
-    service: Optional[str] = None
-    message: str
+    # Sanitized (control characters stripped, lengths capped) before they reach Mongo
+    name: Name
+    email: Email
+    phone: Optional[Phone] = None
+    company: Optional[ShortText] = None
+    service: Optional[ShortText] = None
+    message: Message
+
+contact_submission_serializer = ModelSerializer(ContactFormSubmission)
 
 contact_router = APIRouter(tags=["Contact & Submissions"])
 
@@ -556,11 +1049,10 @@ async def submit_contact_form(form_data: ContactFormCreate):
     submission_data["_id"] = uuid.uuid4()
 
     new_submission = ContactFormSubmission(**submission_data)
-    await db.contact_submissions.insert_one(new_submission.model_dump(by_alias=True))
+    submission_doc = new_submission.model_dump(by_alias=True)
+    await db.contact_submissions.insert_one(submission_doc)
 
-    response_data = new_submission.model_dump()
-    response_data["id"] = response_data.pop("_id")
-    return ContactFormSubmission(**response_data)
+    return contact_submission_serializer.response(submission_doc, status_code=status.HTTP_201_CREATED)
 
 # Newsletter Subscription
 class NewsletterSubscription(BaseModel):
@@ -574,8 +1066,10 @@ class NewsletterSubscription(BaseModel):
         json_encoders = {PyObjectId: str, datetime: lambda dt: dt.isoformat()}
         arbitrary_types_allowed = True
 
+newsletter_subscription_serializer = ModelSerializer(NewsletterSubscription)
+
 class NewsletterSubscribeCreate(BaseModel):
-    email: EmailStr
+    email: Email
 
 @contact_router.post("/newsletter/subscribe", response_model=NewsletterSubscription, status_code=status.HTTP_201_CREATED)
 async def subscribe_to_newsletter(subscription_data: NewsletterSubscribeCreate):
@@ -588,17 +1082,15 @@ async def subscribe_to_newsletter(subscription_data: NewsletterSubscribeCreate):
                 {"$set": {"isActive": True, "updatedAt": datetime.utcnow()}}
             )
             existing_subscription["isActive"] = True # Ensure response reflects update
-        existing_subscription["id"] = existing_subscription.pop("_id")
-        return NewsletterSubscription(**existing_subscription)
+        return newsletter_subscription_serializer.response(existing_subscription, status_code=status.HTTP_201_CREATED)
 
     sub_doc = subscription_data.model_dump()
     sub_doc["_id"] = uuid.uuid4()
     new_subscription = NewsletterSubscription(**sub_doc)
-    await db.newsletter_subscriptions.insert_one(new_subscription.model_dump(by_alias=True))
+    new_subscription_doc = new_subscription.model_dump(by_alias=True)
+    await db.newsletter_subscriptions.insert_one(new_subscription_doc)
 
-    response_data = new_subscription.model_dump()
-    response_data["id"] = response_data.pop("_id")
-    return NewsletterSubscription(**response_data)
+    return newsletter_subscription_serializer.response(new_subscription_doc, status_code=status.HTTP_201_CREATED)
 
 # Quote Request
 class QuoteRequest(BaseModel):
@@ -621,27 +1113,28 @@ class QuoteRequest(BaseModel):
         arbitrary_types_allowed = True
 
 class QuoteRequestCreate(BaseModel):
-    name: str
-    email: EmailStr
-    phone: Optional[str] = None
-    company: Optional[str] = None
-    service_of_interest: Optional[str] = None
-    project_description: str
-    estimated_budget: Optional[str] = None
-    timeline: Optional[str] = None
+    name: Name
+    email: Email
+    phone: Optional[Phone] = None
+    company: Optional[ShortText] = None
+    service_of_interest: Optional[ShortText] = None
+    project_description: Message
+    estimated_budget: Optional[ShortText] = None
+    timeline: Optional[ShortText] = None
     # items: Optional[List[dict]] = None # If quote is from cart, define item structure
 
+quote_request_serializer = ModelSerializer(QuoteRequest)
+
 @contact_router.post("/quotes", response_model=QuoteRequest, status_code=status.HTTP_201_CREATED)
 async def submit_quote_request(quote_data: QuoteRequestCreate):
     quote_doc = quote_data.model_dump()
     quote_doc["_id"] = uuid.uuid4()
 
     new_quote_request = QuoteRequest(**quote_doc)
-    await db.quote_requests.insert_one(new_quote_request.model_dump(by_alias=True))
+    new_quote_doc = new_quote_request.model_dump(by_alias=True)
+    await db.quote_requests.insert_one(new_quote_doc)
 
-    response_data = new_quote_request.model_dump()
-    response_data["id"] = response_data.pop("_id")
-    return QuoteRequest(**response_data)
+    return quote_request_serializer.response(new_quote_doc, status_code=status.HTTP_201_CREATED)
 
 api_router.include_router(contact_router)
 
@@ -668,6 +1161,9 @@ class BlogCategoryInDB(BlogCategoryBase):
 class BlogCategoryPublic(BlogCategoryInDB):
     pass
 
+# Cached batch resolver shared by every endpoint that populates BlogPostPublic.category
+blog_category_resolver = CategoryCache(db.blog_categories, BlogCategoryPublic, ttl=CATEGORY_CACHE_TTL)
+
 # Blog Post
 class BlogPostBase(BaseModel):
     title: str
@@ -703,6 +1199,9 @@ class BlogPostPublic(BlogPostInDB):
         json_encoders = {PyObjectId: str, datetime: lambda dt: dt.isoformat()}
         arbitrary_types_allowed = True
 
+blog_category_public_serializer = ModelSerializer(BlogCategoryPublic)
+blog_post_public_serializer = ModelSerializer(BlogPostPublic)
+
 blog_router = APIRouter(prefix="/blog", tags=["Blog"])
 
 # Blog Category Endpoints
@@ -711,16 +1210,15 @@ async def create_blog_category(category_in: BlogCategoryCreate, current_user: Us
     category_doc = category_in.model_dump()
     category_doc["_id"] = uuid.uuid4()
     new_category = BlogCategoryInDB(**category_doc)
-    await db.blog_categories.insert_one(new_category.model_dump(by_alias=True))
-    public_data = new_category.model_dump()
-    public_data["id"] = public_data.pop("_id")
-    return BlogCategoryPublic(**public_data)
+    new_category_doc = new_category.model_dump(by_alias=True)
+    await db.blog_categories.insert_one(new_category_doc)
+    blog_category_resolver.invalidate()
+    await response_cache.purge("blog")
+    return blog_category_public_serializer.response(new_category_doc, status_code=status.HTTP_201_CREATED)
 
 @blog_router.get("/categories", response_model=List[BlogCategoryPublic])
 async def get_all_blog_categories():
-    categories_cursor = db.blog_categories.find()
-    categories_list = await categories_cursor.to_list(length=100)
-    return [BlogCategoryPublic(**{**cat, "id": cat["_id"]}) for cat in categories_list]
+    return await blog_category_resolver.get_all()
 
 # Blog Post Endpoints
 @blog_router.post("/", response_model=BlogPostPublic, status_code=status.HTTP_201_CREATED)
@@ -731,36 +1229,27 @@ async def create_blog_post(post_in: BlogPostCreate, current_user: UserInDB = Dep
     # Generate slug (simple version, can be more robust)
     post_doc["slug"] = post_in.title.lower().replace(" ", "-").replace("?", "").replace("!", "")
 
+    category = None
     if post_in.category_id:
-        category = await db.blog_categories.find_one({"_id": post_in.category_id})
+        category = await blog_category_resolver.get(post_in.category_id)
         if not category:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blog category not found")
 
     new_post = BlogPostInDB(**post_doc)
-    await db.blog_posts.insert_one(new_post.model_dump(by_alias=True))
+    new_post_doc = new_post.model_dump(by_alias=True)
+    await db.blog_posts.insert_one(new_post_doc)
+    await response_cache.purge("blog")
 
-    public_data = new_post.model_dump()
-    public_data["id"] = public_data.pop("_id")
-    if new_post.category_id:
-        cat_data = await db.blog_categories.find_one({"_id": new_post.category_id})
-        if cat_data:
-            public_data["category"] = BlogCategoryPublic(**{**cat_data, "id": cat_data["_id"]})
-    return BlogPostPublic(**public_data)
+    return blog_post_public_serializer.response({**new_post_doc, "category": category}, status_code=status.HTTP_201_CREATED)
 
 @blog_router.get("/", response_model=List[BlogPostPublic])
-async def get_all_blog_posts(skip: int = 0, limit: int = 20):
-    posts_cursor = db.blog_posts.find({"isPublished": True}).sort("publishedAt", -1).skip(skip).limit(limit)
+async def get_all_blog_posts(skip: int = 0, limit: int = 20, after: Optional[str] = None):
+    query_filter = paginated_filter({"isPublished": True}, BLOG_POST_LIST_SORT, after)
+    posts_cursor = db.blog_posts.find(query_filter).sort(BLOG_POST_LIST_SORT).skip(0 if after else skip).limit(limit)
     posts_list = await posts_cursor.to_list(length=limit)
 
-    populated_posts = []
-    for post_data in posts_list:
-        post_data["id"] = post_data["_id"]
-        if post_data.get("category_id"):
-            cat_data = await db.blog_categories.find_one({"_id": post_data["category_id"]})
-            if cat_data:
-                post_data["category"] = BlogCategoryPublic(**{**cat_data, "id": cat_data["_id"]})
-        populated_posts.append(BlogPostPublic(**post_data))
-    return populated_posts
+    await blog_category_resolver.populate(posts_list)
+    return blog_post_public_serializer.response_many(posts_list, headers=next_cursor_headers(posts_list, BLOG_POST_LIST_SORT, limit))
 
 @blog_router.get("/{post_id_or_slug}", response_model=BlogPostPublic) # Can be ID or slug
 async def get_blog_post_by_id_or_slug(post_id_or_slug: str):
@@ -776,13 +1265,8 @@ async def get_blog_post_by_id_or_slug(post_id_or_slug: str):
     if not post_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Blog post not found")
 
-    post_data["id"] = post_data["_id"]
-    if post_data.get("category_id"):
-        cat_data = await db.blog_categories.find_one({"_id": post_data["category_id"]})
-        if cat_data:
-            post_data["category"] = BlogCategoryPublic(**{**cat_data, "id": cat_data["_id"]})
-
-    return BlogPostPublic(**post_data)
+    await blog_category_resolver.populate([post_data])
+    return blog_post_public_serializer.response(post_data)
 
 api_router.include_router(blog_router)
 
@@ -815,6 +1299,8 @@ class ProjectInDB(ProjectBase):
 class ProjectPublic(ProjectInDB):
     pass
 
+project_public_serializer = ModelSerializer(ProjectPublic)
+
 projects_router = APIRouter(prefix="/projects", tags=["Projects"])
 
 @projects_router.post("/", response_model=ProjectPublic, status_code=status.HTTP_201_CREATED)
@@ -822,48 +1308,57 @@ async def create_project(project_in: ProjectCreate, current_user: UserInDB = Dep
     project_doc = project_in.model_dump()
     project_doc["_id"] = uuid.uuid4()
     new_project = ProjectInDB(**project_doc)
-    await db.projects.insert_one(new_project.model_dump(by_alias=True))
-    public_data = new_project.model_dump()
-    public_data["id"] = public_data.pop("_id")
-    return ProjectPublic(**public_data)
+    new_project_doc = new_project.model_dump(by_alias=True)
+    await db.projects.insert_one(new_project_doc)
+    await response_cache.purge("projects")
+    return project_public_serializer.response(new_project_doc, status_code=status.HTTP_201_CREATED)
 
 @projects_router.get("/", response_model=List[ProjectPublic])
-async def get_all_projects(skip: int = 0, limit: int = 20):
-    projects_cursor = db.projects.find().sort("createdAt", -1).skip(skip).limit(limit)
+async def get_all_projects(skip: int = 0, limit: int = 20, after: Optional[str] = None):
+    query_filter = paginated_filter({}, PROJECT_LIST_SORT, after)
+    projects_cursor = db.projects.find(query_filter).sort(PROJECT_LIST_SORT).skip(0 if after else skip).limit(limit)
     projects_list = await projects_cursor.to_list(length=limit)
-    return [ProjectPublic(**{**proj, "id": proj["_id"]}) for proj in projects_list]
+    return project_public_serializer.response_many(projects_list, headers=next_cursor_headers(projects_list, PROJECT_LIST_SORT, limit))
 
 @projects_router.get("/{project_id}", response_model=ProjectPublic)
 async def get_project_by_id(project_id: PyObjectId):
     project_data = await db.projects.find_one({"_id": project_id})
     if not project_data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Project not found")
-    project_data["id"] = project_data["_id"]
-    return ProjectPublic(**project_data)
+    return project_public_serializer.response(project_data)
 
 api_router.include_router(projects_router)
 
 # --- Payment Integration ---
-from rave_python import Rave, RaveExceptions
-from paystackapi.paystack import Paystack
-from paystackapi.transaction import Transaction as PaystackTransaction
-
 FLUTTERWAVE_SECRET_KEY = os.environ.get("FLUTTERWAVE_SECRET_KEY")
 FLUTTERWAVE_PUBLIC_KEY = os.environ.get("FLUTTERWAVE_PUBLIC_KEY")
-# FLUTTERWAVE_ENCRYPTION_KEY = os.environ.get("FLUTTERWAVE_ENCRYPTION_KEY") # if needed by rave-python
+FLUTTERWAVE_BASE_URL = os.environ.get("FLUTTERWAVE_BASE_URL", DEFAULT_FLUTTERWAVE_BASE_URL)
+FLUTTERWAVE_WEBHOOK_HASH = os.environ.get("FLUTTERWAVE_WEBHOOK_HASH", "") # "Secret hash" set on the Flutterwave dashboard
 
 PAYSTACK_SECRET_KEY = os.environ.get("PAYSTACK_SECRET_KEY")
 PAYSTACK_PUBLIC_KEY = os.environ.get("PAYSTACK_PUBLIC_KEY")
+PAYSTACK_BASE_URL = os.environ.get("PAYSTACK_BASE_URL", DEFAULT_PAYSTACK_BASE_URL)
+
+PAYMENT_GATEWAY_TIMEOUT = float(os.environ.get("PAYMENT_GATEWAY_TIMEOUT", "10")) # Seconds per attempt
+PAYMENT_GATEWAY_RETRIES = int(os.environ.get("PAYMENT_GATEWAY_RETRIES", "2"))
+PAYMENT_RECONCILE_INTERVAL = int(os.environ.get("PAYMENT_RECONCILE_INTERVAL", "300")) # Seconds; 0 leaves it to the CLI
+PAYMENT_RECONCILE_CONCURRENCY = int(os.environ.get("PAYMENT_RECONCILE_CONCURRENCY", "5")) # Gateway calls in flight
+PAYMENT_RECONCILE_RATE = float(os.environ.get("PAYMENT_RECONCILE_RATE", "5")) # Gateway calls per second
 
-# Initialize Flutterwave Rave
-rave = None
-if FLUTTERWAVE_PUBLIC_KEY and FLUTTERWAVE_SECRET_KEY:
-    rave = Rave(FLUTTERWAVE_PUBLIC_KEY, FLUTTERWAVE_SECRET_KEY, usingEnv=False) # Set usingEnv based on actual key type (test/live)
+# One keep-alive pool for both gateways; calls are async so slow verifications don't stall other requests
+payment_http_client = create_http_client(timeout=PAYMENT_GATEWAY_TIMEOUT)
+
+# Initialize Flutterwave
+flutterwave = None
+if FLUTTERWAVE_SECRET_KEY:
+    flutterwave = FlutterwaveClient(FLUTTERWAVE_SECRET_KEY, payment_http_client, base_url=FLUTTERWAVE_BASE_URL,
+                                    webhook_hash=FLUTTERWAVE_WEBHOOK_HASH, retries=PAYMENT_GATEWAY_RETRIES)
 
 # Initialize Paystack
 paystack = None
 if PAYSTACK_SECRET_KEY:
-    paystack = Paystack(secret_key=PAYSTACK_SECRET_KEY)
+    paystack = PaystackClient(PAYSTACK_SECRET_KEY, payment_http_client, base_url=PAYSTACK_BASE_URL,
+                              retries=PAYMENT_GATEWAY_RETRIES)
 
 payments_router = APIRouter(prefix="/payments", tags=["Payments"])
 
@@ -876,163 +1371,190 @@ class PaymentVerificationResponse(BaseModel):
     message: str
     order: Optional[OrderPublic] = None
 
+payment_verification_serializer = ModelSerializer(PaymentVerificationResponse)
+
 
 async def update_order_payment_status(order_id: PyObjectId, payment_status: str, new_order_status: Optional[str] = None):
+    if payment_status == "paid":
+        # Stock was decremented when the order was reserved; committing is idempotent, so
+        # verifying twice is harmless. Commit first so a paid order's stock is never swept.
+        try:
+            await stock_reservations.commit(order_id)
+        except InsufficientStock as e:
+            logger.error(f"Order {order_id} was paid after its stock reservation expired and can't be filled: {e}")
+
     update_fields = {"payment_status": payment_status, "updatedAt": datetime.utcnow()}
     if new_order_status:
         update_fields["status"] = new_order_status
 
+    # A paid order is never downgraded, e.g. by a failed retry landing after the webhook
     updated_order = await db.orders.find_one_and_update(
-        {"_id": order_id},
+        {"_id": order_id, "payment_status": {"$ne": "paid"}},
         {"$set": update_fields},
         return_document=True # Use pymongo.ReturnDocument.AFTER for newer pymongo
     )
+    if updated_order is None and payment_status == "paid":
+        # Paid meanwhile by a webhook or a concurrent verify; report the order as it stands
+        updated_order = await db.orders.find_one({"_id": order_id})
     if updated_order:
-        # TODO: Decrement stock here if payment is successful
-        # This should be done carefully to avoid race conditions or doing it multiple times.
-        # A flag on the order or a separate transaction log might be needed.
-        # if payment_status == "paid":
-        #     for item in updated_order.get("items", []):
-        #         await db.products.update_one(
-        #             {"_id": item["product_id"]},
-        #             {"$inc": {"stock_quantity": -item["quantity"]}}
-        #         )
-        #         logger.info(f"Decremented stock for product {item['product_id']} by {item['quantity']}")
-
-        updated_order["id"] = updated_order.pop("_id")
-        return OrderPublic(**updated_order)
+        return order_public_serializer.validate(updated_order)
     return None
 
-@payments_router.post("/verify/flutterwave", response_model=PaymentVerificationResponse)
-async def verify_flutterwave_payment(verification_data: PaymentVerificationRequest, current_user: UserInDB = Depends(get_current_active_user)):
-    if not rave:
-        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Flutterwave payment service not configured.")
+async def update_orders_payment_status(order_ids: List[PyObjectId], payment_status: str, new_order_status: Optional[str] = None):
+    # Batched update_order_payment_status for the webhook consumer; orders already paid are left alone
+    if not order_ids:
+        return
+    if payment_status == "paid":
+        await stock_reservations.commit_many(order_ids)
 
-    order = await db.orders.find_one({"_id": verification_data.order_id, "customer_id": current_user.id})
-    if not order:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found or does not belong to user.")
+    update_fields = {"payment_status": payment_status, "updatedAt": datetime.utcnow()}
+    if new_order_status:
+        update_fields["status"] = new_order_status
+    await db.orders.update_many({"_id": {"$in": order_ids}, "payment_status": {"$ne": "paid"}}, {"$set": update_fields})
 
-    if order["payment_status"] == "paid":
-        order["id"] = order.pop("_id")
-        return PaymentVerificationResponse(success=True, message="Payment already verified.", order=OrderPublic(**order))
+async def process_payment_events(events: List[dict]):
+    # One orders query and at most two updates per batch, however many events it holds
+    order_ids = {}
+    for event in events:
+        try:
+            order_ids[event["_id"]] = uuid.UUID(event["order_id"])
+        except (TypeError, ValueError):
+            logger.warning(f"Payment event {event['_id']} ({event['reference']}) doesn't reference an order")
+    orders = {order["_id"]: order async for order in db.orders.find(
+        {"_id": {"$in": list(set(order_ids.values()))}}, {"total_amount": 1, "payment_status": 1})}
+
+    paid, failed = set(), set()
+    for event in events:
+        order = orders.get(order_ids.get(event["_id"]))
+        if order is None:
+            if event["_id"] in order_ids:
+                logger.warning(f"Payment event {event['_id']} references unknown order {event['order_id']}")
+            continue
+        if order["payment_status"] == "paid":
+            continue
+        if not event["successful"]:
+            failed.add(order["_id"])
+        elif float(event["amount"]) < float(order["total_amount"]) or event["currency"] != "NGN":
+            logger.error(f"{event['provider']} webhook amount mismatch: Expected {order['total_amount']}, Got {event['amount']} {event['currency']}")
+            failed.add(order["_id"])
+        else:
+            paid.add(order["_id"])
+
+    # A success anywhere in the batch wins over an earlier failed attempt for the same order
+    await update_orders_payment_status(list(paid), "paid", "processing")
+    await update_orders_payment_status(list(failed - paid), "failed")
+    if paid or failed:
+        logger.info(f"Applied payment webhooks: {len(paid)} paid, {len(failed - paid)} failed")
+
+# Webhook events are persisted, acknowledged, then applied in batches by a background consumer
+payment_event_queue = PaymentEventQueue(db.payment_events, process_payment_events)
+
+# Re-verifies orders left pending/error by failed or abandoned verify requests
+payment_reconciler = PaymentReconciler(
+    db.orders, {gateway.provider: gateway for gateway in (paystack, flutterwave) if gateway},
+    on_paid=stock_reservations.commit_many,
+    concurrency=PAYMENT_RECONCILE_CONCURRENCY,
+    rate=PAYMENT_RECONCILE_RATE,
+    interval=PAYMENT_RECONCILE_INTERVAL,
+    leases=db.leases, # Only one worker reconciles at a time
+)
 
+async def receive_payment_webhook(gateway: Optional[GatewayClient], request: Request):
+    if not gateway:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Payment service not configured.")
+    body = await request.body()
+    if not gateway.verify_signature(body, request.headers):
+        logger.warning(f"Rejected {gateway.name} webhook with an invalid signature from {client_ip(request)}")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid signature")
     try:
-        # Flutterwave uses tx_ref or transaction_id. Assuming verification_data.transaction_reference is the tx_ref.
-        # The rave-python SDK might have a slightly different verification flow.
-        # This is a conceptual example. Refer to rave-python docs for exact method.
-        # Example: res = rave.Transaction.verify(verification_data.transaction_reference)
-        # For this example, let's assume a direct verification call that returns structured data.
-        # A common pattern is to re-query the transaction status.
-
-        # Placeholder: The actual verification call to Flutterwave SDK
-        # This SDK (rave-python 1.4.1) seems to focus on charging, not direct verification of external refs easily
-        # A more common approach is to use their /transactions/{ID}/verify endpoint via an HTTP call if SDK lacks it
-        # For now, let's simulate:
-        # if verification_data.transaction_reference.startswith("FLW_SUCCESS_"): # Simulate success
-        #     is_successful = True
-        #     amount_paid = order["total_amount"]
-        #     currency = "NGN" # Assume NGN
-        # else: # Simulate failure
-        #     is_successful = False
-        #     amount_paid = 0
-        #     currency = "NGN"
-
-        # A more realistic SDK usage would be something like:
-        # charge_response = rave.Card.charge(...) or rave.MobileMoney.charge(...)
-        # verify_response = rave.Transaction.verify(charge_response['flwRef'])
-        # This example assumes the frontend already initiated and got a reference.
-        # Let's assume verification_data.transaction_reference is the transaction ID from Flutterwave.
-
-        # The rave_python.Transaction.verify method expects 'flw_ref' which is Flutterwave's internal reference.
-        # If the frontend provides `transaction_id` (integer), it might be that.
-        # If it provides `tx_ref` (your unique order ref), you use that to query.
-        # This part is highly dependent on what reference the frontend gets and sends.
-        # For now, we'll assume transaction_reference is the FLW Transaction ID.
-
-        # This SDK is a bit old. A direct API call might be more reliable for verification:
-        # headers = {'Authorization': f'Bearer {FLUTTERWAVE_SECRET_KEY}'}
-        # async with httpx.AsyncClient() as client:
-        #     response = await client.get(f"https://api.flutterwave.com/v3/transactions/{verification_data.transaction_reference}/verify", headers=headers)
-        # if response.status_code == 200:
-        #     fw_res = response.json()
-        #     if fw_res.get("status") == "success" and fw_res["data"]["tx_ref"] == str(order["_id"]): # Match with your order ref
-        #         is_successful = True
-        #         amount_paid = fw_res["data"]["amount"]
-        #         currency = fw_res["data"]["currency"]
-        #     else: is_successful = False, amount_paid = 0, currency = "NGN"
-        # else: is_successful = False, amount_paid = 0, currency = "NGN"
-
-        # Given the SDK limitations for simple verification, this part is simplified.
-        # In a real scenario, ensure the API/SDK call is correct.
-        # For this exercise, we'll assume the frontend only calls this if Flutterwave indicated success.
-        # We'll simulate a successful verification if it reaches here for now.
-        is_successful = True
-        amount_paid = order["total_amount"]
-        currency = "NGN" # Assuming NGN
-
-        if is_successful and float(amount_paid) >= float(order["total_amount"]) and currency == "NGN": # Basic checks
-            updated_order_public = await update_order_payment_status(verification_data.order_id, "paid", "processing")
-            if updated_order_public:
-                return PaymentVerificationResponse(success=True, message="Payment verified successfully via Flutterwave.", order=updated_order_public)
-            else:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update order status.")
-        else:
-            await update_order_payment_status(verification_data.order_id, "failed")
-            return PaymentVerificationResponse(success=False, message="Flutterwave payment verification failed or amount mismatch.")
+        event = gateway.parse_event(json.loads(body))
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed payload")
+    if event:
+        await payment_event_queue.enqueue(event)
+    # Acknowledge quickly: gateways time out and redeliver slow webhooks
+    return {"status": "received"}
+
+@payments_router.post("/webhooks/paystack", include_in_schema=False)
+async def paystack_webhook(request: Request):
+    return await receive_payment_webhook(paystack, request)
+
+@payments_router.post("/webhooks/flutterwave", include_in_schema=False)
+async def flutterwave_webhook(request: Request):
+    return await receive_payment_webhook(flutterwave, request)
 
-    except RaveExceptions.TransactionVerificationError as e: # Example exception
-        logger.error(f"Flutterwave verification error: {e}")
-        await update_order_payment_status(verification_data.order_id, "failed")
-        return PaymentVerificationResponse(success=False, message=f"Flutterwave verification error: {e}")
-    except Exception as e:
-        logger.error(f"General error during Flutterwave verification: {e}")
-        await update_order_payment_status(verification_data.order_id, "error")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {e}")
+@payments_router.post("/verify/flutterwave", response_model=PaymentVerificationResponse)
+async def verify_flutterwave_payment(verification_data: PaymentVerificationRequest, current_user: Principal = Depends(get_current_principal),
+                               idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER)):
+    # A retry with the same key replays the first result without calling Flutterwave again
+    async def verify():
+        return await _verify_flutterwave_payment(verification_data, current_user)
+    return await run_idempotent(idempotency_key, "payments/verify/flutterwave", current_user.id, verification_data, verify)
+
+async def _verify_flutterwave_payment(verification_data: PaymentVerificationRequest, current_user: Principal):
+    if not flutterwave:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Flutterwave payment service not configured.")
+    # The frontend sends Flutterwave's transaction ID (or our tx_ref) as transaction_reference
+    return await _verify_payment(flutterwave, verification_data, current_user)
 
 
 @payments_router.post("/verify/paystack", response_model=PaymentVerificationResponse)
-async def verify_paystack_payment(verification_data: PaymentVerificationRequest, current_user: UserInDB = Depends(get_current_active_user)):
+async def verify_paystack_payment(verification_data: PaymentVerificationRequest, current_user: Principal = Depends(get_current_principal),
+                               idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_KEY_HEADER)):
+    # A retry with the same key replays the first result without calling Paystack again
+    async def verify():
+        return await _verify_paystack_payment(verification_data, current_user)
+    return await run_idempotent(idempotency_key, "payments/verify/paystack", current_user.id, verification_data, verify)
+
+async def _verify_paystack_payment(verification_data: PaymentVerificationRequest, current_user: Principal):
     if not paystack:
         raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Paystack payment service not configured.")
+    # Paystack API uses reference for verification
+    return await _verify_payment(paystack, verification_data, current_user)
 
+async def _verify_payment(gateway: GatewayClient, verification_data: PaymentVerificationRequest, current_user: Principal):
     order = await db.orders.find_one({"_id": verification_data.order_id, "customer_id": current_user.id})
     if not order:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found or does not belong to user.")
 
     if order["payment_status"] == "paid":
-        order["id"] = order.pop("_id")
-        return PaymentVerificationResponse(success=True, message="Payment already verified.", order=OrderPublic(**order))
+        return payment_verification_serializer.response(PaymentVerificationResponse(success=True, message="Payment already verified.", order=order_public_serializer.validate(order)))
+
+    if order.get("payment_reference") != verification_data.transaction_reference:
+        # Recorded first, so the reconciler can re-check the payment if this request fails midway
+        await db.orders.update_one({"_id": order["_id"]}, {"$set": {
+            "payment_reference": verification_data.transaction_reference,
+            "payment_provider": gateway.provider,
+        }})
 
     try:
-        # Paystack API uses reference for verification
-        response = PaystackTransaction.verify(reference=verification_data.transaction_reference) # paystackapi library call
-
-        if response['status'] is True and response['data']['status'] == 'success':
-            amount_paid_kobo = response['data']['amount']
-            amount_paid_main = amount_paid_kobo / 100
-            currency = response['data']['currency']
-
-            # Ensure amount matches and currency is NGN (or your store's currency)
-            if float(amount_paid_main) >= float(order["total_amount"]) and currency == "NGN":
-                updated_order_public = await update_order_payment_status(verification_data.order_id, "paid", "processing")
-                if updated_order_public:
-                    return PaymentVerificationResponse(success=True, message="Payment verified successfully via Paystack.", order=updated_order_public)
-                else:
-                    raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update order status.")
-            else:
-                await update_order_payment_status(verification_data.order_id, "failed")
-                logger.error(f"Paystack amount mismatch: Expected {order['total_amount']}, Got {amount_paid_main} {currency}")
-                return PaymentVerificationResponse(success=False, message="Paystack payment verification failed: Amount or currency mismatch.")
-        else:
-            await update_order_payment_status(verification_data.order_id, "failed")
-            logger.error(f"Paystack verification failed: {response.get('message')}")
-            return PaymentVerificationResponse(success=False, message=f"Paystack payment verification failed: {response.get('message', 'Unknown error')}")
+        result = await gateway.verify(verification_data.transaction_reference)
+    except GatewayError as e:
+        # Already retried; the order stays payable and the client can verify again later
+        logger.error(f"{gateway.name} verification unavailable: {e}")
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"{gateway.name} is unavailable, please retry.")
+
+    if not result.successful:
+        if not result.final:
+            # Abandoned, pending or still processing: it may yet be paid, so the order stays payable.
+            # Marked no-store so a retry with the same Idempotency-Key asks the gateway again
+            logger.info(f"{gateway.name} payment {verification_data.transaction_reference} not completed yet: {result.status or result.message}")
+            return payment_verification_serializer.response(PaymentVerificationResponse(success=False, message=f"{gateway.name} payment is not complete yet, please retry shortly."),
+                                                            headers=NOT_REPLAYABLE_HEADERS)
+        await update_order_payment_status(verification_data.order_id, "failed")
+        logger.error(f"{gateway.name} verification failed: {result.message}")
+        return payment_verification_serializer.response(PaymentVerificationResponse(success=False, message=f"{gateway.name} payment verification failed: {result.message or 'Unknown error'}"))
 
-    except Exception as e: # Catching generic Exception from paystackapi or other issues
-        logger.error(f"Error during Paystack verification: {e}")
-        await update_order_payment_status(verification_data.order_id, "error") # Mark as error
-        # Consider if this should return 500 or a specific payment error to frontend
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred during Paystack verification: {e}")
+    # Ensure amount matches and currency is NGN (or your store's currency)
+    if float(result.amount) < float(order["total_amount"]) or result.currency != "NGN":
+        await update_order_payment_status(verification_data.order_id, "failed")
+        logger.error(f"{gateway.name} amount mismatch: Expected {order['total_amount']}, Got {result.amount} {result.currency}")
+        return payment_verification_serializer.response(PaymentVerificationResponse(success=False, message=f"{gateway.name} payment verification failed: Amount or currency mismatch."))
+
+    updated_order_public = await update_order_payment_status(verification_data.order_id, "paid", "processing")
+    if not updated_order_public:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to update order status.")
+    return payment_verification_serializer.response(PaymentVerificationResponse(success=True, message=f"Payment verified successfully via {gateway.name}.", order=updated_order_public))
 
 api_router.include_router(payments_router)
 
@@ -1056,7 +1578,7 @@ async def update_product_admin(product_id: PyObjectId, product_update: ProductCr
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
     if product_update.category_id:
-        category = await db.categories.find_one({"_id": product_update.category_id})
+        category = await product_category_resolver.get(product_update.category_id)
         if not category:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
 
@@ -1074,14 +1596,14 @@ async def update_product_admin(product_id: PyObjectId, product_update: ProductCr
         # but as a safeguard for concurrent deletion or other issues.
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found during update")
 
-    # Populate category for response
-    updated_product_doc["id"] = updated_product_doc["_id"]
-    if updated_product_doc.get("category_id"):
-        category_data = await db.categories.find_one({"_id": updated_product_doc["category_id"]})
-        if category_data:
-            updated_product_doc["category"] = CategoryPublic(**{**category_data, "id": category_data["_id"]})
+    if PRODUCT_SEARCH_ENGINE == "memory":
+        product_search_index.upsert(updated_product_doc)
+    product_facet_cache.clear()
+    await response_cache.purge("products")
 
-    return ProductPublic(**updated_product_doc)
+    # Populate category for response
+    await product_category_resolver.populate([updated_product_doc])
+    return product_public_serializer.response(updated_product_doc)
 
 
 @admin_router.delete("/products/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1089,8 +1611,169 @@ async def delete_product_admin(product_id: PyObjectId):
     delete_result = await db.products.delete_one({"_id": product_id})
     if delete_result.deleted_count == 0:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
+    product_search_index.remove(product_id)
+    product_facet_cache.clear()
+    await response_cache.purge("products")
     return # No content response
 
+# Admin Bulk Import/Export
+BULK_IMPORT_CHUNK_SIZE = 1000
+# Imported text is sanitized like the public forms, one chunk at a time
+PRODUCT_IMPORT_TEXT_LIMITS = {"name": 200, "description": 20_000}
+BULK_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+class BulkImportRowError(BaseModel):
+    line: int # Line number in the uploaded file
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[BulkImportRowError] = []
+    errors_truncated: bool = False
+
+def _record_import_error(result: BulkImportResult, line: int, error: str):
+    result.failed += 1
+    if len(result.errors) < BULK_IMPORT_MAX_REPORTED_ERRORS:
+        result.errors.append(BulkImportRowError(line=line, error=error))
+    else:
+        result.errors_truncated = True
+
+def _format_validation_error(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in e.errors())
+
+async def _import_product_chunk(rows: list, result: BulkImportResult):
+    # Validate the chunk, resolve its categories in one lookup, then write it in one bulk_write
+    validated = []
+    sanitize_errors = sanitize_records([record or {} for _, record, _ in rows], PRODUCT_IMPORT_TEXT_LIMITS)
+    for (line, record, parse_error), sanitize_error in zip(rows, sanitize_errors):
+        result.received += 1
+        if parse_error:
+            _record_import_error(result, line, parse_error)
+            continue
+        if sanitize_error:
+            _record_import_error(result, line, sanitize_error)
+            continue
+        product_id = record.pop("id", None) or record.pop("_id", None)
+        try:
+            product_in = ProductCreate(**record)
+            product_id = PyObjectId.validate(product_id, None) if product_id else None
+        except ValidationError as e:
+            _record_import_error(result, line, _format_validation_error(e))
+            continue
+        except ValueError as e:
+            _record_import_error(result, line, f"id: {e}")
+            continue
+        validated.append((line, product_id, product_in))
+
+    categories = await product_category_resolver.resolve(product_in.category_id for _, _, product_in in validated)
+    now = datetime.utcnow()
+    operations, op_lines, index_docs = [], [], []
+    for line, product_id, product_in in validated:
+        if product_in.category_id and product_in.category_id not in categories:
+            _record_import_error(result, line, "category_id: Category not found")
+            continue
+        if product_id:
+            fields = {**product_in.model_dump(), "updatedAt": now}
+            operations.append(UpdateOne(
+                {"_id": product_id},
+                {"$set": fields, "$setOnInsert": {"createdAt": now}},
+                upsert=True,
+            ))
+            index_docs.append({**fields, "_id": product_id})
+        else:
+            new_product = ProductInDB(**product_in.model_dump(), _id=uuid.uuid4())
+            product_doc = new_product.model_dump(by_alias=True)
+            operations.append(InsertOne(product_doc))
+            index_docs.append(product_doc)
+        op_lines.append(line)
+
+    if not operations:
+        return
+
+    failed_ops = set()
+    try:
+        write_result = await db.products.bulk_write(operations, ordered=False)
+        details = write_result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for write_error in details.get("writeErrors", []):
+            failed_ops.add(write_error["index"])
+            _record_import_error(result, op_lines[write_error["index"]], write_error.get("errmsg", "Write failed"))
+
+    result.inserted += details.get("nInserted", 0) + details.get("nUpserted", 0)
+    result.updated += details.get("nMatched", 0)
+    if PRODUCT_SEARCH_ENGINE == "memory":
+        for position, index_doc in enumerate(index_docs):
+            if position not in failed_ops:
+                product_search_index.upsert(index_doc)
+
+@admin_router.post("/products/import", response_model=BulkImportResult)
+async def import_products_admin(request: Request, format: Optional[str] = None):
+    # Streams the request body: send NDJSON or CSV (with a header row) as the raw body
+    content_type = request.headers.get("content-type", "")
+    import_format = format or ("csv" if "csv" in content_type else "ndjson")
+    if import_format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be 'ndjson' or 'csv'")
+
+    rows = iter_csv(request.stream()) if import_format == "csv" else iter_ndjson(request.stream())
+    result = BulkImportResult()
+    async for chunk in batched(rows, BULK_IMPORT_CHUNK_SIZE):
+        await _import_product_chunk(chunk, result)
+
+    if result.inserted or result.updated:
+        product_facet_cache.clear()
+        await response_cache.purge("products")
+    return result
+
+@admin_router.get("/products/export")
+async def export_products_admin(format: str = "ndjson"):
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be 'ndjson' or 'csv'")
+
+    if format == "csv":
+        async def generate_csv():
+            yield product_csv_header()
+            async for product in db.products.find().batch_size(DEFAULT_BATCH_SIZE):
+                yield product_csv_row(product)
+
+        return StreamingResponse(generate_csv(), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=products.csv"})
+    return stream_cursor(
+        db.products.find(),
+        lambda product: ProductInDB(**product).model_dump_json(by_alias=True),
+        ndjson=True,
+        headers={"Content-Disposition": "attachment; filename=products.ndjson"},
+    )
+
+@admin_router.get("/stats/password-hasher")
+async def get_password_hasher_stats():
+    # Queue depth and latency of the bcrypt pool; sustained queueing means logins are CPU-bound
+    return {**password_hasher.get_stats(), "login_guard": login_guard.get_stats()}
+
+@admin_router.get("/stats/principal-cache")
+async def get_principal_cache_stats():
+    return {**principal_cache.get_stats(), "revocations": revoked_tokens.get_stats()}
+
+@admin_router.get("/stats/stock-reservations")
+async def get_stock_reservation_stats():
+    # `stuck` holds were claimed by a sweeper that never finished; their stock needs a manual check
+    return {**stock_reservations.get_stats(), "stuck": await stock_reservations.count_stuck()}
+
+@admin_router.get("/stats/idempotency")
+async def get_idempotency_stats():
+    return idempotency_store.get_stats()
+
+@admin_router.get("/stats/payment-gateways")
+async def get_payment_gateway_stats():
+    return {
+        **{gateway.name: gateway.get_stats() for gateway in (paystack, flutterwave) if gateway},
+        "webhooks": payment_event_queue.get_stats(),
+        "reconciliation": payment_reconciler.get_stats(),
+    }
+
 # Note: Product creation can use the existing POST /api/products/ endpoint,
 # but it's currently protected by get_current_active_user.
 # If only admins should create products, that endpoint's dependency should change to get_current_admin_user.
@@ -1109,16 +1792,17 @@ async def make_user_admin_dev_only(user_email: EmailStr):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
     update_result = await db.users.update_one(
-        {"email": user_email},
+        {"_id": user.id},
         {"$set": {"isAdmin": True, "updatedAt": datetime.utcnow()}}
     )
     if update_result.modified_count == 0 and not user.isAdmin: # Check if already admin
         raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, detail="User was already admin or not modified.")
+    if update_result.modified_count:
+        # Tokens carry the role claim; existing ones are revoked so the user signs in with the new role
+        await revoke_user_sessions(user)
 
     updated_user = await get_user_by_email(user_email)
-    public_user_data = updated_user.model_dump(exclude={"hashed_password", "disabled"})
-    public_user_data["id"] = public_user_data.pop("_id")
-    return {"message": f"User {user_email} is now an admin.", "user": UserPublic(**public_user_data)}
+    return {"message": f"User {user_email} is now an admin.", "user": user_public_serializer.validate(updated_user.model_dump(by_alias=True))}
 
 
 class StatusCheck(BaseModel):
@@ -1141,21 +1825,28 @@ async def create_status_check(input_data: StatusCheckCreate): # Renamed 'input'
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck], tags=["Status"])
-async def get_status_checks():
-    status_checks_cursor = db.status_checks.find()
-    status_checks_list = await status_checks_cursor.to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks_list]
+async def get_status_checks(request: Request, limit: int = 1000):
+    # Streamed as a JSON array (or NDJSON when requested via Accept) straight from the cursor
+    status_checks_cursor = db.status_checks.find().limit(limit)
+    return stream_cursor(
+        status_checks_cursor,
+        lambda status_check: StatusCheck(**status_check).model_dump_json(),
+        ndjson=wants_ndjson(request),
+    )
 
 
 # Include the main API router in the app
 app.include_router(api_router)
 
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"], # Consider restricting this in production
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Configure logging
@@ -1167,13 +1858,45 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("startup")
 async def startup_event():
-    # You can add any startup logic here, e.g., creating indexes
-    # For example, ensuring 'email' is unique for users collection
-    await db.users.create_index("email", unique=True)
+    if PASSWORD_HASH_ROUNDS:
+        password_hasher.set_rounds(int(PASSWORD_HASH_ROUNDS))
+    else:
+        await password_hasher.calibrate(PASSWORD_HASH_TARGET_MS)
+    lowercased = await lowercase_user_emails()
+    if lowercased:
+        logger.info(f"Lowercased the stored email of {lowercased} users")
+    # Indexes are declared in utils.indexes to match the API's actual query shapes
+    await ensure_indexes(db)
+    index_report = await audit_indexes(db)
+    for kind, entries in index_report.items():
+        if entries:
+            logger.warning(f"Indexes {kind}: {', '.join(entries)}")
+    if PRODUCT_SEARCH_ENGINE == "memory":
+        await product_search_index.rebuild(db.products)
+    # Keep category caches coherent across workers when change streams are available
+    product_category_resolver.start_watching()
+    blog_category_resolver.start_watching()
+    principal_cache.start_watching(db.users)
+    # Loads current revocations, then polls for ones made by other workers
+    await revoked_tokens.load()
+    revoked_tokens.start()
+    stock_reservations.start()
+    payment_event_queue.start()
+    if PAYMENT_RECONCILE_INTERVAL > 0:
+        payment_reconciler.start()
     logger.info("Application startup complete. MongoDB indexes checked/created.")
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await product_category_resolver.stop_watching()
+    await blog_category_resolver.stop_watching()
+    await principal_cache.stop_watching()
+    await revoked_tokens.stop()
+    await stock_reservations.stop()
+    await payment_event_queue.stop()
+    await payment_reconciler.stop()
+    await payment_http_client.aclose()
+    password_hasher.shutdown()
     client.close()
     logger.info("MongoDB connection closed.")
@@ -0,0 +1,171 @@
+import codecs
+import csv
+import io
+import json
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, List, Optional, Tuple
+
+PRODUCT_CSV_COLUMNS = ["id", "name", "description", "price", "stock_quantity", "category_id", "images"]
+IMAGE_SEPARATOR = "|"
+
+# (line number, parsed record or None, parse error or None)
+ParsedRow = Tuple[int, Optional[Dict[str, Any]], Optional[str]]
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Split a byte stream into numbered text lines without buffering the whole body"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    line_number = 0
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_number += 1
+            yield line_number, line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield line_number + 1, pending.rstrip("\r")
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    """Parse newline-delimited JSON objects, skipping blank lines"""
+    async for line_number, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, record, None
+
+def _csv_record(header: List[str], values: List[str]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {}
+    for column, value in zip(header, values):
+        value = value.strip()
+        if value == "":
+            continue
+        if column == "images":
+            record[column] = [image for image in value.split(IMAGE_SEPARATOR) if image]
+        else:
+            record[column] = value
+    return record
+
+class _LineFeed:
+    """Line iterator a csv.reader pulls from; it is only advanced once a whole record is fed"""
+
+    def __init__(self):
+        self.lines: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+def _ends_in_quoted_field(line: str, in_quotes: bool) -> bool:
+    """Whether a record is still inside a quoted field after `line` (csv's default dialect)"""
+    if not in_quotes and '"' not in line:
+        return False
+    position = 0 # Outside quotes, always the start of a field
+    while position < len(line):
+        if in_quotes:
+            quote = line.find('"', position)
+            if quote < 0:
+                return True
+            if line.startswith('"', quote + 1):
+                position = quote + 2 # A doubled quote is an escaped quote
+                continue
+            in_quotes = False
+            comma = line.find(",", quote + 1)
+        elif line.startswith('"', position):
+            in_quotes = True
+            position += 1
+            continue
+        else:
+            # Quotes only open a quoted field at the start of a field; elsewhere they're literal
+            comma = line.find(",", position)
+        if comma < 0:
+            return False
+        position = comma + 1
+    return in_quotes
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[ParsedRow]:
+    """Parse CSV with a header row; quoted fields may span lines
+
+    Lines go through one csv.reader, which is only advanced once a whole record has been
+    fed to it. A quoted field longer than csv's field size limit is reported and dropped.
+    """
+    header: Optional[List[str]] = None
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    max_record_size = csv.field_size_limit()
+    in_quotes = False
+    record_size = 0
+    first_line = 0
+    async for line_number, line in iter_lines(chunks):
+        if not in_quotes:
+            first_line = line_number
+            record_size = 0
+        # The reader keeps newlines inside quoted fields only if the lines carry them
+        feed.lines.append(line + "\n")
+        record_size += len(line) + 1
+        in_quotes = _ends_in_quoted_field(line, in_quotes)
+        if in_quotes:
+            if record_size > max_record_size:
+                yield first_line, None, f"Quoted field longer than {max_record_size} characters"
+                feed.lines.clear()
+                in_quotes = False
+            continue
+        if len(feed.lines) == 1 and not line.strip():
+            feed.lines.clear()
+            continue
+
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            feed.lines.clear()
+            yield first_line, None, f"Invalid CSV: {e}"
+            continue
+
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        if len(values) > len(header):
+            yield first_line, None, f"Expected at most {len(header)} columns, got {len(values)}"
+            continue
+        yield first_line, _csv_record(header, values), None
+
+    if in_quotes:
+        yield first_line, None, "Unterminated quoted field"
+
+async def batched(rows: AsyncIterator[ParsedRow], size: int) -> AsyncIterator[List[ParsedRow]]:
+    batch: List[ParsedRow] = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def product_csv_header() -> str:
+    return _csv_line(PRODUCT_CSV_COLUMNS)
+
+def product_csv_row(product: Dict[str, Any]) -> str:
+    values = []
+    for column in PRODUCT_CSV_COLUMNS:
+        value = product.get("_id") if column == "id" else product.get(column)
+        if column == "images":
+            value = IMAGE_SEPARATOR.join(value or [])
+        values.append("" if value is None else str(value))
+    return _csv_line(values)
+
+def _csv_line(values: Iterable[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from pydantic import BaseModel
+from pymongo.errors import OperationFailure, PyMongoError
+
+from utils.category_resolver import CategoryResolver
+
+logger = logging.getLogger(__name__)
+
+class CategoryCache(CategoryResolver):
+    """In-process snapshot of a small category collection with TTL and explicit invalidation
+
+    IDs that Mongo doesn't have are remembered for `negative_ttl` seconds, so stale or
+    bogus references don't cost a query on every page; invalidation forgets them too.
+    """
+
+    def __init__(self, collection, public_model: Type[BaseModel], ttl: float = 300,
+                 key: str = "category_id", target: str = "category", max_size: int = 1000,
+                 negative_ttl: float = 30):
+        super().__init__(collection, public_model, key=key, target=target)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._categories: Optional[Dict[Any, BaseModel]] = None
+        self._unknown: Dict[Any, float] = {} # ID -> monotonic time it stops being trusted as missing
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+        self._watch_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def _is_fresh(self) -> bool:
+        return self._categories is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    async def _snapshot(self) -> Dict[Any, BaseModel]:
+        """Return the cached categories, reloading the whole collection when stale"""
+        if self._is_fresh():
+            self.hits += 1
+            return self._categories
+
+        async with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self._categories
+
+            self.misses += 1
+            generation = self._generation
+            cursor = self.collection.find()
+            categories = await cursor.to_list(length=self.max_size)
+            snapshot = {
+                category["_id"]: self.public_model(**{**category, "id": category["_id"]})
+                for category in categories
+            }
+            # Don't publish a snapshot that raced with an invalidation
+            if generation == self._generation:
+                self._categories = snapshot
+                self._loaded_at = time.monotonic()
+            return snapshot
+
+    async def resolve(self, category_ids: Iterable[Any]) -> Dict[Any, BaseModel]:
+        """Resolve categories from the snapshot, falling back to Mongo for unknown IDs"""
+        ids = {category_id for category_id in category_ids if category_id}
+        if not ids:
+            return {}
+
+        snapshot = await self._snapshot()
+        resolved = {category_id: snapshot[category_id] for category_id in ids if category_id in snapshot}
+        missing = ids - resolved.keys()
+        if not missing:
+            return resolved
+
+        now = time.monotonic()
+        unknown = {category_id for category_id in missing if self._unknown.get(category_id, 0) > now}
+        self.negative_hits += len(unknown)
+        missing -= unknown
+        if missing:
+            # Created by another worker since the last load; fetch just those
+            generation = self._generation
+            found = await super().resolve(missing)
+            resolved.update(found)
+            if generation == self._generation:
+                self._remember_unknown(missing - found.keys(), now)
+        return resolved
+
+    def _remember_unknown(self, category_ids: Iterable[Any], now: float):
+        if len(self._unknown) >= self.max_size:
+            self._unknown = {key: until for key, until in self._unknown.items() if until > now}
+        for category_id in category_ids:
+            if len(self._unknown) >= self.max_size:
+                break
+            self._unknown[category_id] = now + self.negative_ttl
+
+    async def get_all(self) -> List[BaseModel]:
+        """Return every cached category"""
+        return list((await self._snapshot()).values())
+
+    def invalidate(self):
+        """Drop the snapshot so the next read reloads it"""
+        self._generation += 1
+        self._categories = None
+        self._loaded_at = 0.0
+        self._unknown = {}
+
+    def start_watching(self):
+        """Invalidate on every change reported by a Mongo change stream"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop_watching(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self):
+        retry_delay = 1.0
+        while True:
+            try:
+                async with self.collection.watch() as stream:
+                    retry_delay = 1.0
+                    # Changes made while the stream was down may have been missed
+                    self.invalidate()
+                    async for _change in stream:
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # Change streams need a replica set; rely on the TTL instead
+                logger.info(f"Change stream unavailable for {self.collection.name}, using TTL only: {e}")
+                return
+            except PyMongoError as e:
+                logger.warning(f"Change stream for {self.collection.name} interrupted: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._categories) if self._categories is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "unknown": len(self._unknown),
+            "negative_hits": self.negative_hits,
+            "watching": self._watch_task is not None and not self._watch_task.done(),
+        }
@@ -0,0 +1,44 @@
+import logging
+from typing import Any, Dict, Iterable, List, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+class CategoryResolver:
+    """Resolve category references for a page of documents in one query"""
+
+    def __init__(self, collection, public_model: Type[BaseModel],
+                 key: str = "category_id", target: str = "category"):
+        self.collection = collection
+        self.public_model = public_model
+        self.key = key
+        self.target = target
+
+    async def resolve(self, category_ids: Iterable[Any]) -> Dict[Any, BaseModel]:
+        """Fetch all given categories with a single $in query"""
+        ids = list({category_id for category_id in category_ids if category_id})
+        if not ids:
+            return {}
+
+        cursor = self.collection.find({"_id": {"$in": ids}})
+        categories = await cursor.to_list(length=len(ids))
+        return {
+            category["_id"]: self.public_model(**{**category, "id": category["_id"]})
+            for category in categories
+        }
+
+    async def get(self, category_id: Any):
+        """Resolve a single category, returning None if it does not exist"""
+        if not category_id:
+            return None
+        return (await self.resolve([category_id])).get(category_id)
+
+    async def populate(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Attach the resolved category to every document that references one"""
+        categories = await self.resolve(doc.get(self.key) for doc in documents)
+        for doc in documents:
+            category = categories.get(doc.get(self.key))
+            if category is not None:
+                doc[self.target] = category
+        return documents
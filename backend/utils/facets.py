@@ -0,0 +1,104 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Naira price buckets for the storefront price filter
+PRICE_BUCKET_BOUNDARIES = [0, 10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000]
+PRICE_BUCKET_OVERFLOW = "overflow"
+
+class TTLCache:
+    """Small LRU mapping with per-entry expiry"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+def hits_stages(sort: Sequence[Tuple[str, int]], skip: int, limit: int) -> Dict[str, List[Dict[str, Any]]]:
+    """$facet branches returning one page of hits and the total hit count"""
+    return {
+        "hits": [{"$sort": dict(sort)}, {"$skip": skip}, {"$limit": limit}],
+        "total": [{"$count": "count"}],
+    }
+
+def facet_stages() -> Dict[str, List[Dict[str, Any]]]:
+    """$facet branches for category counts, price histogram and stock availability"""
+    return {
+        "categories": [
+            {"$group": {"_id": "$category_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ],
+        "price": [
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_BUCKET_BOUNDARIES,
+                "default": PRICE_BUCKET_OVERFLOW,
+                "output": {"count": {"$sum": 1}},
+            }},
+        ],
+        "availability": [
+            {"$group": {"_id": {"$gt": ["$stock_quantity", 0]}, "count": {"$sum": 1}}},
+        ],
+    }
+
+def build_facet_pipeline(base_match: Dict[str, Any], refinements: Dict[str, Any], sort: Sequence[Tuple[str, int]],
+                         skip: int, limit: int, text_score: bool, include_facets: bool) -> List[Dict[str, Any]]:
+    """Single aggregation returning hits, total and (optionally) facets
+
+    Facets are counted over the base match only, so selecting a category or
+    price range doesn't hide the other options; refinements only narrow hits.
+    """
+    pipeline: List[Dict[str, Any]] = []
+    if include_facets:
+        pipeline.append({"$match": base_match})
+    else:
+        # No facets needed, so refinements can go into the indexed $match
+        pipeline.append({"$match": {**base_match, **refinements}})
+    if text_score:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+
+    branches = hits_stages(sort, skip, limit)
+    if include_facets:
+        if refinements:
+            for stages in branches.values():
+                stages.insert(0, {"$match": refinements})
+        branches.update(facet_stages())
+    pipeline.append({"$facet": branches})
+    return pipeline
+
+def parse_facets(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert raw $facet output to the ProductFacets shape (category names resolved later)"""
+    price = []
+    for bucket in result.get("price", []):
+        if bucket["_id"] == PRICE_BUCKET_OVERFLOW:
+            price.append({"min": PRICE_BUCKET_BOUNDARIES[-1], "max": None, "count": bucket["count"]})
+        else:
+            position = PRICE_BUCKET_BOUNDARIES.index(bucket["_id"])
+            price.append({"min": bucket["_id"], "max": PRICE_BUCKET_BOUNDARIES[position + 1], "count": bucket["count"]})
+
+    availability = {"in_stock": 0, "out_of_stock": 0}
+    for group in result.get("availability", []):
+        availability["in_stock" if group["_id"] else "out_of_stock"] = group["count"]
+
+    categories = [{"category_id": group["_id"], "count": group["count"]} for group in result.get("categories", [])]
+    return {"categories": categories, "price": price, "availability": availability}
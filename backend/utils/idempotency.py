@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import logging
+import math
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pydantic import BaseModel
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = (b"idempotent-replayed", b"true")
+# Set by a handler on an interim answer (e.g. "payment not complete yet") so a retry runs it again
+NOT_REPLAYABLE_HEADERS = {"Cache-Control": "no-store"}
+MAX_KEY_LENGTH = 255
+
+class IdempotencyKeyInvalid(Exception):
+    """Raised for an empty or overlong Idempotency-Key"""
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key is sent again with a different request body"""
+
+class IdempotencyInFlight(Exception):
+    """Raised when the first request with a key is still running after the wait timeout"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"A request with this {IDEMPOTENCY_KEY_HEADER} is still in progress, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+def request_fingerprint(body: BaseModel) -> str:
+    """Digest of a parsed request body; a key may only be replayed for the same body"""
+    return hashlib.sha256(body.model_dump_json().encode()).hexdigest()
+
+class IdempotencyStore:
+    """Runs a handler once per Idempotency-Key and replays its response to retries
+
+    Records live in Mongo (`idempotency_keys`, TTL-indexed on `expiresAt`) so retries
+    landing on any worker see them. The first request inserts a record as a lock; a
+    concurrent duplicate waits for its response (on a local future when the first
+    request is on the same worker, else by polling) instead of running the handler
+    again. Exceptions, server errors and responses marked `Cache-Control: no-store`
+    aren't cached: the record is dropped so a retry runs afresh. A lock whose holder
+    died is taken over once `lock_ttl` passes.
+    """
+
+    def __init__(self, collection, ttl: float = 86400, lock_ttl: float = 60,
+                 wait_timeout: float = 10, poll_interval: float = 0.05, max_poll_interval: float = 0.5):
+        self.collection = collection
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.waited = 0
+        self.conflicts = 0
+
+    async def run(self, key: Optional[str], scope: str, fingerprint: str,
+                  handler: Callable[[], Awaitable[Response]]) -> Response:
+        """Return `handler()`'s response, or the stored one for a repeated `key` within `scope`"""
+        if key is None:
+            return await handler()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise IdempotencyKeyInvalid(f"{IDEMPOTENCY_KEY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+        record_id = f"{scope}:{key}"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        poll_interval = self.poll_interval
+        waited = False
+        while True:
+            owner, record = await self._acquire(record_id, fingerprint)
+            if owner:
+                return await self._execute(record_id, owner, handler)
+            if record is None:
+                continue # Released between our insert and read; try again
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyKeyReused(f"{IDEMPOTENCY_KEY_HEADER} was already used for a different request")
+            if "response" in record:
+                self.replayed += 1
+                return self._replay(record["response"])
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self.conflicts += 1
+                lock_left = (record["lockedUntil"] - datetime.utcnow()).total_seconds()
+                raise IdempotencyInFlight(max(1, math.ceil(lock_left)))
+            if not waited:
+                waited = True
+                self.waited += 1
+            future = self._inflight.get(record_id)
+            if future is not None:
+                await asyncio.wait({future}, timeout=remaining)
+            else:
+                await asyncio.sleep(min(poll_interval, remaining))
+                poll_interval = min(poll_interval * 2, self.max_poll_interval)
+
+    async def _acquire(self, record_id: str, fingerprint: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        # Returns (owner, None) when we hold the lock, else (None, the existing record or None)
+        now = datetime.utcnow()
+        owner = uuid.uuid4().hex
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "owner": owner,
+                "lockedUntil": now + timedelta(seconds=self.lock_ttl),
+                "expiresAt": now + timedelta(seconds=self.ttl),
+            })
+            return owner, None
+        except DuplicateKeyError:
+            pass
+
+        # Take over a lock whose holder died without storing a response or releasing it
+        record = await self.collection.find_one_and_update(
+            {"_id": record_id, "fingerprint": fingerprint, "response": {"$exists": False}, "lockedUntil": {"$lt": now}},
+            {"$set": {"owner": owner, "lockedUntil": now + timedelta(seconds=self.lock_ttl)}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if record is not None:
+            logger.warning(f"Took over expired idempotency lock {record_id}")
+            return owner, None
+        return None, await self.collection.find_one({"_id": record_id})
+
+    async def _execute(self, record_id: str, owner: str, handler: Callable[[], Awaitable[Response]]) -> Response:
+        done = asyncio.get_running_loop().create_future()
+        self._inflight[record_id] = done
+        try:
+            try:
+                response = await handler()
+            except BaseException:
+                await self.collection.delete_one({"_id": record_id, "owner": owner})
+                raise
+            self.executed += 1
+            stored = self._snapshot(response)
+            if stored is None:
+                await self.collection.delete_one({"_id": record_id, "owner": owner})
+            else:
+                await self.collection.update_one({"_id": record_id, "owner": owner}, {"$set": {"response": stored}})
+            return response
+        finally:
+            # Wakes same-worker duplicates; they re-read the record
+            self._inflight.pop(record_id, None)
+            done.set_result(None)
+
+    @staticmethod
+    def _snapshot(response: Response) -> Optional[Dict[str, Any]]:
+        body = getattr(response, "body", None)
+        if body is None or response.status_code >= 500:
+            return None # Streaming responses and server errors are never replayed
+        if "no-store" in response.headers.get("cache-control", ""):
+            return None
+        return {
+            "status_code": response.status_code,
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")]
+                        for name, value in response.raw_headers if name != b"content-length"],
+            "body": bytes(body),
+        }
+
+    @staticmethod
+    def _replay(stored: Dict[str, Any]) -> Response:
+        response = Response(stored["body"], status_code=stored["status_code"])
+        response.raw_headers.extend((name.encode("latin-1"), value.encode("latin-1")) for name, value in stored["headers"])
+        response.raw_headers.append(REPLAYED_HEADER)
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "waited": self.waited,
+            "conflicts": self.conflicts,
+            "in_flight": len(self._inflight),
+        }
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Sort orders used by the list endpoints; every one has a matching index below
+PRODUCT_LIST_SORT = [("createdAt", -1), ("_id", -1)]
+ORDER_LIST_SORT = [("createdAt", -1), ("_id", -1)]
+BLOG_POST_LIST_SORT = [("publishedAt", -1), ("_id", -1)]
+PROJECT_LIST_SORT = [("createdAt", -1), ("_id", -1)]
+
+@dataclass
+class IndexSpec:
+    """An index the API relies on"""
+    collection: str
+    keys: List[Tuple[str, Any]]
+    unique: bool = False
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def key_document(self) -> Dict[str, Any]:
+        return dict(self.keys)
+
+    def matches(self, index_info: Dict[str, Any]) -> bool:
+        """Compare against an entry of index_information()/list_indexes()"""
+        existing = index_info.get("key")
+        existing_keys = list(existing.items()) if isinstance(existing, dict) else list(existing or [])
+        if any(value == "text" for _, value in self.keys):
+            # Text indexes are stored as _fts/_ftsx; compare the indexed fields instead
+            return "_fts" in dict(existing_keys) and \
+                set(index_info.get("weights", {})) == {name for name, _ in self.keys}
+        return [(name, value) for name, value in existing_keys] == list(self.keys)
+
+@dataclass
+class HotQuery:
+    """A query shape served on a hot path, checked with explain()"""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, Any]]] = None
+
+SAMPLE_ID = uuid.UUID(int=0)
+
+INDEXES: List[IndexSpec] = [
+    IndexSpec("users", [("email", 1)], unique=True),
+    IndexSpec("products", [("name", "text"), ("description", "text")]),
+    IndexSpec("products", PRODUCT_LIST_SORT),
+    IndexSpec("products", [("category_id", 1)] + PRODUCT_LIST_SORT),
+    IndexSpec("orders", [("customer_id", 1)] + ORDER_LIST_SORT),
+    IndexSpec("orders", [("payment_status", 1), ("updatedAt", 1)]),
+    IndexSpec("blog_posts", [("isPublished", 1)] + BLOG_POST_LIST_SORT),
+    IndexSpec("blog_posts", [("slug", 1), ("isPublished", 1)]),
+    IndexSpec("projects", PROJECT_LIST_SORT),
+    IndexSpec("newsletter_subscriptions", [("email", 1)], unique=True),
+    IndexSpec("revoked_tokens", [("expiresAt", 1)], options={"expireAfterSeconds": 0}),
+    IndexSpec("revoked_tokens", [("revokedAt", 1)]),
+    IndexSpec("refresh_rotations", [("expiresAt", 1)], options={"expireAfterSeconds": 0}),
+    IndexSpec("stock_reservations", [("status", 1), ("expiresAt", 1)]),
+    IndexSpec("idempotency_keys", [("expiresAt", 1)], options={"expireAfterSeconds": 0}),
+    IndexSpec("payment_events", [("status", 1), ("availableAt", 1)]),
+    IndexSpec("payment_events", [("status", 1), ("leaseUntil", 1)]),
+    IndexSpec("payment_events", [("expiresAt", 1)], options={"expireAfterSeconds": 0}),
+]
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("users_by_email", "users", {"email": "user@example.com"}),
+    HotQuery("products_list", "products", {}, PRODUCT_LIST_SORT),
+    HotQuery("products_by_category", "products", {"category_id": SAMPLE_ID}, PRODUCT_LIST_SORT),
+    HotQuery("products_text_search", "products", {"$text": {"$search": "heater"}}),
+    HotQuery("orders_by_customer", "orders", {"customer_id": SAMPLE_ID}, ORDER_LIST_SORT),
+    HotQuery("orders_unsettled_payments", "orders",
+             {"payment_status": {"$in": ["pending", "error"]}, "updatedAt": {"$lte": datetime(2024, 1, 1)}},
+             [("updatedAt", 1)]),
+    HotQuery("blog_posts_published", "blog_posts", {"isPublished": True}, BLOG_POST_LIST_SORT),
+    HotQuery("blog_post_by_slug", "blog_posts", {"slug": "sample-post", "isPublished": True}),
+    HotQuery("projects_list", "projects", {}, PROJECT_LIST_SORT),
+    HotQuery("newsletter_by_email", "newsletter_subscriptions", {"email": "user@example.com"}),
+    HotQuery("revoked_tokens_since", "revoked_tokens", {"revokedAt": {"$gte": datetime(2024, 1, 1)}}),
+    HotQuery("stock_reservations_expired", "stock_reservations",
+             {"status": "held", "expiresAt": {"$lte": datetime(2024, 1, 1)}}, [("expiresAt", 1)]),
+    HotQuery("payment_events_due", "payment_events", {"$or": [
+        {"status": "pending", "availableAt": {"$lte": datetime(2024, 1, 1)}},
+        {"status": "processing", "leaseUntil": {"$lt": datetime(2024, 1, 1)}},
+    ]}),
+]
+
+class CollectionScanError(Exception):
+    """Raised when a hot query is planned as a COLLSCAN"""
+
+async def ensure_indexes(db, specs: List[IndexSpec] = INDEXES) -> List[str]:
+    """Create every declared index; failures are logged so startup can continue"""
+    created = []
+    for spec in specs:
+        try:
+            name = await db[spec.collection].create_index(spec.keys, unique=spec.unique, **spec.options)
+            created.append(f"{spec.collection}.{name}")
+        except OperationFailure as e:
+            # e.g. duplicates blocking a unique index, or a conflicting index with the same name
+            logger.error(f"Could not create index {spec.key_document} on {spec.collection}: {e}")
+    return created
+
+async def _index_usage(collection) -> Dict[str, int]:
+    try:
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(length=None)
+    except OperationFailure:
+        return {}
+    return {stat["name"]: stat.get("accesses", {}).get("ops", 0) for stat in stats}
+
+async def audit_indexes(db, specs: List[IndexSpec] = INDEXES) -> Dict[str, List[str]]:
+    """Report declared-but-missing indexes and existing indexes that are undeclared or unused"""
+    report: Dict[str, List[str]] = {"missing": [], "unused": [], "undeclared": []}
+    collections = sorted({spec.collection for spec in specs})
+    for collection_name in collections:
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = [spec for spec in specs if spec.collection == collection_name]
+
+        for spec in declared:
+            if not any(spec.matches(info) for info in existing.values()):
+                report["missing"].append(f"{collection_name}: {spec.key_document}")
+
+        usage = await _index_usage(collection)
+        for name, info in existing.items():
+            if name == "_id_":
+                continue
+            if not any(spec.matches(info) for spec in declared):
+                report["undeclared"].append(f"{collection_name}.{name}")
+            elif usage.get(name) == 0:
+                report["unused"].append(f"{collection_name}.{name}")
+    return report
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        # Classic plans nest via inputStage(s); SBE plans wrap them in queryPlan
+        pending.extend(node.get("inputStages", []))
+        for key in ("inputStage", "queryPlan", "outerStage", "innerStage"):
+            if key in node:
+                pending.append(node[key])
+    return stages
+
+async def explain_query(db, query: HotQuery) -> Dict[str, Any]:
+    """Return the winning plan's stages for a hot query"""
+    cursor = db[query.collection].find(query.filter)
+    if query.sort:
+        cursor = cursor.sort(query.sort)
+    explanation = await cursor.explain()
+    stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+    return {"name": query.name, "collection": query.collection, "stages": stages, "collscan": "COLLSCAN" in stages}
+
+async def check_hot_queries(db, queries: List[HotQuery] = HOT_QUERIES) -> List[Dict[str, Any]]:
+    """Explain every hot query and return the ones planned as a COLLSCAN"""
+    results = [await explain_query(db, query) for query in queries]
+    return [result for result in results if result["collscan"]]
+
+async def assert_no_collection_scans(db, queries: List[HotQuery] = HOT_QUERIES):
+    """Raise CollectionScanError if any hot query would scan a whole collection"""
+    scans = await check_hot_queries(db, queries)
+    if scans:
+        names = ", ".join(f"{scan['name']} ({scan['collection']})" for scan in scans)
+        raise CollectionScanError(f"Hot queries planned as COLLSCAN: {names}")
+
+async def _main(ensure: bool) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], uuidRepresentation="standard")
+    db = client[os.environ["DB_NAME"]]
+    try:
+        if ensure:
+            await ensure_indexes(db)
+        report = await audit_indexes(db)
+        for kind, entries in report.items():
+            for entry in entries:
+                print(f"{kind}: {entry}")
+        try:
+            await assert_no_collection_scans(db)
+        except CollectionScanError as e:
+            print(e)
+            return 1
+        print("All hot queries use an index")
+        return 0
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    # CI check: python -m utils.indexes [--ensure]; exits 1 when a hot query does a COLLSCAN
+    sys.exit(asyncio.run(_main("--ensure" in sys.argv[1:])))
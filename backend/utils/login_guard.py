@@ -0,0 +1,160 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request
+
+class LoginThrottled(Exception):
+    """Raised when an IP or account has too many recent failed logins"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many failed login attempts, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class SlidingWindowCounter:
+    """Approximate sliding-window event counts with O(1) time and fixed memory per key
+
+    Each key keeps the current and previous fixed window's counts; the sliding count
+    weights the previous window by how much of it still overlaps. The least recently
+    touched keys are evicted beyond `max_keys`.
+    """
+
+    def __init__(self, window: float, max_keys: int = 100_000):
+        self.window = window
+        self.max_keys = max_keys
+        # key -> (current window start, current count, previous count)
+        self._counts: "OrderedDict[str, Tuple[float, int, int]]" = OrderedDict()
+
+    def _roll(self, key: str, now: float) -> Tuple[float, int, int]:
+        window_start = now - now % self.window
+        entry = self._counts.get(key)
+        if entry is None:
+            return window_start, 0, 0
+        start, current, previous = entry
+        if start == window_start:
+            return entry
+        if start == window_start - self.window:
+            return window_start, 0, current
+        return window_start, 0, 0
+
+    def count(self, key: str, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        start, current, previous = self._roll(key, now)
+        overlap = 1 - (now - start) / self.window
+        return current + previous * overlap
+
+    def add(self, key: str, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        start, current, previous = self._roll(key, now)
+        self._counts[key] = (start, current + 1, previous)
+        self._counts.move_to_end(key)
+        while len(self._counts) > self.max_keys:
+            self._counts.popitem(last=False)
+
+    def reset(self, key: str):
+        self._counts.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+def _increment(counts: Dict[str, int], key: str):
+    counts[key] = counts.get(key, 0) + 1
+
+def _decrement(counts: Dict[str, int], key: str):
+    remaining = counts.get(key, 0) - 1
+    if remaining > 0:
+        counts[key] = remaining
+    else:
+        counts.pop(key, None)
+
+def client_ip(request: Request) -> str:
+    """Client address, honouring the proxy headers set by our load balancer"""
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    real_ip = request.headers.get("X-Real-IP")
+    if real_ip:
+        return real_ip
+    return request.client.host if request.client else "unknown"
+
+class LoginGuard:
+    """Sheds credential-stuffing load before any bcrypt work is done
+
+    Failed logins are counted per IP and per account over a sliding window. Past
+    `delay_after` failures, attempts are slowed with an exponential delay (which holds
+    the connection, not a CPU); past the limits they are rejected outright. An attempt
+    that passes check() counts against the limits while its password is verified, so
+    a concurrent burst can't slip past before its first failure is recorded.
+    """
+
+    def __init__(self, ip_limit: int = 50, account_limit: int = 10, window: float = 900,
+                 delay_after: int = 3, base_delay: float = 0.25, max_delay: float = 5, max_keys: int = 100_000):
+        self.ip_limit = ip_limit
+        self.account_limit = account_limit
+        self.delay_after = delay_after
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.ip_failures = SlidingWindowCounter(window, max_keys)
+        self.account_failures = SlidingWindowCounter(window, max_keys)
+        # Attempts between check() and their verdict; entries are dropped at zero
+        self.ip_in_flight: Dict[str, int] = {}
+        self.account_in_flight: Dict[str, int] = {}
+        self.rejected = 0
+        self.delayed = 0
+
+    @staticmethod
+    def _retry_after(counter: SlidingWindowCounter) -> int:
+        # Earliest the sliding count can fall: when the current fixed window rolls over
+        return max(1, math.ceil(counter.window - time.time() % counter.window))
+
+    async def check(self, ip: str, account: str):
+        """Raise LoginThrottled or sleep according to recent failures; call before verifying
+
+        A passing attempt holds a slot until record_failure, record_success or release.
+        """
+        account = account.lower()
+        ip_count = self.ip_failures.count(ip) + self.ip_in_flight.get(ip, 0)
+        account_count = self.account_failures.count(account) + self.account_in_flight.get(account, 0)
+        if ip_count >= self.ip_limit:
+            self.rejected += 1
+            raise LoginThrottled(self._retry_after(self.ip_failures))
+        if account_count >= self.account_limit:
+            self.rejected += 1
+            raise LoginThrottled(self._retry_after(self.account_failures))
+
+        _increment(self.ip_in_flight, ip)
+        _increment(self.account_in_flight, account)
+        excess = max(account_count, ip_count / (self.ip_limit / self.account_limit)) - self.delay_after
+        if excess >= 0:
+            self.delayed += 1
+            try:
+                await asyncio.sleep(min(self.max_delay, self.base_delay * 2 ** excess))
+            except BaseException:
+                self.release(ip, account)
+                raise
+
+    def release(self, ip: str, account: str):
+        """Free an attempt's slot without a verdict, e.g. when verification errored"""
+        _decrement(self.ip_in_flight, ip)
+        _decrement(self.account_in_flight, account.lower())
+
+    def record_failure(self, ip: str, account: str):
+        self.release(ip, account)
+        self.ip_failures.add(ip)
+        self.account_failures.add(account.lower())
+
+    def record_success(self, ip: str, account: str):
+        self.release(ip, account)
+        # The IP keeps its history; one valid login shouldn't launder a stuffing run
+        self.account_failures.reset(account.lower())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "tracked_ips": len(self.ip_failures),
+            "tracked_accounts": len(self.account_failures),
+            "in_flight": sum(self.ip_in_flight.values()),
+            "rejected": self.rejected,
+            "delayed": self.delayed,
+        }
@@ -0,0 +1,87 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SortSpec = Sequence[Tuple[str, int]]
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$d": value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {"$u": str(value)}
+    return value
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        if "$d" in value:
+            return datetime.fromisoformat(value["$d"])
+        if "$u" in value:
+            return uuid.UUID(value["$u"])
+        raise ValueError("Unknown cursor value type")
+    return value
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode sort key values (sort fields + _id) into an opaque URL-safe token"""
+    payload = json.dumps([_encode_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str) -> List[Any]:
+    """Decode a token produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid pagination cursor") from e
+    if not isinstance(values, list):
+        raise ValueError("Invalid pagination cursor")
+    try:
+        return [_decode_value(value) for value in values]
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid pagination cursor") from e
+
+def _after(field: str, direction: int, value: Any) -> Dict[str, Any]:
+    # Mongo sorts null (and missing) below every value: first ascending, last descending
+    if value is None:
+        return {field: {"$ne": None}} if direction == 1 else {field: {"$in": []}}
+    if direction == 1:
+        return {field: {"$gt": value}}
+    # $lt never matches null, so the nulls sorted after every value need their own branch
+    return {"$or": [{field: {"$lt": value}}, {field: None}]}
+
+def keyset_filter(sort: SortSpec, values: Sequence[Any]) -> Dict[str, Any]:
+    """Build the filter selecting documents strictly after `values` in `sort` order"""
+    if len(values) != len(sort):
+        raise ValueError("Invalid pagination cursor")
+
+    clauses = []
+    for position, (field, direction) in enumerate(sort):
+        clause = {prefix_field: prefix_value for (prefix_field, _), prefix_value in zip(sort[:position], values)}
+        clause.update(_after(field, direction, values[position]))
+        clauses.append(clause)
+    return {"$or": clauses}
+
+def apply_cursor(query_filter: Dict[str, Any], sort: SortSpec, after: Optional[str]) -> Dict[str, Any]:
+    """Combine a base filter with the keyset condition for an `after` token"""
+    if not after:
+        return query_filter
+    condition = keyset_filter(sort, decode_cursor(after))
+    if not query_filter:
+        return condition
+    return {"$and": [query_filter, condition]}
+
+def _get_field(document: Dict[str, Any], field: str) -> Any:
+    value: Any = document
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+def next_cursor(documents: List[Dict[str, Any]], sort: SortSpec, limit: int) -> Optional[str]:
+    """Cursor for the page following `documents`, or None when this was the last page"""
+    if not documents or len(documents) < limit:
+        return None
+    last = documents[-1]
+    return encode_cursor([_get_field(last, field) for field, _ in sort])
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from passlib.context import CryptContext
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = max(1, min(4, os.cpu_count() or 1))
+# bcrypt work factors considered by calibration; each step doubles the cost
+MIN_ROUNDS = 10
+MAX_ROUNDS = 14
+DEFAULT_ROUNDS = 12
+BENCHMARK_PASSWORD = "calibration-Password-123"
+
+def build_context(rounds: int = DEFAULT_ROUNDS) -> CryptContext:
+    """bcrypt context hashing at `rounds`; hashes below that cost are flagged for rehash"""
+    return CryptContext(schemes=["bcrypt"], deprecated="auto",
+                        bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+def measure_hash_time(rounds: int, samples: int = 3) -> float:
+    """Best-of-`samples` seconds for one bcrypt hash at `rounds` on the current thread"""
+    context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+    best = float("inf")
+    for _ in range(samples):
+        started_at = time.perf_counter()
+        context.hash(BENCHMARK_PASSWORD)
+        best = min(best, time.perf_counter() - started_at)
+    return best
+
+def choose_rounds(target_ms: float, min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS) -> Tuple[int, float]:
+    """Highest work factor whose measured hash time stays within `target_ms`
+
+    Returns (rounds, measured ms). Never goes below `min_rounds`, even on slow hardware.
+    """
+    rounds = min_rounds
+    elapsed_ms = measure_hash_time(rounds) * 1000
+    while rounds < max_rounds:
+        # Cost doubles per round; only measure the next step if the estimate fits
+        if elapsed_ms * 2 > target_ms:
+            break
+        next_ms = measure_hash_time(rounds + 1) * 1000
+        if next_ms > target_ms:
+            break
+        rounds, elapsed_ms = rounds + 1, next_ms
+    return rounds, elapsed_ms
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify calls are already waiting for a worker"""
+
+class PasswordHasher:
+    """Runs bcrypt hash/verify in a dedicated thread pool so they never block the event loop
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism up to
+    `concurrency` cores. Calls beyond that wait on a semaphore; `max_queue` bounds
+    how many may wait before new calls fail fast with PasswordHasherBusy.
+    """
+
+    def __init__(self, context: Optional[CryptContext] = None, concurrency: int = DEFAULT_CONCURRENCY,
+                 max_queue: Optional[int] = None):
+        self.context = context or build_context()
+        self.rounds = DEFAULT_ROUNDS
+        self.calibrated_ms: Optional[float] = None
+        self.rehashed = 0
+        self._dummy_hash: Optional[str] = None
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="password-hasher")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._max_waiting = 0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop rather than the import-time one
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        if self.max_queue is not None and self._waiting >= self.max_queue:
+            self._rejected += 1
+            raise PasswordHasherBusy(f"{self._waiting} password operations already queued")
+
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        self._max_waiting = max(self._max_waiting, self._waiting)
+        try:
+            await self._get_semaphore().acquire()
+        finally:
+            self._waiting -= 1
+
+        started_at = time.perf_counter()
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            finished_at = time.perf_counter()
+            self._in_flight -= 1
+            self._completed += 1
+            self._total_wait += started_at - queued_at
+            self._total_run += finished_at - started_at
+            self._get_semaphore().release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verify, and return a replacement hash when the stored one is below the current cost"""
+        verified, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        if new_hash:
+            self.rehashed += 1
+        return verified, new_hash
+
+    async def verify_dummy(self, password: str) -> bool:
+        """Spend the same bcrypt work as a real verify, e.g. for unknown accounts; always False"""
+        if self._dummy_hash is None:
+            self._dummy_hash = await self.hash(BENCHMARK_PASSWORD)
+        await self.verify(password, self._dummy_hash)
+        return False
+
+    def set_rounds(self, rounds: int):
+        self.rounds = rounds
+        self.context = build_context(rounds)
+        self._dummy_hash = None
+
+    async def calibrate(self, target_ms: float, min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS) -> int:
+        """Measure bcrypt on this machine and adopt the highest cost within `target_ms`"""
+        loop = asyncio.get_running_loop()
+        rounds, elapsed_ms = await loop.run_in_executor(self._executor, choose_rounds, target_ms, min_rounds, max_rounds)
+        self.set_rounds(rounds)
+        self.calibrated_ms = round(elapsed_ms, 1)
+        logger.info(f"bcrypt calibrated to {rounds} rounds ({elapsed_ms:.0f} ms per hash, target {target_ms:.0f} ms)")
+        return rounds
+
+    def get_stats(self) -> Dict[str, Any]:
+        completed = self._completed or 1
+        return {
+            "rounds": self.rounds,
+            "calibrated_ms": self.calibrated_ms,
+            "rehashed": self.rehashed,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self._max_waiting,
+            "in_flight": self._in_flight,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "avg_wait_ms": round(self._total_wait / completed * 1000, 2),
+            "avg_run_ms": round(self._total_run / completed * 1000, 2),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+_shared_hasher: Optional[PasswordHasher] = None
+
+def set_shared_hasher(hasher: PasswordHasher):
+    """Make `hasher` the one used by every caller of get_shared_hasher()"""
+    global _shared_hasher
+    _shared_hasher = hasher
+
+def get_shared_hasher() -> PasswordHasher:
+    global _shared_hasher
+    if _shared_hasher is None:
+        _shared_hasher = PasswordHasher()
+    return _shared_hasher
+
+def benchmark(min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS) -> List[Dict[str, Any]]:
+    """Single-core bcrypt throughput at each work factor"""
+    results = []
+    for rounds in range(min_rounds, max_rounds + 1):
+        seconds = measure_hash_time(rounds)
+        results.append({"rounds": rounds, "ms_per_hash": seconds * 1000, "hashes_per_sec_per_core": 1 / seconds})
+    return results
+
+if __name__ == "__main__":
+    # python -m utils.passwords [target_ms]; prints throughput per cost and the cost calibration would pick
+    cores = os.cpu_count() or 1
+    print(f"{'rounds':>6} {'ms/hash':>9} {'hashes/s/core':>14} {'hashes/s (' + str(cores) + ' cores)':>20}")
+    for result in benchmark():
+        print(f"{result['rounds']:>6} {result['ms_per_hash']:>9.1f} {result['hashes_per_sec_per_core']:>14.2f} "
+              f"{result['hashes_per_sec_per_core'] * cores:>20.2f}")
+    if len(sys.argv) > 1:
+        target = float(sys.argv[1])
+        rounds, elapsed_ms = choose_rounds(target)
+        print(f"Target {target:.0f} ms -> {rounds} rounds ({elapsed_ms:.1f} ms)")
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import uuid
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from utils.payment_gateways import PaymentEvent
+
+logger = logging.getLogger(__name__)
+
+# Queue entry lifecycle: pending -> processing (leased) -> done, or back to pending on failure
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+class PaymentEventQueue:
+    """Durable queue of webhook payment events (`payment_events`), consumed in batches
+
+    Events are keyed by their gateway event ID, so redelivered webhooks are dropped at
+    insert. A consumer leases a batch by stamping it with a lease ID and expiry; events
+    whose lease runs out (a worker died mid-batch) become claimable again. A batch that
+    fails is retried with per-event exponential backoff up to `max_attempts`, then
+    marked failed. Processed events are kept for `retention` seconds (TTL on
+    `expiresAt`) so late redeliveries still deduplicate.
+    """
+
+    def __init__(self, collection, handler: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+                 batch_size: int = 100, lease: float = 60, poll_interval: float = 5,
+                 max_attempts: int = 5, retry_delay: float = 10, retention: float = 30 * 86400):
+        self.collection = collection
+        self.handler = handler
+        self.batch_size = batch_size
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+
+    async def enqueue(self, event: PaymentEvent) -> bool:
+        """Persist an event; False if it was already queued"""
+        now = datetime.utcnow()
+        document = asdict(event)
+        document["_id"] = document.pop("id")
+        document.update({"status": PENDING, "attempts": 0, "receivedAt": now, "availableAt": now})
+        try:
+            await self.collection.insert_one(document)
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.enqueued += 1
+        self._wakeup.set() # Consume right away rather than at the next poll
+        return True
+
+    async def claim(self) -> List[Dict[str, Any]]:
+        """Lease up to batch_size due events"""
+        now = datetime.utcnow()
+        due = {"$or": [
+            {"status": PENDING, "availableAt": {"$lte": now}},
+            {"status": PROCESSING, "leaseUntil": {"$lt": now}},
+        ]}
+        candidates = [event["_id"] async for event in self.collection.find(due, {"_id": 1}).limit(self.batch_size)]
+        if not candidates:
+            return []
+        lease_id = uuid.uuid4().hex
+        # Re-applying the due filter makes the claim atomic per event across workers
+        await self.collection.update_many(
+            {"$and": [{"_id": {"$in": candidates}}, due]},
+            {"$set": {"status": PROCESSING, "leaseId": lease_id, "leaseUntil": now + timedelta(seconds=self.lease)},
+             "$inc": {"attempts": 1}},
+        )
+        return await self.collection.find({"_id": {"$in": candidates}, "leaseId": lease_id}).to_list(length=None)
+
+    async def process_batch(self) -> int:
+        """Claim and handle one batch; returns how many events it held"""
+        events = await self.claim()
+        if not events:
+            return 0
+        event_ids = [event["_id"] for event in events]
+        try:
+            await self.handler(events)
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Payment event batch of {len(events)} failed: {e}")
+            await self._retry_later(events)
+            return len(events)
+
+        now = datetime.utcnow()
+        await self.collection.update_many(
+            {"_id": {"$in": event_ids}, "leaseId": events[0]["leaseId"]},
+            {"$set": {"status": DONE, "processedAt": now, "expiresAt": now + timedelta(seconds=self.retention)},
+             "$unset": {"leaseUntil": ""}},
+        )
+        self.processed += len(events)
+        return len(events)
+
+    async def _retry_later(self, events: List[Dict[str, Any]]):
+        now = datetime.utcnow()
+        lease_id = events[0]["leaseId"]
+        operations = []
+        exhausted = []
+        for event in events:
+            match = {"_id": event["_id"], "leaseId": lease_id}
+            if event["attempts"] >= self.max_attempts:
+                # Kept (no expiresAt) for a manual look; a redelivery of the same event stays deduplicated
+                exhausted.append(event["_id"])
+                operations.append(UpdateOne(match, {"$set": {"status": FAILED}, "$unset": {"leaseUntil": ""}}))
+            else:
+                # Backoff follows each event's own attempts, not the batch's least-retried one
+                delay = self.retry_delay * 2 ** (event["attempts"] - 1)
+                operations.append(UpdateOne(match, {
+                    "$set": {"status": PENDING, "availableAt": now + timedelta(seconds=delay)},
+                    "$unset": {"leaseUntil": ""},
+                }))
+        if exhausted:
+            self.dead_lettered += len(exhausted)
+            logger.error(f"Giving up on payment events after {self.max_attempts} attempts: {exhausted}")
+        await self.collection.bulk_write(operations, ordered=False)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # Cleared before claiming so an event enqueued mid-batch wakes the next round
+            self._wakeup.clear()
+            try:
+                # Drain full batches back to back; sleep once the queue runs dry
+                if await self.process_batch() >= self.batch_size:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Payment event consumer failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed_batches": self.failed_batches,
+            "failed": self.dead_lettered,
+            "consuming": self._task is not None and not self._task.done(),
+        }
@@ -0,0 +1,365 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, quote
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PAYSTACK_BASE_URL = "https://api.paystack.co"
+FLUTTERWAVE_BASE_URL = "https://api.flutterwave.com/v3"
+
+# Worth another attempt: the gateway is overloaded or briefly down
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Transaction statuses (either gateway) that won't turn into a payment later
+FINAL_FAILURE_STATUSES = {"failed", "reversed"}
+
+class GatewayError(Exception):
+    """Raised when a gateway can't be reached or keeps failing after retries"""
+
+@dataclass
+class PaymentVerification:
+    """A gateway's verdict on one transaction, in the currency's main unit"""
+    successful: bool
+    amount: float
+    currency: str
+    reference: str
+    message: str
+    status: str = "" # The gateway's own transaction status, e.g. "abandoned" or "reversed"
+    data: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def final(self) -> bool:
+        """Whether the transaction can no longer change (paid, or definitively not)"""
+        return self.successful or self.status in FINAL_FAILURE_STATUSES
+
+@dataclass
+class PaymentEvent:
+    """A payment confirmation pushed by a gateway webhook"""
+    id: str # Stable per transaction and event type, so redeliveries share it
+    provider: str
+    type: str
+    reference: str
+    order_id: Optional[str] # From the payment metadata, else the reference when it is an order ID
+    successful: bool
+    amount: float
+    currency: str
+    data: Dict[str, Any] = field(default_factory=dict)
+
+def _order_id(metadata: Any, reference: str) -> Optional[str]:
+    if isinstance(metadata, dict) and metadata.get("order_id"):
+        return str(metadata["order_id"])
+    try:
+        return str(uuid.UUID(reference))
+    except ValueError:
+        return None
+
+def _signature_matches(expected: str, received: str) -> bool:
+    # compare_digest raises TypeError on non-ASCII str, and headers are attacker-controlled; compare bytes
+    return hmac.compare_digest(expected.encode(), received.encode("utf-8", "surrogateescape"))
+
+def create_http_client(timeout: float = 10, connect_timeout: float = 3, max_connections: int = 50) -> httpx.AsyncClient:
+    """One keep-alive pool shared by every gateway client; close it on shutdown"""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=30),
+        headers={"Accept": "application/json"},
+    )
+
+class GatewayClient(ABC):
+    """Async JSON API client for one payment gateway
+
+    Calls share the pooled `http` client and never block the event loop. Transport
+    errors and overload responses are retried up to `retries` times, sleeping a random
+    ("full jitter") slice of an exponentially growing backoff so that workers retrying
+    at once don't hit the gateway in lockstep; a Retry-After header takes precedence.
+    """
+
+    name = "gateway"
+    provider = "" # Key stored on orders and events
+
+    def __init__(self, secret_key: str, http: httpx.AsyncClient, base_url: str, timeout: Optional[float] = None,
+                 retries: int = 2, backoff: float = 0.25, max_backoff: float = 2):
+        self.secret_key = secret_key
+        self.http = http
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.retried = 0
+        self.failures = 0
+
+    def _delay(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        url = f"{self.base_url}{path}"
+        headers = {"Authorization": f"Bearer {self.secret_key}"}
+        timeout = self.timeout if self.timeout is not None else httpx.USE_CLIENT_DEFAULT
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = await self.http.get(url, params=params, headers=headers, timeout=timeout)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    return response
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e: # Timeouts, refused and reset connections
+                error = f"{type(e).__name__}: {e}"
+            if attempt == self.retries:
+                break
+            self.retried += 1
+            logger.warning(f"{self.name} {path} failed ({error}), retrying")
+            await asyncio.sleep(self._delay(attempt, response))
+        self.failures += 1
+        raise GatewayError(f"{self.name} request failed after {self.retries + 1} attempts: {error}")
+
+    @staticmethod
+    def _json(response: httpx.Response) -> Dict[str, Any]:
+        try:
+            return response.json()
+        except ValueError:
+            raise GatewayError(f"Unexpected non-JSON response (HTTP {response.status_code})")
+
+    @abstractmethod
+    async def verify(self, reference: str) -> PaymentVerification:
+        """The gateway's verdict on a transaction; raises GatewayError if it can't be reached"""
+
+    @abstractmethod
+    def verify_signature(self, body: bytes, headers) -> bool:
+        """Whether a webhook request really came from the gateway"""
+
+    @abstractmethod
+    def parse_event(self, payload: Dict[str, Any]) -> Optional[PaymentEvent]:
+        """The payment event in a webhook payload, or None for event types we don't act on"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "retried": self.retried, "failures": self.failures}
+
+class PaystackClient(GatewayClient):
+    name = "Paystack"
+    provider = "paystack"
+    signature_header = "x-paystack-signature"
+
+    def __init__(self, secret_key: str, http: httpx.AsyncClient, base_url: str = PAYSTACK_BASE_URL, **kwargs):
+        super().__init__(secret_key, http, base_url, **kwargs)
+
+    async def verify(self, reference: str) -> PaymentVerification:
+        payload = self._json(await self._get(f"/transaction/verify/{quote(reference, safe='')}"))
+        data = payload.get("data") or {}
+        return PaymentVerification(
+            successful=payload.get("status") is True and data.get("status") == "success",
+            amount=(data.get("amount") or 0) / 100, # Kobo
+            currency=data.get("currency", ""),
+            reference=data.get("reference", reference),
+            message=payload.get("message", ""),
+            status=data.get("status", ""),
+            data=data,
+        )
+
+    def verify_signature(self, body: bytes, headers) -> bool:
+        # HMAC-SHA512 of the raw body, keyed with the secret key
+        expected = hmac.new(self.secret_key.encode(), body, hashlib.sha512).hexdigest()
+        return _signature_matches(expected, headers.get(self.signature_header, ""))
+
+    def parse_event(self, payload: Dict[str, Any]) -> Optional[PaymentEvent]:
+        event_type = payload.get("event")
+        data = payload.get("data") or {}
+        if event_type != "charge.success":
+            return None
+        reference = str(data.get("reference", ""))
+        return PaymentEvent(
+            id=f"paystack:{event_type}:{data.get('id') or reference}",
+            provider=self.provider,
+            type=event_type,
+            reference=reference,
+            order_id=_order_id(data.get("metadata"), reference),
+            successful=data.get("status") == "success",
+            amount=(data.get("amount") or 0) / 100, # Kobo
+            currency=data.get("currency", ""),
+            data=data,
+        )
+
+class FlutterwaveClient(GatewayClient):
+    name = "Flutterwave"
+    provider = "flutterwave"
+    signature_header = "verif-hash"
+
+    def __init__(self, secret_key: str, http: httpx.AsyncClient, base_url: str = FLUTTERWAVE_BASE_URL,
+                 webhook_hash: str = "", **kwargs):
+        super().__init__(secret_key, http, base_url, **kwargs)
+        self.webhook_hash = webhook_hash
+
+    async def verify(self, reference: str) -> PaymentVerification:
+        """Verify by Flutterwave transaction ID, or by our tx_ref when the reference isn't numeric"""
+        if reference.isdigit():
+            response = await self._get(f"/transactions/{reference}/verify")
+        else:
+            response = await self._get("/transactions/verify_by_reference", params={"tx_ref": reference})
+        payload = self._json(response)
+        data = payload.get("data") or {}
+        return PaymentVerification(
+            successful=payload.get("status") == "success" and data.get("status") == "successful",
+            amount=float(data.get("amount") or 0),
+            currency=data.get("currency", ""),
+            reference=str(data.get("tx_ref", reference)),
+            message=payload.get("message", ""),
+            status=data.get("status", ""),
+            data=data,
+        )
+
+    def verify_signature(self, body: bytes, headers) -> bool:
+        # Flutterwave echoes the secret hash configured on the dashboard; without one nothing is trusted
+        return bool(self.webhook_hash) and _signature_matches(self.webhook_hash, headers.get(self.signature_header, ""))
+
+    def parse_event(self, payload: Dict[str, Any]) -> Optional[PaymentEvent]:
+        event_type = payload.get("event")
+        data = payload.get("data") or {}
+        if event_type != "charge.completed":
+            return None
+        reference = str(data.get("tx_ref", ""))
+        return PaymentEvent(
+            id=f"flutterwave:{event_type}:{data.get('id') or reference}",
+            provider=self.provider,
+            type=event_type,
+            reference=reference,
+            order_id=_order_id(data.get("meta") or payload.get("meta_data"), reference),
+            successful=data.get("status") == "successful",
+            amount=float(data.get("amount") or 0),
+            currency=data.get("currency", ""),
+            data=data,
+        )
+
+class FakeGateway:
+    """In-process stand-in for the Paystack and Flutterwave verify APIs
+
+    An ASGI app: mount it behind `httpx.ASGITransport` in tests, or serve it with
+    uvicorn and point PAYSTACK_BASE_URL / FLUTTERWAVE_BASE_URL at it. `latency` delays
+    every response and `fail_next` makes the next calls return an error status.
+    """
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.transactions: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self._failures = 0
+        self._failure_status = 503
+
+    def add_transaction(self, reference: str, amount: float, currency: str = "NGN", successful: bool = True,
+                        transaction_id: Optional[int] = None, status: str = "failed"):
+        """`status` is reported for an unsuccessful transaction: "failed", or e.g. "abandoned" if it may still complete"""
+        transaction = {"reference": reference, "amount": amount, "currency": currency, "successful": successful,
+                       "status": status}
+        self.transactions[reference] = transaction
+        if transaction_id is not None:
+            self.transactions[str(transaction_id)] = transaction
+
+    def fail_next(self, count: int = 1, status_code: int = 503):
+        self._failures = count
+        self._failure_status = status_code
+
+    def _respond(self, path: str, query: Dict[str, str]):
+        parts = path.strip("/").split("/")
+        if parts[:2] == ["transaction", "verify"] and len(parts) == 3:
+            transaction = self.transactions.get(parts[2])
+            if transaction is None:
+                return 400, {"status": False, "message": "Transaction reference not found"}
+            return 200, {"status": True, "message": "Verification successful", "data": {
+                "status": "success" if transaction["successful"] else transaction["status"],
+                "reference": transaction["reference"],
+                "amount": round(transaction["amount"] * 100),
+                "currency": transaction["currency"],
+            }}
+
+        if parts[:1] == ["v3"]:
+            parts = parts[1:]
+        if parts[:1] == ["transactions"] and len(parts) == 3 and parts[2] == "verify":
+            transaction = self.transactions.get(parts[1])
+        elif parts == ["transactions", "verify_by_reference"]:
+            transaction = self.transactions.get(query.get("tx_ref", ""))
+        else:
+            return 404, {"status": "error", "message": "Not found"}
+        if transaction is None:
+            return 400, {"status": "error", "message": "No transaction was found for this id", "data": None}
+        return 200, {"status": "success", "message": "Transaction fetched successfully", "data": {
+            "status": "successful" if transaction["successful"] else transaction["status"],
+            "tx_ref": transaction["reference"],
+            "amount": transaction["amount"],
+            "currency": transaction["currency"],
+        }}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._failures:
+            self._failures -= 1
+            status_code, payload = self._failure_status, {"status": False, "message": "Service unavailable"}
+        else:
+            query = dict(parse_qsl(scope.get("query_string", b"").decode()))
+            status_code, payload = self._respond(scope["path"], query)
+        body = json.dumps(payload).encode()
+        await send({"type": "http.response.start", "status": status_code,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+async def _load_test(verifications: int, latency: float):
+    """Event-loop lag while `verifications` slow gateway calls are in flight, async vs blocking"""
+    import time
+
+    fake = FakeGateway(latency=latency)
+    fake.add_transaction("ref", 1000)
+
+    async def measure_lag(stop: asyncio.Event) -> float:
+        # Stands in for every other endpoint: how late does a 10 ms timer fire?
+        worst = 0.0
+        while not stop.is_set():
+            started_at = time.perf_counter()
+            await asyncio.sleep(0.01)
+            worst = max(worst, time.perf_counter() - started_at - 0.01)
+        return worst
+
+    async def blocking_verify():
+        time.sleep(latency) # What a requests-based SDK call does to the loop
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=fake), base_url="http://fake") as http:
+        paystack = PaystackClient("sk_test", http, base_url="http://fake")
+        for name, verify in [("async client", lambda: paystack.verify("ref")), ("blocking SDK", blocking_verify)]:
+            stop = asyncio.Event()
+            lag = asyncio.create_task(measure_lag(stop))
+            started_at = time.perf_counter()
+            await asyncio.gather(*[verify() for _ in range(verifications)])
+            elapsed = time.perf_counter() - started_at
+            stop.set()
+            print(f"{name}: {verifications} verifications in {elapsed:.2f}s, "
+                  f"worst event-loop lag {(await lag) * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    # python -m utils.payment_gateways [verifications] [latency_s]  - loop lag under slow verifications
+    # python -m utils.payment_gateways serve [port] [latency_s]     - fake gateway over HTTP
+    import sys
+
+    if sys.argv[1:2] == ["serve"]:
+        import uvicorn
+
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8099
+        uvicorn.run(FakeGateway(latency=float(sys.argv[3]) if len(sys.argv) > 3 else 0), port=port)
+    else:
+        asyncio.run(_load_test(int(sys.argv[1]) if len(sys.argv) > 1 else 20,
+                               float(sys.argv[2]) if len(sys.argv) > 2 else 0.5))
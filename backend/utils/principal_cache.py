@@ -0,0 +1,129 @@
+import asyncio
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+class PrincipalCache:
+    """Short-lived cache of verified tokens -> (claims, user snapshot)
+
+    Entries are keyed by the token's signature segment, never outlive the token's
+    `exp`, and are dropped per user whenever that user's record changes.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # signature -> (expires_at, token, claims, user, email)
+        self._entries: "OrderedDict[str, Tuple[float, str, Dict[str, Any], Any, str]]" = OrderedDict()
+        self._signatures_by_email: Dict[str, Set[str]] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _signature(token: str) -> str:
+        return token.rsplit(".", 1)[-1]
+
+    def get(self, token: str) -> Optional[Tuple[Dict[str, Any], Any]]:
+        signature = self._signature(token)
+        entry = self._entries.get(signature)
+        # Compare the whole token so a reused signature with an altered payload never hits
+        if entry is None or not hmac.compare_digest(entry[1], token):
+            self.misses += 1
+            return None
+        if entry[0] < time.monotonic():
+            self._discard(signature)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(signature)
+        self.hits += 1
+        return entry[2], entry[3]
+
+    def set(self, token: str, claims: Dict[str, Any], user: Any, email: str):
+        ttl = self.ttl
+        exp = claims.get("exp")
+        if exp is not None:
+            ttl = min(ttl, float(exp) - datetime.utcnow().timestamp())
+        if ttl <= 0:
+            return
+
+        signature = self._signature(token)
+        self._discard(signature)
+        self._entries[signature] = (time.monotonic() + ttl, token, claims, user, email)
+        self._signatures_by_email.setdefault(email, set()).add(signature)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, signature: str):
+        entry = self._entries.pop(signature, None)
+        if entry is None:
+            return
+        signatures = self._signatures_by_email.get(entry[4])
+        if signatures is not None:
+            signatures.discard(signature)
+            if not signatures:
+                del self._signatures_by_email[entry[4]]
+
+    def invalidate_user(self, email: str):
+        """Drop every cached token for a user, e.g. after they're disabled or promoted"""
+        for signature in list(self._signatures_by_email.get(email, ())):
+            self._discard(signature)
+
+    def clear(self):
+        self._entries.clear()
+        self._signatures_by_email.clear()
+
+    def start_watching(self, collection):
+        """Invalidate users changed by other workers, reported by a Mongo change stream"""
+        if self._watch_task is None or self._watch_task.done():
+            self._watch_task = asyncio.create_task(self._watch(collection))
+
+    async def stop_watching(self):
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch(self, collection):
+        retry_delay = 1.0
+        while True:
+            try:
+                async with collection.watch(full_document="updateLookup") as stream:
+                    retry_delay = 1.0
+                    self.clear()
+                    async for change in stream:
+                        email = (change.get("fullDocument") or {}).get("email")
+                        updated_fields = (change.get("updateDescription") or {}).get("updatedFields", {})
+                        if email and "email" not in updated_fields:
+                            self.invalidate_user(email)
+                        else:
+                            # Deletes and email changes don't tell us the cached email; drop everything
+                            self.clear()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                # Change streams need a replica set; rely on the short TTL instead
+                logger.info(f"Change stream unavailable for {collection.name}, using TTL only: {e}")
+                return
+            except PyMongoError as e:
+                logger.warning(f"Change stream for {collection.name} interrupted: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 60)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "watching": self._watch_task is not None and not self._watch_task.done(),
+        }
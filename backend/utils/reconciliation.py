@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from utils.payment_gateways import GatewayClient, GatewayError, PaymentVerification
+
+logger = logging.getLogger(__name__)
+
+# Orders whose payment may have gone through without us hearing about it
+UNSETTLED_PAYMENT_STATUSES = ["pending", "error"]
+# Matches the (payment_status, updatedAt) index
+RECONCILE_SORT = [("updatedAt", 1)]
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart, waiting instead of rejecting"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class ThroughputMeter:
+    """Events per minute over a sliding one-minute window"""
+
+    def __init__(self, window: float = 60):
+        self.window = window
+        self._events: "deque[tuple]" = deque()
+
+    def add(self, count: int = 1, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self._events.append((now, count))
+        self._trim(now)
+
+    def _trim(self, now: float):
+        while self._events and self._events[0][0] <= now - self.window:
+            self._events.popleft()
+
+    def per_minute(self, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        self._trim(now)
+        return sum(count for _, count in self._events) * 60 / self.window
+
+class PaymentReconciler:
+    """Re-verifies orders stuck in pending/error against the gateway that took the payment
+
+    Orders untouched for `min_age` seconds that carry a gateway reference are scanned
+    oldest first through the (payment_status, updatedAt) index. Gateway calls run
+    `concurrency` at a time and at most `rate` per second. Each batch's outcome is
+    written with one unordered bulk_write: paid, failed, or (still undecided) an
+    attempt count and a fresh updatedAt, which pushes the order back `min_age` before
+    its next check. Orders are given up on after `max_attempts` checks.
+
+    With a `leases` collection, the background loop only runs on the worker holding
+    the `payment_reconciler` lease document, so the gateway rate isn't multiplied by
+    the number of workers. The lease is renewed between batches and lapses after
+    `lease_ttl` seconds (twice the interval by default) if its holder dies.
+    """
+
+    LEASE_ID = "payment_reconciler"
+
+    def __init__(self, orders, gateways: Dict[str, GatewayClient],
+                 on_paid: Optional[Callable[[List[Any]], Awaitable[Any]]] = None,
+                 concurrency: int = 5, rate: float = 5, batch_size: int = 100,
+                 min_age: float = 600, max_attempts: int = 12, interval: float = 300,
+                 leases=None, lease_ttl: Optional[float] = None):
+        self.orders = orders
+        self.gateways = gateways
+        self.on_paid = on_paid
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.min_age = min_age
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self.leases = leases
+        self.lease_ttl = lease_ttl or max(interval * 2, 60)
+        self.worker_id = uuid.uuid4().hex
+        self.leader = leases is None
+        self.throughput = ThroughputMeter()
+        self._task: Optional[asyncio.Task] = None
+        self.checked = 0
+        self.paid = 0
+        self.failed = 0
+        self.unresolved = 0
+        self.gateway_errors = 0
+        self.last_run: Optional[datetime] = None
+
+    def _stale_filter(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "payment_status": {"$in": UNSETTLED_PAYMENT_STATUSES},
+            "updatedAt": {"$lte": now - timedelta(seconds=self.min_age)},
+            "payment_provider": {"$in": list(self.gateways)},
+            "payment_reference": {"$ne": None},
+            "reconcile_attempts": {"$not": {"$gte": self.max_attempts}},
+        }
+
+    async def _verify(self, order: Dict[str, Any], semaphore: asyncio.Semaphore) -> Optional[PaymentVerification]:
+        gateway = self.gateways[order["payment_provider"]]
+        async with semaphore:
+            await self.rate_limiter.wait()
+            try:
+                return await gateway.verify(order["payment_reference"])
+            except GatewayError as e:
+                self.gateway_errors += 1
+                logger.warning(f"Reconciling order {order['_id']}: {e}")
+                return None
+
+    @staticmethod
+    def _is_paid(order: Dict[str, Any], result: Optional[PaymentVerification]) -> bool:
+        return result is not None and result.successful \
+            and float(result.amount) >= float(order["total_amount"]) and result.currency == "NGN"
+
+    def _outcome(self, order: Dict[str, Any], result: Optional[PaymentVerification], now: datetime) -> UpdateOne:
+        # Every update re-checks payment_status, so a webhook or client verify landing meanwhile wins
+        match = {"_id": order["_id"], "payment_status": {"$in": UNSETTLED_PAYMENT_STATUSES}}
+        if self._is_paid(order, result):
+            self.paid += 1
+            return UpdateOne(match, {"$set": {"payment_status": "paid", "status": "processing", "updatedAt": now}})
+        if result is not None and result.successful:
+            logger.error(f"Reconciling order {order['_id']}: amount mismatch, expected {order['total_amount']}, "
+                         f"got {result.amount} {result.currency}")
+            self.failed += 1
+            return UpdateOne(match, {"$set": {"payment_status": "failed", "updatedAt": now}})
+        if result is not None and result.final:
+            self.failed += 1
+            return UpdateOne(match, {"$set": {"payment_status": "failed", "updatedAt": now}})
+        self.unresolved += 1
+        return UpdateOne(match, {"$set": {"updatedAt": now}, "$inc": {"reconcile_attempts": 1}})
+
+    async def reconcile_batch(self, now: Optional[datetime] = None) -> int:
+        """Check one batch of stale orders; returns how many were checked"""
+        now = now or datetime.utcnow()
+        cursor = self.orders.find(
+            self._stale_filter(now),
+            {"payment_reference": 1, "payment_provider": 1, "total_amount": 1},
+        ).sort(RECONCILE_SORT).limit(self.batch_size)
+        orders = await cursor.to_list(length=self.batch_size)
+        if not orders:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*[self._verify(order, semaphore) for order in orders])
+        operations = [self._outcome(order, result, now) for order, result in zip(orders, results)]
+
+        paid_ids = [order["_id"] for order, result in zip(orders, results) if self._is_paid(order, result)]
+        if paid_ids and self.on_paid:
+            # Before the orders flip to paid, so their stock reservations can't be swept in between
+            await self.on_paid(paid_ids)
+        await self.orders.bulk_write(operations, ordered=False)
+
+        self.checked += len(orders)
+        self.throughput.add(len(orders))
+        return len(orders)
+
+    async def hold_lease(self) -> bool:
+        """Take or renew the leader lease; True if this worker holds it (always, without `leases`)"""
+        if self.leases is None:
+            return True
+        now = datetime.utcnow()
+        try:
+            # Matches only our own or a lapsed lease; otherwise the upsert collides on _id
+            await self.leases.update_one(
+                {"_id": self.LEASE_ID, "$or": [{"holder": self.worker_id}, {"leaseUntil": {"$lt": now}}]},
+                {"$set": {"holder": self.worker_id, "leaseUntil": now + timedelta(seconds=self.lease_ttl)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            if self.leader:
+                logger.warning("Lost the payment reconciliation lease to another worker")
+            self.leader = False
+            return False
+        self.leader = True
+        return True
+
+    async def release_lease(self):
+        if self.leases is not None and self.leader:
+            await self.leases.delete_one({"_id": self.LEASE_ID, "holder": self.worker_id})
+            self.leader = False
+
+    async def run_once(self) -> int:
+        """Reconcile every stale order, batch by batch; returns how many were checked"""
+        started_at = datetime.utcnow()
+        total = 0
+        while True:
+            # Each batch bumps updatedAt past the cutoff, so the next one sees fresh orders
+            checked = await self.reconcile_batch(started_at)
+            total += checked
+            if checked < self.batch_size or not await self.hold_lease():
+                break
+        self.last_run = started_at
+        if total:
+            logger.info(f"Reconciled {total} orders ({self.throughput.per_minute():.0f}/min)")
+        return total
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.release_lease()
+
+    async def _run(self):
+        while True:
+            try:
+                if await self.hold_lease():
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g. a Mongo outage or a malformed gateway payload; the next round retries
+                logger.exception("Payment reconciliation failed")
+            await asyncio.sleep(self.interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "paid": self.paid,
+            "failed": self.failed,
+            "unresolved": self.unresolved,
+            "gateway_errors": self.gateway_errors,
+            "orders_per_minute": round(self.throughput.per_minute(), 1),
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "running": self._task is not None and not self._task.done(),
+            "leader": self.leader,
+        }
+
+def _cli():
+    import typer
+
+    app = typer.Typer(help="Re-verify orders stuck in pending/error against Paystack and Flutterwave")
+
+    @app.command()
+    def run(
+        once: bool = typer.Option(True, help="Reconcile the current backlog and exit, or keep running"),
+        concurrency: int = typer.Option(5, help="Gateway calls in flight at once"),
+        rate: float = typer.Option(5, help="Gateway calls per second at most"),
+        batch_size: int = typer.Option(100, help="Orders per bulk_write"),
+        min_age: float = typer.Option(600, help="Seconds an order must be untouched before it is checked"),
+        interval: float = typer.Option(300, help="Seconds between runs without --once"),
+    ):
+        asyncio.run(_run_cli(once, concurrency, rate, batch_size, min_age, interval))
+
+    app()
+
+async def _run_cli(once: bool, concurrency: int, rate: float, batch_size: int, min_age: float, interval: float):
+    import os
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from utils.payment_gateways import (
+        FLUTTERWAVE_BASE_URL, PAYSTACK_BASE_URL, FlutterwaveClient, PaystackClient, create_http_client,
+    )
+    from utils.reservations import StockReservations
+    from utils.stock import StockLedger
+
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], uuidRepresentation="standard")
+    db = client[os.environ["DB_NAME"]]
+    http = create_http_client()
+    gateways: Dict[str, GatewayClient] = {}
+    if os.environ.get("PAYSTACK_SECRET_KEY"):
+        gateways["paystack"] = PaystackClient(os.environ["PAYSTACK_SECRET_KEY"], http,
+                                              base_url=os.environ.get("PAYSTACK_BASE_URL", PAYSTACK_BASE_URL))
+    if os.environ.get("FLUTTERWAVE_SECRET_KEY"):
+        gateways["flutterwave"] = FlutterwaveClient(os.environ["FLUTTERWAVE_SECRET_KEY"], http,
+                                                    base_url=os.environ.get("FLUTTERWAVE_BASE_URL", FLUTTERWAVE_BASE_URL))
+    # Paid orders commit their stock reservations exactly as the API does
+    reservations = StockReservations(StockLedger(client, db.products), db.stock_reservations)
+    # A long-running CLI takes turns with the API workers through the same lease
+    reconciler = PaymentReconciler(db.orders, gateways, on_paid=reservations.commit_many, concurrency=concurrency,
+                                   rate=rate, batch_size=batch_size, min_age=min_age, interval=interval,
+                                   leases=None if once else db.leases)
+    try:
+        if once:
+            started_at = time.monotonic()
+            checked = await reconciler.run_once()
+            elapsed = time.monotonic() - started_at
+            print({**reconciler.get_stats(), "orders_per_minute": round(checked / elapsed * 60, 1) if elapsed else 0})
+        else:
+            reconciler.start()
+            while True:
+                await asyncio.sleep(60)
+                print(reconciler.get_stats())
+    finally:
+        await reconciler.stop()
+        await http.aclose()
+        client.close()
+
+if __name__ == "__main__":
+    # python -m utils.reconciliation [--no-once] [--concurrency N] [--rate R] ...; reads MONGO_URL, DB_NAME and gateway keys
+    _cli()
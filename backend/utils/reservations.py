@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from utils.stock import InsufficientStock, StockLedger, merge_quantities
+
+logger = logging.getLogger(__name__)
+
+# Reservation lifecycle: held -> committed (paid) or held -> releasing -> released (expired)
+HELD = "held"
+COMMITTED = "committed"
+RELEASING = "releasing"
+RELEASED = "released"
+
+class _AlreadyCommitted(Exception):
+    """Another worker committed the reservation first; rolls back our re-acquired stock"""
+
+class StockReservations:
+    """Stock held for unpaid orders until they are paid or the hold expires
+
+    `reserve` decrements stock and records a reservation (`stock_reservations`, keyed by
+    order ID) atomically with the order insert. `commit` flips held -> committed with a
+    conditional update, so verifying one payment twice never touches stock twice. A
+    background sweeper claims expired holds in batches and gives their stock back with
+    one bulk_write per batch.
+
+    A payment confirmed after its hold was released re-acquires the stock if it's still
+    there. Holds left `releasing` by a sweeper that died mid-batch are not retried, since
+    that could restore their stock twice; `count_stuck` reports them.
+    """
+
+    def __init__(self, ledger: StockLedger, collection, ttl: float = 1800, sweep_interval: float = 30,
+                 batch_size: int = 500, on_released: Optional[Callable[[List[Any]], Awaitable[Any]]] = None):
+        self.ledger = ledger
+        self.collection = collection
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self.on_released = on_released
+        self._task: Optional[asyncio.Task] = None
+        self.reserved = 0
+        self.committed = 0
+        self.reacquired = 0
+        self.released = 0
+        self.last_sweep: Optional[datetime] = None
+
+    async def reserve(self, order_id: Any, quantities: Dict[Any, int],
+                      on_reserved: Callable[[Any], Awaitable[Any]]) -> datetime:
+        """Hold stock for an order and run `on_reserved(session)` atomically with it; returns the expiry
+
+        Raises InsufficientStock (holding nothing) if any product can't cover its quantity.
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        reservation = {
+            "_id": order_id,
+            "items": [{"product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()],
+            "status": HELD,
+            "expiresAt": expires_at,
+            "createdAt": now,
+        }
+
+        async def on_decremented(session):
+            await self.collection.insert_one(reservation, session=session)
+            try:
+                await on_reserved(session)
+            except BaseException:
+                if session is None:
+                    # Without a transaction the ledger restores stock; the hold must go too
+                    # or the sweeper would restore it a second time
+                    await self.collection.delete_one({"_id": order_id})
+                raise
+
+        await self.ledger.decrement(order_id, quantities, on_decremented)
+        self.reserved += 1
+        return expires_at
+
+    async def commit(self, order_id: Any) -> bool:
+        """Make an order's hold permanent once it's paid; False if there was nothing to commit
+
+        Idempotent. Raises InsufficientStock if the hold had expired and the stock has since
+        been sold to someone else.
+        """
+        now = datetime.utcnow()
+        result = await self.collection.update_one(
+            {"_id": order_id, "status": HELD},
+            {"$set": {"status": COMMITTED, "committedAt": now}},
+        )
+        if result.modified_count:
+            self.committed += 1
+            return True
+
+        reservation = await self.collection.find_one({"_id": order_id}, {"status": 1, "items": 1})
+        if reservation is None or reservation["status"] == COMMITTED:
+            # Already committed, or an order placed before reservations existed
+            return False
+        return await self._reacquire(order_id, reservation, now)
+
+    async def commit_many(self, order_ids: List[Any]) -> int:
+        """`commit` for a batch of paid orders; held reservations are committed in one update
+
+        Orders whose stock ran out after their hold expired are logged and skipped.
+        """
+        if not order_ids:
+            return 0
+        now = datetime.utcnow()
+        result = await self.collection.update_many(
+            {"_id": {"$in": order_ids}, "status": HELD},
+            {"$set": {"status": COMMITTED, "committedAt": now}},
+        )
+        committed = result.modified_count
+        # Only holds the sweeper already claimed are left to re-acquire, one by one
+        cursor = self.collection.find({"_id": {"$in": order_ids}, "status": {"$in": [RELEASING, RELEASED]}},
+                                      {"status": 1, "items": 1})
+        async for reservation in cursor:
+            try:
+                committed += await self._reacquire(reservation["_id"], reservation, now)
+            except InsufficientStock as e:
+                logger.error(f"Order {reservation['_id']} was paid after its stock reservation expired and can't be filled: {e}")
+        self.committed += result.modified_count
+        return committed
+
+    async def _reacquire(self, order_id: Any, reservation: Dict[str, Any], now: datetime) -> bool:
+        # Paid after the sweeper claimed the hold: take the stock again. Whether or not the
+        # sweeper has restored it yet, the net effect is one decrement.
+        quantities = merge_quantities((item["product_id"], item["quantity"]) for item in reservation["items"])
+
+        async def on_decremented(session):
+            result = await self.collection.update_one(
+                {"_id": order_id, "status": {"$in": [RELEASING, RELEASED]}},
+                {"$set": {"status": COMMITTED, "committedAt": now}},
+                session=session,
+            )
+            if not result.modified_count:
+                raise _AlreadyCommitted()
+
+        try:
+            await self.ledger.decrement(order_id, quantities, on_decremented)
+        except _AlreadyCommitted:
+            return False
+        logger.info(f"Re-acquired stock for order {order_id} paid after its reservation expired")
+        self.reacquired += 1
+        self.committed += 1
+        return True
+
+    async def sweep(self, now: Optional[datetime] = None) -> int:
+        """Release every hold that expired before `now`, batch by batch; returns how many"""
+        now = now or datetime.utcnow()
+        total = 0
+        while True:
+            cursor = self.collection.find({"status": HELD, "expiresAt": {"$lte": now}}, {"_id": 1}) \
+                .sort("expiresAt", 1).limit(self.batch_size)
+            candidates = [reservation["_id"] async for reservation in cursor]
+            if not candidates:
+                break
+
+            # Claim first: holds committed meanwhile, or claimed by another worker, drop out here
+            sweep_id = uuid.uuid4().hex
+            await self.collection.update_many(
+                {"_id": {"$in": candidates}, "status": HELD},
+                {"$set": {"status": RELEASING, "sweepId": sweep_id, "releasingAt": now}},
+            )
+            claimed = await self.collection.find(
+                {"_id": {"$in": candidates}, "sweepId": sweep_id}, {"items": 1}
+            ).to_list(length=None)
+
+            if claimed:
+                order_ids = [reservation["_id"] for reservation in claimed]
+                await self.ledger.restock(merge_quantities(
+                    (item["product_id"], item["quantity"]) for reservation in claimed for item in reservation["items"]
+                ))
+                await self.collection.update_many(
+                    {"_id": {"$in": order_ids}, "status": RELEASING, "sweepId": sweep_id},
+                    {"$set": {"status": RELEASED, "releasedAt": datetime.utcnow()}},
+                )
+                total += len(order_ids)
+                if self.on_released:
+                    await self.on_released(order_ids)
+
+            if len(candidates) < self.batch_size:
+                break
+
+        self.released += total
+        self.last_sweep = now
+        if total:
+            logger.info(f"Released {total} expired stock reservations")
+        return total
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Stock reservation sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def count_stuck(self, older_than: float = 600) -> int:
+        """Holds claimed by a sweeper more than `older_than` seconds ago and never released"""
+        cutoff = datetime.utcnow() - timedelta(seconds=older_than)
+        return await self.collection.count_documents({"status": RELEASING, "releasingAt": {"$lt": cutoff}})
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "reserved": self.reserved,
+            "committed": self.committed,
+            "reacquired": self.reacquired,
+            "released": self.released,
+            "last_sweep": self.last_sweep.isoformat() if self.last_sweep else None,
+            "sweeping": self._task is not None and not self._task.done(),
+        }
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+Headers = List[Tuple[bytes, bytes]]
+
+# Purges only reach the worker's own memory, so without a shared backend other workers
+# serve stale pages until their entries expire
+MEMORY_CACHE_MAX_TTL = 5
+
+class MemoryCacheBackend:
+    """In-process LRU backend; also the local stand-in for Redis in tests"""
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+class RedisCacheBackend:
+    """Redis backend shared by all workers (requires the `redis` package)"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(key, value, ex=ttl)
+
+    async def get_counter(self, key: str) -> int:
+        value = await self.client.get(key)
+        return int(value) if value else 0
+
+    async def incr(self, key: str) -> int:
+        return await self.client.incr(key)
+
+class CachedResponse:
+    """A fully buffered response as stored in the cache"""
+
+    def __init__(self, status: int, headers: Headers, body: bytes, etag: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+
+    def dumps(self) -> bytes:
+        meta = {
+            "status": self.status,
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in self.headers],
+            "etag": self.etag.decode("latin-1"),
+        }
+        return json.dumps(meta).encode() + b"\n" + self.body
+
+    @classmethod
+    def loads(cls, data: bytes) -> "CachedResponse":
+        meta, body = data.split(b"\n", 1)
+        meta = json.loads(meta)
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in meta["headers"]]
+        return cls(meta["status"], headers, body, meta["etag"].encode("latin-1"))
+
+def compute_etag(body: bytes) -> bytes:
+    """Strong ETag derived from the exact response bytes"""
+    return b'"' + hashlib.sha256(body).hexdigest()[:32].encode() + b'"'
+
+def etag_matches(if_none_match: Optional[bytes], etag: bytes) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(b",")]
+    return b"*" in candidates or etag in candidates
+
+class ResponseCache:
+    """Route + normalized query keyed response cache with per-namespace purging"""
+
+    def __init__(self, backend, ttl: int, prefixes: Dict[str, str], key_prefix: str = "rc"):
+        self.backend = backend
+        self.ttl = ttl
+        # Longest prefix first so nested prefixes resolve to the most specific namespace
+        self.prefixes = sorted(prefixes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.key_prefix = key_prefix
+        self.hits = 0
+        self.misses = 0
+
+    def namespace_for(self, path: str) -> Optional[str]:
+        for prefix, namespace in self.prefixes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return namespace
+        return None
+
+    @staticmethod
+    def normalize_query(query_string: bytes) -> str:
+        params = parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)
+        return urlencode(sorted(params))
+
+    async def _key(self, namespace: str, path: str, query_string: bytes) -> str:
+        # The generation is bumped on purge, orphaning every key of the namespace
+        generation = await self.backend.get_counter(f"{self.key_prefix}:gen:{namespace}")
+        digest = hashlib.sha1(f"{path}?{self.normalize_query(query_string)}".encode()).hexdigest()
+        return f"{self.key_prefix}:{namespace}:{generation}:{digest}"
+
+    async def get(self, namespace: str, path: str, query_string: bytes) -> Tuple[str, Optional[CachedResponse]]:
+        key = await self._key(namespace, path, query_string)
+        data = await self.backend.get(key)
+        if data is None:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        return key, CachedResponse.loads(data)
+
+    async def set(self, key: str, response: CachedResponse):
+        await self.backend.set(key, response.dumps(), self.ttl)
+
+    async def purge(self, *namespaces: str):
+        """Invalidate every cached response of the given namespaces"""
+        for namespace in namespaces:
+            try:
+                await self.backend.incr(f"{self.key_prefix}:gen:{namespace}")
+            except Exception as e:
+                logger.error(f"Response cache purge failed for {namespace}: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+class ResponseCacheMiddleware:
+    """ASGI middleware serving anonymous GETs from a ResponseCache with ETag/304 support"""
+
+    def __init__(self, app, cache: ResponseCache, max_body_size: int = 1024 * 1024):
+        self.app = app
+        self.cache = cache
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        namespace = self.cache.namespace_for(scope["path"])
+        request_headers = dict(scope["headers"])
+        # Authenticated responses may be user specific
+        if namespace is None or b"authorization" in request_headers:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = request_headers.get(b"if-none-match")
+        try:
+            key, cached = await self.cache.get(namespace, scope["path"], scope.get("query_string", b""))
+        except Exception as e:
+            logger.error(f"Response cache lookup failed: {e}")
+            await self.app(scope, receive, send)
+            return
+
+        if cached is not None:
+            await self._send_cached(send, cached, if_none_match, b"HIT")
+            return
+
+        await self._call_and_store(scope, receive, send, key, if_none_match)
+
+    async def _send_cached(self, send, cached: CachedResponse, if_none_match: Optional[bytes], state: bytes):
+        if etag_matches(if_none_match, cached.etag):
+            headers = [(b"etag", cached.etag), (b"cache-control", b"no-cache"), (b"x-cache", state)]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        headers = cached.headers + [(b"etag", cached.etag), (b"cache-control", b"no-cache"), (b"x-cache", state)]
+        await send({"type": "http.response.start", "status": cached.status, "headers": headers})
+        await send({"type": "http.response.body", "body": cached.body})
+
+    async def _call_and_store(self, scope, receive, send, key: str, if_none_match: Optional[bytes]):
+        start_message = None
+        chunks: List[bytes] = []
+        size = 0
+        passthrough = False
+
+        async def buffering_send(message):
+            nonlocal start_message, size, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                if message["status"] != 200:
+                    passthrough = True
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if message.get("more_body", False):
+                if size > self.max_body_size:
+                    # Too large to cache; flush what we have and stream the rest
+                    passthrough = True
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                return
+
+            body = b"".join(chunks)
+            headers = [
+                (name, value) for name, value in start_message.get("headers", [])
+                if name.lower() not in (b"etag", b"content-length")
+            ]
+            headers.append((b"content-length", str(len(body)).encode()))
+            cached = CachedResponse(start_message["status"], headers, body, compute_etag(body))
+            if size <= self.max_body_size:
+                try:
+                    await self.cache.set(key, cached)
+                except Exception as e:
+                    logger.error(f"Response cache store failed: {e}")
+            await self._send_cached(send, cached, if_none_match, b"MISS")
+
+        await self.app(scope, receive, buffering_send)
+
+def create_response_cache(redis_url: Optional[str], ttl: int, prefixes: Dict[str, str]) -> ResponseCache:
+    """Use Redis when configured and importable, otherwise the in-memory LRU with a short TTL"""
+    if redis_url:
+        try:
+            return ResponseCache(RedisCacheBackend(redis_url), ttl, prefixes)
+        except ImportError:
+            logger.warning("REDIS_URL is set but the redis package is not installed; using in-memory response cache")
+    if ttl > MEMORY_CACHE_MAX_TTL:
+        logger.warning(f"In-memory response cache purges don't reach other workers; capping its TTL at "
+                       f"{MEMORY_CACHE_MAX_TTL}s instead of {ttl}s (set REDIS_URL for the full TTL)")
+        ttl = MEMORY_CACHE_MAX_TTL
+    return ResponseCache(MemoryCacheBackend(), ttl, prefixes)
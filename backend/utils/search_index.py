@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import logging
+import math
+import re
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "with",
+})
+
+# Ordered longest-first so e.g. "ingly" is tried before "ly"
+SUFFIX_RULES: Tuple[Tuple[str, str], ...] = (
+    ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"),
+    ("ingly", ""), ("ments", ""), ("ment", ""),
+    ("edly", ""), ("ness", ""), ("sses", "ss"), ("ings", ""), ("ies", "y"),
+    ("ing", ""), ("ly", ""), ("ed", ""), ("ss", "ss"), ("s", ""),
+)
+DOUBLED_AFTER = frozenset({"ing", "ings", "ingly", "ed", "edly"})
+
+def stem(token: str) -> str:
+    """Light English stemmer (Porter steps 1, 2 and 5), keeping stems >= 3 chars"""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, replacement in SUFFIX_RULES:
+        if token.endswith(suffix):
+            stemmed = token[:-len(suffix)] + replacement
+            if len(stemmed) < 3:
+                return token
+            # "running" -> "runn" -> "run"
+            if suffix in DOUBLED_AFTER and len(stemmed) > 3 \
+                    and stemmed[-1] == stemmed[-2] and stemmed[-1] not in "lsz":
+                stemmed = stemmed[:-1]
+            token = stemmed
+            break
+    # "valve"/"valves" -> "valv"
+    if len(token) > 4 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase, split on non-alphanumerics and drop stop words"""
+    if not text:
+        return []
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOP_WORDS]
+
+def analyze(text: Optional[str]) -> List[str]:
+    """Tokenize and stem"""
+    return [stem(token) for token in tokenize(text)]
+
+class InvertedIndex:
+    """In-memory BM25 inverted index over product name/description with prefix matching"""
+
+    FIELD_WEIGHTS = {"name": 3.0, "description": 1.0}
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, min_prefix_length: int = 2, max_prefix_expansions: int = 50):
+        self.min_prefix_length = min_prefix_length
+        self.max_prefix_expansions = max_prefix_expansions
+        self._sync_lock = asyncio.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.postings: Dict[str, Dict[Any, float]] = defaultdict(dict)
+        self.doc_terms: Dict[Any, Counter] = {}
+        self.doc_lengths: Dict[Any, float] = {}
+        self.doc_categories: Dict[Any, Any] = {}
+        self.vocabulary: List[str] = []
+        self.total_length = 0.0
+        self.watermark: Optional[datetime] = None
+        self.last_sync = 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def _weighted_terms(self, doc: Dict[str, Any]) -> Counter:
+        terms: Counter = Counter()
+        for field, weight in self.FIELD_WEIGHTS.items():
+            for term in analyze(doc.get(field)):
+                terms[term] += weight
+        return terms
+
+    def upsert(self, doc: Dict[str, Any]):
+        """Add or replace a product document"""
+        doc_id = doc["_id"]
+        self.remove(doc_id)
+
+        terms = self._weighted_terms(doc)
+        for term, weight in terms.items():
+            posting = self.postings[term]
+            if not posting:
+                insort(self.vocabulary, term)
+            posting[doc_id] = weight
+
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = terms
+        self.doc_lengths[doc_id] = length
+        self.doc_categories[doc_id] = doc.get("category_id")
+        self.total_length += length
+
+        updated_at = doc.get("updatedAt")
+        if updated_at and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    def remove(self, doc_id: Any):
+        """Remove a product document if present"""
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                position = bisect_left(self.vocabulary, term)
+                if position < len(self.vocabulary) and self.vocabulary[position] == term:
+                    del self.vocabulary[position]
+        self.total_length -= self.doc_lengths.pop(doc_id, 0.0)
+        self.doc_categories.pop(doc_id, None)
+
+    def _expand_prefix(self, prefix: str) -> Iterable[str]:
+        position = bisect_left(self.vocabulary, prefix)
+        for term in self.vocabulary[position:position + self.max_prefix_expansions]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def _query_terms(self, query: str) -> Dict[str, float]:
+        """Map index terms to a query weight; the last token also matches as a prefix"""
+        tokens = tokenize(query)
+        terms: Dict[str, float] = {}
+        for position, token in enumerate(tokens):
+            terms[stem(token)] = 1.0
+            if position == len(tokens) - 1 and len(token) >= self.min_prefix_length:
+                for term in self._expand_prefix(token):
+                    # Prefix matches rank just below exact matches
+                    terms.setdefault(term, 0.8)
+        return terms
+
+    def search(self, query: str, category_id: Any = None, limit: Optional[int] = None) -> List[Tuple[Any, float]]:
+        """Return (doc_id, score) pairs sorted by relevance, then id; the best `limit` if given"""
+        doc_count = len(self.doc_terms)
+        if not doc_count:
+            return []
+        average_length = self.total_length / doc_count or 1.0
+
+        scores: Dict[Any, float] = defaultdict(float)
+        for term, query_weight in self._query_terms(query).items():
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, frequency in posting.items():
+                if category_id is not None and self.doc_categories.get(doc_id) != category_id:
+                    continue
+                norm = self.K1 * (1 - self.B + self.B * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += query_weight * idf * frequency * (self.K1 + 1) / (frequency + norm)
+
+        ranked: Iterable[Tuple[Any, float]] = scores.items()
+        if limit is not None and limit < len(scores):
+            # Only fully sort what can make the cut; ties with the last score are kept so the id tie-break stays exact
+            cutoff = heapq.nlargest(limit, scores.values())[-1] if limit > 0 else math.inf
+            ranked = [item for item in ranked if item[1] >= cutoff]
+        return sorted(ranked, key=lambda item: (-item[1], str(item[0])))[:limit]
+
+    async def rebuild(self, collection, batch_size: int = 1000):
+        """Rebuild the whole index from the products collection"""
+        async with self._sync_lock:
+            self._reset()
+            started = time.perf_counter()
+            projection = {"name": 1, "description": 1, "category_id": 1, "updatedAt": 1}
+            async for doc in collection.find({}, projection).batch_size(batch_size):
+                self.upsert(doc)
+            self.last_sync = time.monotonic()
+            logger.info(f"Search index built with {len(self)} products in {time.perf_counter() - started:.2f}s")
+
+    async def sync(self, collection, min_interval: float = 5.0, batch_size: int = 1000):
+        """Pull products changed since the watermark (e.g. written by other workers)"""
+        if time.monotonic() - self.last_sync < min_interval:
+            return
+        async with self._sync_lock:
+            if time.monotonic() - self.last_sync < min_interval:
+                return
+            # $gte: products sharing the watermark timestamp may not all have been seen
+            query = {"updatedAt": {"$gte": self.watermark}} if self.watermark else {}
+            projection = {"name": 1, "description": 1, "category_id": 1, "updatedAt": 1}
+            async for doc in collection.find(query, projection).batch_size(batch_size):
+                self.upsert(doc)
+            self.last_sync = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.doc_terms),
+            "terms": len(self.vocabulary),
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+        }
+
@@ -0,0 +1,51 @@
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder used by JSONResponse
+    orjson = None
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that passes pre-encoded bytes through and encodes everything else with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        if orjson is not None:
+            # orjson handles UUID and datetime natively; pydantic models go through jsonable_encoder
+            return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+        return super().render(jsonable_encoder(content))
+
+class ModelSerializer:
+    """Precompiled Mongo document -> response JSON bytes conversion for one response model
+
+    Documents are validated exactly once (Mongo's `_id` matches the models' alias)
+    and dumped straight to JSON by pydantic-core, bypassing FastAPI's response_model
+    re-validation and jsonable_encoder. Output uses aliases, like FastAPI's default.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.adapter = TypeAdapter(model)
+        self.list_adapter = TypeAdapter(List[model])
+
+    def validate(self, document: Any) -> BaseModel:
+        return self.adapter.validate_python(document)
+
+    def dumps(self, document: Any) -> bytes:
+        return self.adapter.dump_json(self.adapter.validate_python(document), by_alias=True)
+
+    def dumps_many(self, documents: Iterable[Any]) -> bytes:
+        return self.list_adapter.dump_json(self.list_adapter.validate_python(list(documents)), by_alias=True)
+
+    def response(self, document: Any, status_code: int = 200,
+                 headers: Optional[Dict[str, str]] = None) -> FastJSONResponse:
+        return FastJSONResponse(self.dumps(document), status_code=status_code, headers=headers)
+
+    def response_many(self, documents: Iterable[Any], status_code: int = 200,
+                      headers: Optional[Dict[str, str]] = None) -> FastJSONResponse:
+        return FastJSONResponse(self.dumps_many(documents), status_code=status_code, headers=headers)
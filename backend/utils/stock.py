@@ -0,0 +1,144 @@
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Server error codes meaning "this deployment can't run multi-document transactions"
+TRANSACTIONS_UNSUPPORTED_CODES = {20, 263}
+
+class ProductNotFound(Exception):
+    """Raised when an order references products that don't exist"""
+
+    def __init__(self, product_ids: List[Any]):
+        super().__init__(f"Product with ID {', '.join(str(product_id) for product_id in product_ids)} not found.")
+        self.product_ids = product_ids
+
+class InsufficientStock(Exception):
+    """Raised when one or more products can't cover the requested quantity"""
+
+    def __init__(self, names: List[str]):
+        super().__init__(f"Not enough stock for product {', '.join(names)}.")
+        self.names = names
+
+def merge_quantities(items: Iterable[Tuple[Any, int]]) -> "OrderedDict[Any, int]":
+    """Sum quantities per product so duplicate cart lines can't slip past the stock check"""
+    quantities: "OrderedDict[Any, int]" = OrderedDict()
+    for product_id, quantity in items:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+class StockLedger:
+    """Atomic, constant-round-trip stock decrements for orders
+
+    One `$in` query loads every product in the cart, and one unordered bulk_write
+    applies a conditional decrement (`stock_quantity >= qty`) per product. On a replica
+    set the decrement and the order insert share a transaction. Elsewhere each
+    decrement also sets a hold marker (`stock_holds.<order>`), so a partial failure can
+    be compensated with one more bulk_write that only touches the marked products.
+    """
+
+    def __init__(self, client, products):
+        self.client = client
+        self.products = products
+        self.transactions: Optional[bool] = None # Unknown until the first attempt
+
+    async def load_products(self, product_ids: Iterable[Any]) -> Dict[Any, Dict[str, Any]]:
+        ids = list(product_ids)
+        cursor = self.products.find({"_id": {"$in": ids}}, {"name": 1, "price": 1, "stock_quantity": 1})
+        products = {product["_id"]: product async for product in cursor}
+        missing = [product_id for product_id in ids if product_id not in products]
+        if missing:
+            raise ProductNotFound(missing)
+        return products
+
+    @staticmethod
+    def check_available(products: Dict[Any, Dict[str, Any]], quantities: Dict[Any, int]):
+        short = [products[product_id]["name"] for product_id, quantity in quantities.items()
+                 if products[product_id].get("stock_quantity", 0) < quantity]
+        if short:
+            raise InsufficientStock(short)
+
+    async def _find_short(self, quantities: Dict[Any, int], session=None) -> List[str]:
+        # Only on the failure path: re-read stock to name the products that ran out
+        cursor = self.products.find({"_id": {"$in": list(quantities)}}, {"name": 1, "stock_quantity": 1},
+                                    session=session)
+        return [product["name"] async for product in cursor
+                if product.get("stock_quantity", 0) < quantities[product["_id"]]] or ["one or more items"]
+
+    async def decrement(self, order_id: Any, quantities: Dict[Any, int],
+                        on_decremented: Callable[[Any], Awaitable[Any]]):
+        """Decrement stock for every product and run `on_decremented(session)` atomically with it
+
+        Raises InsufficientStock (leaving stock untouched) if any product can't cover its quantity.
+        """
+        if self.transactions is not False:
+            try:
+                await self._decrement_in_transaction(quantities, on_decremented)
+                self.transactions = True
+                return
+            except OperationFailure as e:
+                if e.code not in TRANSACTIONS_UNSUPPORTED_CODES:
+                    raise
+                logger.info(f"Transactions unsupported ({e}); using compensating stock rollback")
+                self.transactions = False
+        await self._decrement_with_compensation(order_id, quantities, on_decremented)
+
+    async def _decrement_in_transaction(self, quantities: Dict[Any, int],
+                                        on_decremented: Callable[[Any], Awaitable[Any]]):
+        operations = [
+            UpdateOne({"_id": product_id, "stock_quantity": {"$gte": quantity}},
+                      {"$inc": {"stock_quantity": -quantity}})
+            for product_id, quantity in quantities.items()
+        ]
+
+        async def callback(session):
+            result = await self.products.bulk_write(operations, ordered=False, session=session)
+            if result.matched_count != len(operations):
+                # Raising aborts the transaction, undoing the decrements that did match
+                raise InsufficientStock(await self._find_short(quantities, session))
+            await on_decremented(session)
+
+        async with await self.client.start_session() as session:
+            await session.with_transaction(callback)
+
+    async def _decrement_with_compensation(self, order_id: Any, quantities: Dict[Any, int],
+                                           on_decremented: Callable[[Any], Awaitable[Any]]):
+        hold = f"stock_holds.{order_id}"
+        operations = [
+            UpdateOne({"_id": product_id, "stock_quantity": {"$gte": quantity}},
+                      {"$inc": {"stock_quantity": -quantity}, "$set": {hold: quantity}})
+            for product_id, quantity in quantities.items()
+        ]
+        result = await self.products.bulk_write(operations, ordered=False)
+        if result.matched_count != len(operations):
+            await self.release(order_id, quantities)
+            raise InsufficientStock(await self._find_short(quantities))
+
+        try:
+            await on_decremented(None)
+        except BaseException:
+            await self.release(order_id, quantities)
+            raise
+        await self.products.update_many({"_id": {"$in": list(quantities)}}, {"$unset": {hold: ""}})
+
+    async def release(self, order_id: Any, quantities: Dict[Any, int]):
+        """Give back stock held for `order_id`; products without its hold marker are left alone"""
+        hold = f"stock_holds.{order_id}"
+        await self.products.bulk_write([
+            UpdateOne({"_id": product_id, hold: {"$exists": True}},
+                      {"$inc": {"stock_quantity": quantity}, "$unset": {hold: ""}})
+            for product_id, quantity in quantities.items()
+        ], ordered=False)
+
+    async def restock(self, quantities: Dict[Any, int]):
+        """Unconditionally add quantities back, one bulk_write for any number of products"""
+        if not quantities:
+            return
+        await self.products.bulk_write([
+            UpdateOne({"_id": product_id}, {"$inc": {"stock_quantity": quantity}})
+            for product_id, quantity in quantities.items()
+        ], ordered=False)
@@ -0,0 +1,69 @@
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+# Documents per Motor round trip; large enough to amortize latency, small enough to keep memory flat
+DEFAULT_BATCH_SIZE = 500
+# Encoded documents are coalesced into chunks of roughly this many bytes before being sent
+FLUSH_SIZE = 64 * 1024
+
+Encoder = Callable[[Dict[str, Any]], str]
+
+async def iter_ndjson(cursor, encode: Encoder) -> AsyncIterator[bytes]:
+    """One encoded document per line"""
+    buffer = []
+    size = 0
+    try:
+        async for document in cursor:
+            line = encode(document) + "\n"
+            buffer.append(line)
+            size += len(line)
+            if size >= FLUSH_SIZE:
+                yield "".join(buffer).encode()
+                buffer, size = [], 0
+    finally:
+        await cursor.close()
+    if buffer:
+        yield "".join(buffer).encode()
+
+async def iter_json_array(cursor, encode: Encoder) -> AsyncIterator[bytes]:
+    """A JSON array written element by element"""
+    buffer = ["["]
+    size = 1
+    separator = ""
+    try:
+        async for document in cursor:
+            item = separator + encode(document)
+            separator = ","
+            buffer.append(item)
+            size += len(item)
+            if size >= FLUSH_SIZE:
+                yield "".join(buffer).encode()
+                buffer, size = [], 0
+    finally:
+        await cursor.close()
+    buffer.append("]")
+    yield "".join(buffer).encode()
+
+def wants_ndjson(request: Optional[Request]) -> bool:
+    return request is not None and NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+def stream_cursor(cursor, encode: Encoder, ndjson: bool = False, batch_size: int = DEFAULT_BATCH_SIZE,
+                  headers: Optional[Dict[str, str]] = None) -> StreamingResponse:
+    """Stream a Motor cursor as NDJSON or a chunked JSON array without materializing it
+
+    The cursor is closed when the stream ends, fails, or the client disconnects mid-stream
+    (Starlette then abandons the body iterator but still runs the background task).
+    """
+    cursor = cursor.batch_size(batch_size)
+    close = BackgroundTask(cursor.close)
+    if ndjson:
+        return StreamingResponse(iter_ndjson(cursor, encode), media_type=NDJSON_MEDIA_TYPE, headers=headers,
+                                 background=close)
+    return StreamingResponse(iter_json_array(cursor, encode), media_type=JSON_MEDIA_TYPE, headers=headers,
+                             background=close)
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TOKEN_TYPE = "access"
+REFRESH_TOKEN_TYPE = "refresh"
+
+def session_revocation_key(user_id: Any, token_version: int) -> str:
+    """Revocation key covering every token issued to a user at one token version"""
+    return f"session:{user_id}:{token_version}"
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings (double hashing on one blake2b digest)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationList:
+    """Revoked token IDs and sessions, persisted in Mongo and mirrored in memory on every worker
+
+    Lookups hit a bloom filter first, so the common not-revoked case costs a few hash
+    probes; maybe-revoked keys are confirmed against the exact set. Workers poll the
+    collection for new revocations and periodically reload it to drop expired keys.
+    """
+
+    def __init__(self, collection, capacity: int = 100_000, error_rate: float = 0.001,
+                 sync_interval: float = 5, reload_interval: float = 3600):
+        self.collection = collection
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.reload_interval = reload_interval
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._expires: Dict[str, datetime] = {}
+        self._watermark: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self.checks = 0
+        self.bloom_positives = 0
+
+    def _add_local(self, key: str, expires_at: datetime):
+        if key not in self._expires:
+            self._bloom.add(key)
+        self._expires[key] = expires_at
+
+    def is_revoked(self, *keys: Optional[str]) -> bool:
+        self.checks += 1
+        for key in keys:
+            if key is None or key not in self._bloom:
+                continue
+            self.bloom_positives += 1
+            expires_at = self._expires.get(key)
+            if expires_at is not None and expires_at > datetime.utcnow():
+                return True
+        return False
+
+    async def revoke(self, key: str, expires_at: datetime):
+        """Revoke a key until `expires_at`; other workers pick it up on their next sync"""
+        self._add_local(key, expires_at)
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"expiresAt": expires_at, "revokedAt": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    async def load(self):
+        """Rebuild the filter from every unexpired revocation"""
+        now = datetime.utcnow()
+        expires: Dict[str, datetime] = {}
+        cursor = self.collection.find({"expiresAt": {"$gt": now}}, {"expiresAt": 1})
+        async for document in cursor:
+            expires[document["_id"]] = document["expiresAt"]
+        # Keep revocations made locally while the reload was running
+        for key, expires_at in self._expires.items():
+            if expires_at > now:
+                expires.setdefault(key, expires_at)
+
+        bloom = BloomFilter(max(self.capacity, len(expires) * 2), self.error_rate)
+        for key in expires:
+            bloom.add(key)
+        self._bloom, self._expires = bloom, expires
+        # Small overlap so revocations with clock skew between workers aren't missed
+        self._watermark = now - timedelta(seconds=self.sync_interval)
+
+    async def sync(self):
+        """Pull revocations made by other workers since the last sync"""
+        if self._watermark is None:
+            await self.load()
+            return
+        started_at = datetime.utcnow()
+        cursor = self.collection.find({"revokedAt": {"$gte": self._watermark}}, {"expiresAt": 1})
+        async for document in cursor:
+            self._add_local(document["_id"], document["expiresAt"])
+        self._watermark = started_at - timedelta(seconds=self.sync_interval)
+        if self._bloom.count > self._bloom.capacity:
+            # Past its sized capacity the false-positive rate climbs; rebuild larger
+            await self.load()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        since_reload = 0.0
+        while True:
+            try:
+                if since_reload >= self.reload_interval:
+                    await self.load()
+                    since_reload = 0.0
+                else:
+                    await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.warning(f"Token revocation sync failed: {e}")
+            await asyncio.sleep(self.sync_interval)
+            since_reload += self.sync_interval
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "revoked": len(self._expires),
+            "filter_bits": self._bloom.size,
+            "filter_hashes": self._bloom.hash_count,
+            "checks": self.checks,
+            "bloom_positives": self.bloom_positives,
+            "syncing": self._task is not None and not self._task.done(),
+        }
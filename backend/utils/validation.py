@@ -0,0 +1,86 @@
+import re
+from typing import Annotated, Any, Dict, Iterable, List, Optional
+
+from pydantic import AfterValidator, BeforeValidator, EmailStr
+
+# Control characters other than tab/newline/carriage return, removed in one C-level pass
+CONTROL_CHARS = dict.fromkeys(code for code in range(32) if chr(code) not in "\t\n\r")
+
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+PHONE_PATTERN = re.compile(r"^\+?[1-9]\d{1,14}$")
+PHONE_STRIP_PATTERN = re.compile(r"[^\d+]")
+# National format (trunk prefix 0, e.g. 0803 123 4567), rewritten with the country code
+NATIONAL_PHONE_PATTERN = re.compile(r"^0([1-9]\d{6,9})$")
+DEFAULT_COUNTRY_CODE = "234"
+
+# Field limits for the public forms
+NAME_MAX_LENGTH = 200
+SHORT_TEXT_MAX_LENGTH = 200
+PHONE_MAX_LENGTH = 30
+MESSAGE_MAX_LENGTH = 10_000
+
+def sanitize_string(value: str, max_length: int = 1000) -> str:
+    """Strip control characters and surrounding whitespace; reject overlong input"""
+    if not isinstance(value, str):
+        raise ValueError("Input must be a string")
+    # Cheap pre-check: most input has no control characters and skips translate()
+    sanitized = value.translate(CONTROL_CHARS) if not value.isprintable() else value
+    if len(sanitized) > max_length:
+        raise ValueError(f"Input too long. Maximum {max_length} characters allowed")
+    return sanitized.strip()
+
+def validate_email(email: str) -> str:
+    email = sanitize_string(email, 254)
+    if not EMAIL_PATTERN.match(email):
+        raise ValueError("Invalid email format")
+    return email.lower()
+
+def validate_phone(phone: str) -> str:
+    # Formatting (spaces, dashes, brackets) is stripped before the E.164 check
+    phone = PHONE_STRIP_PATTERN.sub("", sanitize_string(phone, PHONE_MAX_LENGTH))
+    national = NATIONAL_PHONE_PATTERN.match(phone)
+    if national:
+        phone = f"+{DEFAULT_COUNTRY_CODE}{national.group(1)}"
+    if not PHONE_PATTERN.match(phone):
+        raise ValueError("Invalid phone number format")
+    return phone
+
+def sanitize_records(records: Iterable[Dict[str, Any]], limits: Dict[str, int]) -> List[Optional[str]]:
+    """Sanitize the string fields named in `limits` of each record in place
+
+    Returns one entry per record: None when clean, else an error message naming
+    the first offending field. Intended for bulk imports.
+    """
+    errors: List[Optional[str]] = []
+    for record in records:
+        error = None
+        for field, max_length in limits.items():
+            value = record.get(field)
+            if not isinstance(value, str):
+                continue
+            try:
+                record[field] = sanitize_string(value, max_length)
+            except ValueError as e:
+                error = f"{field}: {e}"
+                break
+        errors.append(error)
+    return errors
+
+def sanitized(max_length: int):
+    """Pydantic string type run through sanitize_string before validation"""
+    return Annotated[str, BeforeValidator(lambda value: sanitize_string(value, max_length))]
+
+def _lowercase_email(value: Any) -> Any:
+    return sanitize_string(value, 254).lower() if isinstance(value, str) else value
+
+# Email string normalized to lower case before EmailStr validation
+LowercaseEmail = BeforeValidator(_lowercase_email)
+
+# Public form email: lowercased, checked by EmailStr, then held to EMAIL_PATTERN
+Email = Annotated[EmailStr, LowercaseEmail, AfterValidator(validate_email)]
+
+Name = sanitized(NAME_MAX_LENGTH)
+ShortText = sanitized(SHORT_TEXT_MAX_LENGTH)
+# Stored as digits with an optional leading +; national numbers get +234
+Phone = Annotated[sanitized(PHONE_MAX_LENGTH), AfterValidator(validate_phone)]
+Message = sanitized(MESSAGE_MAX_LENGTH)
@@ -194,26 +194,34 @@ db.createCollection('contacts', {
   }
 });
 
-// Create indexes for better performance
+// Create indexes for the API's query shapes
+// Keep in sync with the registry in backend/utils/indexes.py (also ensured at API startup)
 db.users.createIndex({ email: 1 }, { unique: true });
-db.users.createIndex({ createdAt: -1 });
-db.users.createIndex({ isActive: 1 });
 
 db.products.createIndex({ name: 'text', description: 'text' });
-db.products.createIndex({ category: 1 });
-db.products.createIndex({ brand: 1 });
-db.products.createIndex({ price: 1 });
-db.products.createIndex({ isActive: 1 });
-db.products.createIndex({ createdAt: -1 });
+db.products.createIndex({ createdAt: -1, _id: -1 });
+db.products.createIndex({ category_id: 1, createdAt: -1, _id: -1 });
 
-db.orders.createIndex({ userId: 1 });
-db.orders.createIndex({ status: 1 });
-db.orders.createIndex({ createdAt: -1 });
-db.orders.createIndex({ paymentStatus: 1 });
+db.orders.createIndex({ customer_id: 1, createdAt: -1, _id: -1 });
+db.orders.createIndex({ payment_status: 1, updatedAt: 1 });
 
-db.contacts.createIndex({ email: 1 });
-db.contacts.createIndex({ status: 1 });
-db.contacts.createIndex({ createdAt: -1 });
+db.blog_posts.createIndex({ isPublished: 1, publishedAt: -1, _id: -1 });
+db.blog_posts.createIndex({ slug: 1, isPublished: 1 });
+
+db.projects.createIndex({ createdAt: -1, _id: -1 });
+
+db.newsletter_subscriptions.createIndex({ email: 1 }, { unique: true });
+
+db.revoked_tokens.createIndex({ expiresAt: 1 }, { expireAfterSeconds: 0 });
+db.revoked_tokens.createIndex({ revokedAt: 1 });
+
+db.stock_reservations.createIndex({ status: 1, expiresAt: 1 });
+
+db.idempotency_keys.createIndex({ expiresAt: 1 }, { expireAfterSeconds: 0 });
+
+db.payment_events.createIndex({ status: 1, availableAt: 1 });
+db.payment_events.createIndex({ status: 1, leaseUntil: 1 });
+db.payment_events.createIndex({ expiresAt: 1 }, { expireAfterSeconds: 0 });
 
 // Insert sample admin user (change password in production)
 db.users.insertOne({
@@ -0,0 +1,102 @@
+"""Shared fixtures for the backend tests
+
+The backend is imported from backend/ with its Mongo client swapped for mongomock-motor,
+unless TEST_MONGO_URL points at a real server. Tests that need a real server (text
+indexes, explain plans) take the `real_db` fixture and are skipped without one.
+Wall-clock comparisons are marked `benchmark` and only run with RUN_BENCHMARKS=1.
+"""
+import asyncio
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+TEST_MONGO_URL = os.environ.get("TEST_MONGO_URL")
+RUN_BENCHMARKS = os.environ.get("RUN_BENCHMARKS") == "1"
+# Set before server.py loads backend/.env, which never overrides existing variables
+os.environ["MONGO_URL"] = TEST_MONGO_URL or "mongodb://localhost:27017"
+os.environ["DB_NAME"] = os.environ.get("TEST_DB_NAME", "einspot_test")
+os.environ.setdefault("PASSWORD_HASH_ROUNDS", "4") # Cheapest bcrypt cost; the tests don't measure hashing
+
+if not TEST_MONGO_URL:
+    import motor.motor_asyncio
+    import mongomock.collection
+    from bson import BSON
+    from bson.codec_options import CodecOptions
+    from bson.binary import UuidRepresentation
+    from mongomock_motor import AsyncMongoMockClient
+
+    _STANDARD_UUIDS = CodecOptions(uuid_representation=UuidRepresentation.STANDARD)
+
+    class _StandardUuidBSON(BSON):
+        # mongomock validates documents with pymongo's default codec, which refuses UUIDs
+        @classmethod
+        def encode(cls, document, check_keys=False, codec_options=None):
+            return super().encode(document, check_keys, _STANDARD_UUIDS)
+
+    mongomock.collection.BSON = _StandardUuidBSON
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: asserts on wall-clock timings; runs only with RUN_BENCHMARKS=1")
+
+def pytest_collection_modifyitems(config, items):
+    if RUN_BENCHMARKS:
+        return
+    # Timings flake on loaded CI runners; the default run keeps the deterministic checks
+    skip = pytest.mark.skip(reason="timing benchmark; set RUN_BENCHMARKS=1 to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+@pytest.fixture(scope="session")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture(scope="session")
+def run(event_loop):
+    """Runs a coroutine to completion; every test shares one loop, like a worker process"""
+    return event_loop.run_until_complete
+
+@pytest.fixture(scope="session")
+def server():
+    import server as server_module
+
+    server_module.password_hasher.set_rounds(int(os.environ["PASSWORD_HASH_ROUNDS"]))
+    # mongomock has no sessions; stock changes fall back to compensating writes
+    server_module.stock_ledger.transactions = TEST_MONGO_URL is not None
+    return server_module
+
+@pytest.fixture
+def db(server, run):
+    yield server.db
+    run(server.client.drop_database(os.environ["DB_NAME"]))
+    run(server.response_cache.purge("products", "blog", "projects"))
+
+@pytest.fixture
+def api(server, db, run):
+    import httpx
+
+    # ASGITransport skips the lifespan, so no background tasks start
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://testserver")
+    yield client
+    run(client.aclose())
+
+@pytest.fixture
+def real_db(run):
+    if not TEST_MONGO_URL:
+        pytest.skip("needs a real MongoDB; set TEST_MONGO_URL")
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(TEST_MONGO_URL, uuidRepresentation="standard")
+    database = client[f"einspot_test_{uuid.uuid4().hex[:8]}"]
+    yield database
+    run(client.drop_database(database.name))
+    client.close()
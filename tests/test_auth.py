@@ -0,0 +1,161 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+
+from utils.login_guard import LoginGuard, LoginThrottled
+
+def _register(api, run, email="Ada@Example.com", password="correct horse"):
+    response = run(api.post("/api/auth/register", json={"email": email, "password": password, "firstName": "Ada"}))
+    assert response.status_code == 201, response.text
+    return response.json()
+
+def _login(api, run, username, password):
+    return run(api.post("/api/auth/login", data={"username": username, "password": password}))
+
+def test_login_succeeds_for_any_email_case(api, run):
+    user = _register(api, run)
+    assert user["email"] == "ada@example.com"
+
+    for username in ("ada@example.com", "  ADA@example.COM "):
+        response = _login(api, run, username, "correct horse")
+        assert response.status_code == 200, response.text
+        assert response.json()["token_type"] == "bearer"
+
+    me = run(api.get("/api/auth/me", headers={"Authorization": f"Bearer {response.json()['access_token']}"}))
+    assert me.status_code == 200 and me.json()["email"] == "ada@example.com"
+
+def _legacy_user(server, db, run, email, password="correct horse"):
+    # Stored the way registration did before emails were lowercased: case as typed
+    user_id = uuid.uuid4()
+    run(db.users.insert_one({
+        "_id": user_id, "email": email, "firstName": "John", "lastName": None, "disabled": False, "isAdmin": False,
+        "hashed_password": run(server.password_hasher.hash(password)), "createdAt": datetime.utcnow(),
+    }))
+    return user_id
+
+def test_mixed_case_legacy_account_can_log_in_after_migration(server, api, db, run):
+    user_id = _legacy_user(server, db, run, "John.Doe@Example.com")
+    assert run(server.lowercase_user_emails()) == 1
+    assert run(db.users.find_one({"_id": user_id}))["email"] == "john.doe@example.com"
+
+    for username in ("John.Doe@Example.com", "john.doe@example.com"):
+        response = _login(api, run, username, "correct horse")
+        assert response.status_code == 200, response.text
+    me = run(api.get("/api/auth/me", headers={"Authorization": f"Bearer {response.json()['access_token']}"}))
+    assert me.status_code == 200 and me.json()["_id"] == str(user_id)
+
+    response = run(api.post("/api/dev/make-admin/John.Doe@Example.com"))
+    assert response.status_code == 200, response.text
+    assert run(db.users.find_one({"_id": user_id}))["isAdmin"] is True
+    # Already lowercase: nothing left to migrate
+    assert run(server.lowercase_user_emails()) == 0
+
+def test_email_migration_skips_collisions(server, db, run):
+    original_id = _legacy_user(server, db, run, "ada@example.com")
+    duplicate_id = _legacy_user(server, db, run, "Ada@Example.com")
+    assert run(server.lowercase_user_emails()) == 0
+    assert run(db.users.find_one({"_id": duplicate_id}))["email"] == "Ada@Example.com"
+    assert run(db.users.find_one({"_id": original_id}))["email"] == "ada@example.com"
+
+def test_repeated_bad_passwords_are_throttled(server, api, run, monkeypatch):
+    # No backoff sleeps, so the test only counts attempts
+    monkeypatch.setattr(server, "login_guard", LoginGuard(account_limit=5, base_delay=0))
+    _register(api, run)
+
+    for attempt in range(5):
+        response = _login(api, run, "ada@example.com" if attempt % 2 else "ADA@example.com", "wrong")
+        assert response.status_code == 401, response.text
+
+    # Rejected before bcrypt runs, even with the right password
+    response = _login(api, run, "ada@example.com", "correct horse")
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert server.login_guard.rejected == 1
+
+def test_role_change_revokes_existing_tokens(server, api, run):
+    _register(api, run)
+    old_token = _login(api, run, "ada@example.com", "correct horse").json()["access_token"]
+
+    response = run(api.post("/api/dev/make-admin/ada@example.com"))
+    assert response.status_code == 200, response.text
+
+    # The old token still says adm=False; it must not outlive the role change
+    response = run(api.get("/api/auth/me", headers={"Authorization": f"Bearer {old_token}"}))
+    assert response.status_code == 401
+    new_token = _login(api, run, "ada@example.com", "correct horse").json()["access_token"]
+    claims = server.decode_token(new_token)
+    assert claims["adm"] is True and claims["ver"] == 1
+    response = run(api.get("/api/auth/me", headers={"Authorization": f"Bearer {new_token}"}))
+    assert response.status_code == 200
+
+def test_concurrent_burst_is_throttled_before_bcrypt(server, api, run, monkeypatch):
+    monkeypatch.setattr(server, "login_guard", LoginGuard(account_limit=5, base_delay=0))
+    _register(api, run)
+    verified = []
+    verify_password = server.verify_password
+
+    async def counting_verify(*args):
+        verified.append(args)
+        return await verify_password(*args)
+
+    monkeypatch.setattr(server, "verify_password", counting_verify)
+
+    async def burst():
+        # All 12 reach the guard before the first bcrypt verdict lands
+        return await asyncio.gather(*[
+            api.post("/api/auth/login", data={"username": "ada@example.com", "password": "wrong"}) for _ in range(12)
+        ])
+
+    statuses = sorted(response.status_code for response in run(burst()))
+    assert statuses == [401] * 5 + [429] * 7
+    assert len(verified) == 5
+    assert server.login_guard.get_stats()["in_flight"] == 0
+
+def test_guard_slot_is_released_without_a_verdict(run):
+    guard = LoginGuard(account_limit=1, base_delay=0)
+    run(guard.check("10.0.0.1", "ada@example.com"))
+    with pytest.raises(LoginThrottled):
+        run(guard.check("10.0.0.2", "ADA@example.com"))
+    guard.release("10.0.0.1", "ada@example.com")
+    run(guard.check("10.0.0.2", "ada@example.com"))
+    guard.record_success("10.0.0.2", "ada@example.com")
+    assert guard.ip_in_flight == guard.account_in_flight == {}
+
+def _refresh(api, run, refresh_token):
+    return run(api.post("/api/auth/refresh", json={"refresh_token": refresh_token}))
+
+def test_refresh_retry_within_grace_gets_the_same_successor(api, run):
+    _register(api, run)
+    refresh_token = _login(api, run, "ada@example.com", "correct horse").json()["refresh_token"]
+
+    # The client never saw the first response (e.g. a timeout) and retries with the same token
+    first = _refresh(api, run, refresh_token)
+    retry = _refresh(api, run, refresh_token)
+    assert first.status_code == retry.status_code == 200, retry.text
+    assert retry.json()["refresh_token"] == first.json()["refresh_token"]
+    assert retry.json()["access_token"] == first.json()["access_token"]
+
+    # The session survives: the successor still rotates
+    assert _refresh(api, run, first.json()["refresh_token"]).status_code == 200
+
+def test_refresh_reuse_after_grace_ends_every_session(server, api, run, monkeypatch):
+    monkeypatch.setattr(server, "REFRESH_TOKEN_REUSE_GRACE", 0)
+    _register(api, run)
+    refresh_token = _login(api, run, "ada@example.com", "correct horse").json()["refresh_token"]
+    successor = _refresh(api, run, refresh_token).json()
+
+    assert _refresh(api, run, refresh_token).status_code == 401
+    assert _refresh(api, run, successor["refresh_token"]).status_code == 401
+    me = run(api.get("/api/auth/me", headers={"Authorization": f"Bearer {successor['access_token']}"}))
+    assert me.status_code == 401
+
+def test_logged_out_refresh_token_is_not_revived(api, run):
+    _register(api, run)
+    tokens = _login(api, run, "ada@example.com", "correct horse").json()
+    response = run(api.post("/api/auth/logout", json={"refresh_token": tokens["refresh_token"]},
+                            headers={"Authorization": f"Bearer {tokens['access_token']}"}))
+    assert response.status_code == 204
+
+    assert _refresh(api, run, tokens["refresh_token"]).status_code == 401
@@ -0,0 +1,62 @@
+import csv
+import io
+import random
+
+from utils.bulk_io import iter_csv
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+def _parse(run, text: str, chunk_size: int = 7):
+    async def collect():
+        return [row async for row in iter_csv(_chunks(text.encode(), chunk_size))]
+    return run(collect())
+
+def test_literal_quote_in_unquoted_field(run):
+    rows = _parse(run, 'name,price\nvalve 3/4" brass,10\np0,0\np1,1\n')
+    assert rows == [
+        (2, {"name": 'valve 3/4" brass', "price": "10"}, None),
+        (3, {"name": "p0", "price": "0"}, None),
+        (4, {"name": "p1", "price": "1"}, None),
+    ]
+
+def test_quoted_fields_span_lines(run):
+    rows = _parse(run, 'name,description,price\r\n"Heater","Line one\r\nsays ""hot""\r\n\r\nend",5\r\n\r\nPump,,6')
+    assert rows == [
+        (2, {"name": "Heater", "description": 'Line one\nsays "hot"\n\nend', "price": "5"}, None),
+        (7, {"name": "Pump", "price": "6"}, None),
+    ]
+
+def test_unterminated_and_oversized_quoted_fields(run):
+    rows = _parse(run, 'name,price\nok,1\n"never closed,2\nstill open,3\n')
+    assert rows[0] == (2, {"name": "ok", "price": "1"}, None)
+    assert rows[-1] == (3, None, "Unterminated quoted field")
+
+    limit = csv.field_size_limit()
+    rows = _parse(run, 'name,price\n"' + "x\n" * limit + '",1\nok,2\n', chunk_size=65536)
+    assert rows[0][1] is None and rows[0][2].startswith("Quoted field longer than")
+
+def test_matches_csv_reader(run):
+    # Same records as csv.reader over the whole text, whatever the quoting and chunking
+    rng = random.Random(7)
+    alphabet = ['a', 'b', ' ', ',', '"', '\n', '3/4"']
+    for _ in range(300):
+        header = ["name", "description", "price"]
+        lines = [",".join(header)]
+        for _ in range(rng.randint(1, 5)):
+            fields = []
+            for _ in range(3):
+                value = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+                # Unquoted values may hold literal quotes, just not lead with one
+                quoted = rng.random() < 0.5 or value.startswith('"') or "\n" in value or "," in value
+                fields.append('"' + value.replace('"', '""') + '"' if quoted else value)
+            lines.append(",".join(fields))
+        text = "\n".join(lines) + "\n"
+
+        expected = [values for values in csv.reader(io.StringIO(text)) if values][1:]
+        rows = _parse(run, text, chunk_size=rng.randint(1, 16))
+        assert all(error is None for _, _, error in rows), text
+        assert len(rows) == len(expected), text
+        for (_, record, _), values in zip(rows, expected):
+            assert record == {column: value.strip() for column, value in zip(header, values) if value.strip()}, text
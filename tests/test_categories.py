@@ -0,0 +1,149 @@
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+
+from utils import category_cache
+from utils.category_cache import CategoryCache
+from utils.category_resolver import CategoryResolver
+
+class CountingCollection:
+    """Counts find() calls on the wrapped collection; watch() replays queued change events"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        self.finds = 0
+        self.changes = asyncio.Queue()
+
+    def find(self, *args, **kwargs):
+        self.finds += 1
+        return self.collection.find(*args, **kwargs)
+
+    def watch(self):
+        return ChangeStream(self.changes)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+class ChangeStream:
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+def _categories(db, run, count=3):
+    now = datetime.utcnow()
+    categories = [{"_id": uuid.uuid4(), "name": f"Category {n}", "createdAt": now, "updatedAt": now} for n in range(count)]
+    run(db.categories.insert_many(categories))
+    return categories
+
+def _products(categories, count=20):
+    return [{"_id": uuid.uuid4(), "name": f"Product {n}", "category_id": categories[n % len(categories)]["_id"]}
+            for n in range(count)]
+
+def test_resolver_populates_a_page_with_one_query(server, db, run):
+    categories = _categories(db, run)
+    collection = CountingCollection(db.categories)
+    resolver = CategoryResolver(collection, server.CategoryPublic)
+
+    products = run(resolver.populate([*_products(categories), {"_id": uuid.uuid4(), "name": "Uncategorised"}]))
+    assert collection.finds == 1
+    assert [product["category"].name for product in products[:3]] == ["Category 0", "Category 1", "Category 2"]
+    assert "category" not in products[-1]
+
+def test_cache_serves_pages_from_one_snapshot(server, db, run):
+    categories = _categories(db, run)
+    collection = CountingCollection(db.categories)
+    cache = CategoryCache(collection, server.CategoryPublic)
+
+    for _ in range(3):
+        products = run(cache.populate(_products(categories)))
+        assert all(product["category"].id == product["category_id"] for product in products)
+    assert collection.finds == 1
+    assert cache.get_stats()["hits"] == 2
+
+def test_unknown_categories_are_cached_briefly(server, db, run, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(category_cache, "time", clock)
+    _categories(db, run)
+    collection = CountingCollection(db.categories)
+    cache = CategoryCache(collection, server.CategoryPublic)
+    stale_id = uuid.uuid4()
+
+    assert run(cache.get(stale_id)) is None
+    assert collection.finds == 2 # The snapshot, then the fallback for the unknown ID
+    assert run(cache.get(stale_id)) is None
+    assert collection.finds == 2
+    assert cache.get_stats()["negative_hits"] == 1
+
+    # Once the negative entry expires the ID is looked up again
+    clock.now += cache.negative_ttl
+    assert run(cache.get(stale_id)) is None
+    assert collection.finds == 3
+
+def test_invalidation_forgets_unknown_categories(server, db, run):
+    collection = CountingCollection(db.categories)
+    cache = CategoryCache(collection, server.CategoryPublic)
+    category_id = uuid.uuid4()
+    assert run(cache.get(category_id)) is None
+
+    run(db.categories.insert_one({"_id": category_id, "name": "Solar", "createdAt": datetime.utcnow(),
+                                  "updatedAt": datetime.utcnow()}))
+    cache.invalidate()
+    assert run(cache.get(category_id)).name == "Solar"
+
+@pytest.mark.parametrize("operation", ["update", "delete"])
+def test_change_stream_invalidates_on_update_and_delete(server, db, run, operation):
+    category = _categories(db, run, count=1)[0]
+    collection = CountingCollection(db.categories)
+    cache = CategoryCache(collection, server.CategoryPublic)
+
+    async def scenario():
+        assert (await cache.get(category["_id"])).name == "Category 0"
+        cache.start_watching()
+        try:
+            await asyncio.sleep(0) # Let the watcher open its stream
+            if operation == "update":
+                await db.categories.update_one({"_id": category["_id"]}, {"$set": {"name": "Renamed"}})
+            else:
+                await db.categories.delete_one({"_id": category["_id"]})
+            await collection.changes.put({"operationType": operation, "documentKey": {"_id": category["_id"]}})
+            await asyncio.sleep(0)
+            return await cache.get(category["_id"])
+        finally:
+            await cache.stop_watching()
+
+    resolved = run(scenario())
+    assert (resolved.name if resolved else None) == ("Renamed" if operation == "update" else None)
+
+def test_created_category_is_visible_immediately(server, api, run):
+    response = run(api.post("/api/auth/register", json={"email": "editor@example.com", "password": "pw-editor-1"}))
+    assert response.status_code == 201
+    token = run(api.post("/api/auth/login", data={"username": "editor@example.com", "password": "pw-editor-1"})).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    server.product_category_resolver.invalidate()
+
+    assert run(api.get("/api/products/categories")).json() == []
+    category = run(api.post("/api/products/categories", json={"name": "Pumps"}, headers=headers)).json()
+    assert [listed["name"] for listed in run(api.get("/api/products/categories")).json()] == ["Pumps"]
+
+    product = run(api.post("/api/products/", headers=headers,
+                           json={"name": "Booster pump", "price": 125000, "stock_quantity": 4, "category_id": category["_id"]}))
+    assert product.status_code == 201, product.text
+    assert product.json()["category"]["name"] == "Pumps"
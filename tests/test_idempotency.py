@@ -0,0 +1,105 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from starlette.responses import JSONResponse
+
+from utils.idempotency import (
+    NOT_REPLAYABLE_HEADERS, IdempotencyInFlight, IdempotencyKeyReused, IdempotencyStore,
+)
+
+class CountingHandler:
+    def __init__(self, status_code=201, headers=None, delay=0.0, error=None):
+        self.calls = 0
+        self.status_code = status_code
+        self.headers = headers
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return JSONResponse({"call": self.calls}, status_code=self.status_code, headers=self.headers)
+
+def test_retry_replays_the_stored_response(db, run):
+    store = IdempotencyStore(db.idempotency_keys)
+    handler = CountingHandler()
+
+    first = run(store.run("key-1", "orders", "body-a", handler))
+    replay = run(store.run("key-1", "orders", "body-a", handler))
+    assert handler.calls == 1
+    assert (replay.status_code, replay.body) == (201, first.body)
+    assert replay.headers["idempotent-replayed"] == "true"
+    # Another scope, or no key at all, runs the handler
+    run(store.run("key-1", "payments", "body-a", handler))
+    run(store.run(None, "orders", "body-a", handler))
+    assert handler.calls == 3
+    assert store.get_stats()["replayed"] == 1
+
+def test_key_reused_for_a_different_body_is_rejected(db, run):
+    store = IdempotencyStore(db.idempotency_keys)
+    handler = CountingHandler()
+    run(store.run("key-1", "orders", "body-a", handler))
+    with pytest.raises(IdempotencyKeyReused):
+        run(store.run("key-1", "orders", "body-b", handler))
+    assert handler.calls == 1
+
+def test_concurrent_duplicate_waits_for_the_first_response(db, run):
+    # A long poll interval: the duplicate only finishes quickly if it waits on the local future
+    store = IdempotencyStore(db.idempotency_keys, poll_interval=5, max_poll_interval=5)
+    handler = CountingHandler(delay=0.05)
+
+    async def duplicates():
+        return await asyncio.gather(*[store.run("key-1", "orders", "body-a", handler) for _ in range(2)])
+
+    started_at = time.monotonic()
+    first, second = run(duplicates())
+    assert time.monotonic() - started_at < 1
+    assert handler.calls == 1
+    assert first.body == second.body
+    assert second.headers["idempotent-replayed"] == "true"
+    assert store.get_stats()["waited"] == 1
+
+def test_expired_lock_is_taken_over(db, run):
+    store = IdempotencyStore(db.idempotency_keys, wait_timeout=0.05, poll_interval=0.01)
+    now = datetime.utcnow()
+    handler = CountingHandler()
+
+    # A holder that died mid-request, lock still valid: the retry is told to come back later
+    run(db.idempotency_keys.insert_one({"_id": "orders:key-1", "fingerprint": "body-a", "owner": "dead",
+                                        "lockedUntil": now + timedelta(seconds=30), "expiresAt": now + timedelta(days=1)}))
+    with pytest.raises(IdempotencyInFlight) as excinfo:
+        run(store.run("key-1", "orders", "body-a", handler))
+    assert excinfo.value.retry_after >= 1 and handler.calls == 0
+
+    # Once the lock lapses the retry takes it over and stores its own response
+    run(db.idempotency_keys.update_one({"_id": "orders:key-1"}, {"$set": {"lockedUntil": now - timedelta(seconds=1)}}))
+    run(store.run("key-1", "orders", "body-a", handler))
+    record = run(db.idempotency_keys.find_one({"_id": "orders:key-1"}))
+    assert handler.calls == 1 and record["owner"] != "dead" and "response" in record
+
+def test_exceptions_are_not_stored(db, run):
+    store = IdempotencyStore(db.idempotency_keys)
+    failing = CountingHandler(error=RuntimeError("gateway down"))
+    with pytest.raises(RuntimeError):
+        run(store.run("key-1", "orders", "body-a", failing))
+    assert run(db.idempotency_keys.find_one({"_id": "orders:key-1"})) is None
+
+    handler = CountingHandler()
+    assert run(store.run("key-1", "orders", "body-a", handler)).status_code == 201
+    assert handler.calls == 1
+
+@pytest.mark.parametrize("handler", [
+    CountingHandler(status_code=503),
+    CountingHandler(status_code=200, headers=NOT_REPLAYABLE_HEADERS),
+], ids=["server-error", "no-store"])
+def test_interim_responses_are_not_stored(db, run, handler):
+    store = IdempotencyStore(db.idempotency_keys)
+    run(store.run("key-1", "orders", "body-a", handler))
+    second = run(store.run("key-1", "orders", "body-a", handler))
+    assert handler.calls == 2
+    assert "idempotent-replayed" not in second.headers
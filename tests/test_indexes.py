@@ -0,0 +1,37 @@
+"""Hot query plans; the explain() checks need TEST_MONGO_URL"""
+from datetime import datetime
+
+from utils.indexes import HOT_QUERIES, INDEXES, _plan_stages, check_hot_queries, ensure_indexes
+
+def test_plan_stages_walks_classic_and_sbe_plans():
+    classic = {"stage": "FETCH", "inputStage": {"stage": "SORT_MERGE", "inputStages": [
+        {"stage": "IXSCAN"}, {"stage": "IXSCAN"},
+    ]}}
+    sbe = {"queryPlan": {"stage": "PROJECTION", "inputStage": {"stage": "COLLSCAN"}}}
+    assert sorted(_plan_stages(classic)) == ["FETCH", "IXSCAN", "IXSCAN", "SORT_MERGE"]
+    assert "COLLSCAN" in _plan_stages(sbe)
+
+def _seed(db, run):
+    # Non-empty collections, so the planner has to choose between an index and a scan
+    async def seed():
+        for collection in {query.collection for query in HOT_QUERIES}:
+            await db[collection].insert_many([
+                {"name": f"Water heater {n}", "description": "Storage water heater", "email": f"user{n}@example.com",
+                 "updatedAt": datetime(2023, 1, 1), "createdAt": datetime(2023, 1, 1)}
+                for n in range(20)
+            ])
+    run(seed())
+
+def test_hot_queries_scan_without_indexes(real_db, run):
+    # The check must be able to fail: the text search errors without its index, so it's left out
+    _seed(real_db, run)
+    queries = [query for query in HOT_QUERIES if "$text" not in query.filter]
+    scans = run(check_hot_queries(real_db, queries))
+    assert {scan["name"] for scan in scans} == {query.name for query in queries}
+
+def test_hot_queries_use_indexes(real_db, run):
+    _seed(real_db, run)
+    created = run(ensure_indexes(real_db))
+    assert len(created) == len(INDEXES)
+    scans = run(check_hot_queries(real_db))
+    assert scans == [], [f"{scan['name']}: {scan['stages']}" for scan in scans]
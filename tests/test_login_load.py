@@ -0,0 +1,114 @@
+"""Logins keep bcrypt off the event loop; p99 of the product listing under login load is an opt-in benchmark"""
+import asyncio
+import itertools
+import os
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+from utils.passwords import MIN_ROUNDS, measure_hash_time
+
+LOGIN_WORKERS = 8
+REQUESTS = 200
+
+def _p99(latencies):
+    return statistics.quantiles(latencies, n=100)[98]
+
+def test_logins_hash_in_the_thread_pool(server, api, db, run, monkeypatch):
+    context = server.password_hasher.context
+    threads = []
+    for name in ("hash", "verify", "verify_and_update"):
+        method = getattr(context, name)
+
+        def recording(*args, _method=method, **kwargs):
+            threads.append(threading.current_thread().name)
+            return _method(*args, **kwargs)
+
+        monkeypatch.setattr(context, name, recording)
+    monkeypatch.setattr(server.password_hasher, "_dummy_hash", None)
+    completed = server.password_hasher.get_stats()["completed"]
+
+    async def scenario():
+        response = await api.post("/api/auth/register", json={"email": "load@example.com", "password": "pw-load-123"})
+        assert response.status_code == 201
+        logins = [api.post("/api/auth/login", data={"username": "load@example.com", "password": "pw-load-123"})
+                  for _ in range(4)]
+        responses = await asyncio.gather(*logins)
+        for n in range(2):
+            responses.append(await api.post("/api/auth/login", data={"username": f"nobody{n}@example.com", "password": "x"}))
+        return responses
+
+    statuses = [response.status_code for response in run(scenario())]
+    assert statuses == [200] * 4 + [401] * 2
+    # Registration, four verifies, and for unknown accounts one dummy hash plus a verify each
+    assert len(threads) == 8 and server.password_hasher.get_stats()["completed"] - completed == 8
+    assert all(name.startswith("password-hasher") for name in threads), threads
+
+@pytest.mark.benchmark
+def test_product_list_p99_during_logins(server, api, db, run):
+    now = datetime.utcnow()
+    run(db.products.insert_many([
+        {"_id": uuid.uuid4(), "name": f"Pump {n}", "price": 1000.0 + n, "stock_quantity": 5, "images": [],
+         "createdAt": now, "updatedAt": now}
+        for n in range(50)
+    ]))
+    # Production-grade cost, so each login holds a core for tens of milliseconds
+    server.password_hasher.set_rounds(MIN_ROUNDS)
+    hash_ms = measure_hash_time(MIN_ROUNDS) * 1000
+    # A distinct query each time, so the response cache never answers
+    offsets = itertools.count()
+
+    async def list_products(count, until=lambda: True):
+        latencies = []
+        n = 0
+        while n < count or not until():
+            n += 1
+            started_at = time.perf_counter()
+            response = await api.get("/api/products/", params={"limit": 20, "skip": next(offsets)})
+            latencies.append((time.perf_counter() - started_at) * 1000)
+            assert response.status_code == 200
+            # mongomock never suspends; give the login tasks their turn like a real client gap would
+            await asyncio.sleep(0)
+        return latencies
+
+    async def scenario():
+        response = await api.post("/api/auth/register", json={"email": "load@example.com", "password": "pw-load-123"})
+        assert response.status_code == 201
+        await list_products(20) # Warm-up
+        baseline = await list_products(REQUESTS)
+
+        stop = asyncio.Event()
+        logins = 0
+
+        async def login_loop():
+            nonlocal logins
+            while not stop.is_set():
+                response = await api.post("/api/auth/login", data={"username": "load@example.com", "password": "pw-load-123"})
+                assert response.status_code == 200, response.text
+                logins += 1
+
+        workers = [asyncio.create_task(login_loop()) for _ in range(LOGIN_WORKERS)]
+        await asyncio.sleep(hash_ms / 1000) # Let the hasher pool fill up
+        try:
+            # Long enough for every worker to get through several logins
+            loaded = await list_products(REQUESTS, until=lambda: logins >= LOGIN_WORKERS * 5)
+        finally:
+            stop.set()
+            await asyncio.gather(*workers)
+        return baseline, loaded, logins
+
+    try:
+        baseline, loaded, logins = run(scenario())
+    finally:
+        server.password_hasher.set_rounds(int(os.environ["PASSWORD_HASH_ROUNDS"]))
+
+    print(f"\nbcrypt {hash_ms:.0f}ms, {logins} logins; /api/products/ p50/p99 "
+          f"{statistics.median(baseline):.1f}/{_p99(baseline):.1f}ms idle, "
+          f"{statistics.median(loaded):.1f}/{_p99(loaded):.1f}ms during logins")
+    assert logins >= LOGIN_WORKERS * 5
+    # bcrypt on the event loop would stall listings for a whole hash at a time
+    assert _p99(loaded) < hash_ms
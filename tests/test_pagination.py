@@ -0,0 +1,64 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.indexes import BLOG_POST_LIST_SORT
+from utils.pagination import apply_cursor, decode_cursor, encode_cursor, next_cursor
+
+BASE = datetime(2024, 5, 1, 12, 0)
+
+def test_cursor_round_trip():
+    values = [BASE, uuid.UUID(int=7), 3, "name", None]
+    assert decode_cursor(encode_cursor(values)) == values
+
+@pytest.mark.parametrize("token", ["not base64!", "eyJhIjoxfQ", "W3siJHgiOjF9XQ", encode_cursor([BASE])])
+def test_malformed_cursor_is_rejected(token):
+    # Garbage, a JSON object rather than a list, an unknown value type, and too few sort values
+    with pytest.raises(ValueError, match="Invalid pagination cursor"):
+        apply_cursor({}, BLOG_POST_LIST_SORT, token)
+
+def _posts():
+    # Ties on publishedAt, and drafts-turned-published with no publishedAt at all
+    dates = [BASE, BASE, BASE - timedelta(days=1), None, BASE + timedelta(days=1), None, BASE, None]
+    posts = []
+    for n, published_at in enumerate(dates):
+        post = {"_id": uuid.UUID(int=n + 1), "title": f"Post {n}", "isPublished": True}
+        if published_at is not None or n % 2:
+            post["publishedAt"] = published_at  # Odd posts store an explicit null, even ones omit the field
+        posts.append(post)
+    return posts
+
+def _walk(db, run, sort, limit, query_filter=None):
+    pages, after = [], None
+    while True:
+        cursor = db.blog_posts.find(apply_cursor(query_filter or {}, sort, after)).sort(sort).limit(limit)
+        page = run(cursor.to_list(length=limit))
+        pages.append([post["_id"] for post in page])
+        after = next_cursor(page, sort, limit)
+        if after is None:
+            return pages
+
+@pytest.mark.parametrize("sort", [BLOG_POST_LIST_SORT, [("publishedAt", 1), ("_id", 1)], [("publishedAt", -1), ("_id", 1)]])
+@pytest.mark.parametrize("limit", [1, 2, 3, 8])
+def test_keyset_pages_cover_every_document_once(db, run, sort, limit):
+    run(db.blog_posts.insert_many(_posts()))
+    expected = [post["_id"] for post in run(db.blog_posts.find().sort(sort).to_list(length=None))]
+
+    pages = _walk(db, run, sort, limit)
+    assert [post_id for page in pages for post_id in page] == expected
+    assert all(len(page) <= limit for page in pages)
+
+def test_blog_listing_pages_past_posts_without_a_publish_date(api, db, run):
+    run(db.blog_posts.insert_many([{**post, "content": "...", "slug": f"post-{n}", "author_id": uuid.uuid4(),
+                                    "createdAt": BASE, "updatedAt": BASE}
+                                   for n, post in enumerate(_posts())]))
+    seen, after = [], None
+    while True:
+        response = run(api.get("/api/blog/", params={"limit": 3, **({"after": after} if after else {})}))
+        assert response.status_code == 200, response.text
+        seen.extend(post["_id"] for post in response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if not after:
+            break
+    assert len(seen) == len(set(seen)) == 8
@@ -0,0 +1,71 @@
+import pytest
+from passlib.hash import bcrypt
+
+from utils import passwords
+from utils.passwords import PasswordHasher, build_context, choose_rounds
+
+def _rounds(hashed_password):
+    return bcrypt.from_string(hashed_password).rounds
+
+@pytest.fixture
+def hash_time(monkeypatch):
+    """Stub bcrypt timing: `base_ms` at MIN_ROUNDS, doubling per round; records the rounds measured"""
+    measured = []
+
+    def measure(base_ms):
+        def measure_hash_time(rounds, samples=3):
+            measured.append(rounds)
+            return base_ms * 2 ** (rounds - passwords.MIN_ROUNDS) / 1000
+        monkeypatch.setattr(passwords, "measure_hash_time", measure_hash_time)
+        return measured
+    return measure
+
+def test_calibration_picks_the_highest_cost_within_budget(hash_time):
+    measured = hash_time(30) # 30, 60, 120 ms...
+    assert choose_rounds(100) == (11, 60)
+    # 12 rounds is estimated at 120 ms from the 11-round measurement, so it's never hashed
+    assert measured == [10, 11]
+
+def test_calibration_never_goes_below_the_floor(hash_time):
+    hash_time(500)
+    assert choose_rounds(100) == (passwords.MIN_ROUNDS, 500)
+    assert choose_rounds(100, min_rounds=8)[0] == 8
+
+def test_calibration_stops_at_the_ceiling(hash_time):
+    measured = hash_time(1)
+    assert choose_rounds(10_000) == (passwords.MAX_ROUNDS, 16)
+    assert max(measured) == passwords.MAX_ROUNDS
+
+def test_calibrate_adopts_the_chosen_cost(run, hash_time):
+    hash_time(40)
+    hasher = PasswordHasher(build_context(4), concurrency=1)
+    try:
+        assert run(hasher.calibrate(200)) == 12
+        assert hasher.get_stats()["rounds"] == 12 and hasher.calibrated_ms == 160
+        assert hasher.context.to_dict()["bcrypt__default_rounds"] == 12
+    finally:
+        hasher.shutdown()
+
+def test_login_rehashes_a_cheaper_hash_at_the_current_cost(server, api, db, run):
+    response = run(api.post("/api/auth/register", json={"email": "ada@example.com", "password": "correct horse"}))
+    assert response.status_code == 201
+    old_hash = run(db.users.find_one({"email": "ada@example.com"}))["hashed_password"]
+    assert _rounds(old_hash) == 4
+
+    # Recalibrated to a higher cost since the account was created
+    rehashed = server.password_hasher.rehashed
+    server.password_hasher.set_rounds(5)
+    try:
+        response = run(api.post("/api/auth/login", data={"username": "ada@example.com", "password": "correct horse"}))
+        assert response.status_code == 200, response.text
+    finally:
+        server.password_hasher.set_rounds(4)
+
+    new_hash = run(db.users.find_one({"email": "ada@example.com"}))["hashed_password"]
+    assert _rounds(new_hash) == 5 and server.password_hasher.rehashed == rehashed + 1
+    assert bcrypt.verify("correct horse", new_hash)
+
+    # A hash at or above the current cost is left alone
+    response = run(api.post("/api/auth/login", data={"username": "ada@example.com", "password": "correct horse"}))
+    assert response.status_code == 200
+    assert run(db.users.find_one({"email": "ada@example.com"}))["hashed_password"] == new_hash
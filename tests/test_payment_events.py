@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from utils.payment_events import FAILED, PENDING, PaymentEventQueue
+from utils.payment_gateways import PaymentEvent
+
+def _event(n: int) -> PaymentEvent:
+    return PaymentEvent(id=f"evt-{n}", provider="paystack", type="charge.success", reference=f"ref-{n}",
+                        order_id=None, successful=True, amount=1000, currency="NGN")
+
+async def _failing_handler(events):
+    raise RuntimeError("order store unavailable")
+
+def test_failed_batch_backs_off_per_event(db, run):
+    queue = PaymentEventQueue(db.payment_events, _failing_handler, max_attempts=4, retry_delay=10)
+
+    async def fail_once():
+        for n, earlier_attempts in enumerate([0, 1, 3]):
+            await queue.enqueue(_event(n))
+            await db.payment_events.update_one({"_id": f"evt-{n}"}, {"$set": {"attempts": earlier_attempts}})
+        assert await queue.process_batch() == 3
+        return {event["_id"]: event async for event in db.payment_events.find()}
+
+    events = run(fail_once())
+    first, second, exhausted = events["evt-0"], events["evt-1"], events["evt-2"]
+    assert first["status"] == second["status"] == PENDING
+    # 10s after a first attempt, 20s after a second: each event keeps its own schedule
+    assert second["availableAt"] - first["availableAt"] == timedelta(seconds=10)
+    assert exhausted["status"] == FAILED
+    assert "leaseUntil" not in first and "leaseUntil" not in exhausted
+    assert queue.get_stats()["failed"] == 1
+    assert queue.get_stats()["failed_batches"] == 1
@@ -0,0 +1,108 @@
+import hashlib
+import hmac
+import uuid
+from datetime import datetime
+
+import httpx
+import pytest
+
+from utils.payment_gateways import FakeGateway, FlutterwaveClient, GatewayClient, PaystackClient
+
+@pytest.fixture
+def gateway(server, run, monkeypatch):
+    fake = FakeGateway()
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake))
+    monkeypatch.setattr(server, "paystack", PaystackClient("sk_test", http, base_url="http://paystack.test", retries=0))
+    yield fake
+    run(http.aclose())
+
+@pytest.fixture
+def customer(api, run):
+    response = run(api.post("/api/auth/register", json={"email": "payer@example.com", "password": "pw-payer-1"}))
+    assert response.status_code == 201
+    token = run(api.post("/api/auth/login", data={"username": "payer@example.com", "password": "pw-payer-1"})).json()["access_token"]
+    return {"id": uuid.UUID(response.json()["_id"]), "headers": {"Authorization": f"Bearer {token}"}}
+
+def _order(db, run, customer, payment_status="pending"):
+    now = datetime.utcnow()
+    order = {"_id": uuid.uuid4(), "customer_id": customer["id"], "shipping_address": "12 Marina Road, Lagos",
+             "total_amount": 10750.0, "status": "pending", "payment_status": payment_status, "items": [],
+             "createdAt": now, "updatedAt": now}
+    run(db.orders.insert_one(order))
+    return order
+
+def _verify(api, run, customer, order, reference):
+    response = run(api.post("/api/payments/verify/paystack", headers=customer["headers"],
+                            json={"transaction_reference": reference, "order_id": str(order["_id"])}))
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_unfinished_payment_leaves_order_payable(api, db, run, gateway, customer):
+    order = _order(db, run, customer)
+    gateway.add_transaction("ref-abandoned", 10750, successful=False, status="abandoned")
+
+    body = _verify(api, run, customer, order, "ref-abandoned")
+    assert body["success"] is False
+    assert run(db.orders.find_one({"_id": order["_id"]}))["payment_status"] == "pending"
+
+    # The customer completes it later; verifying again marks the order paid
+    gateway.add_transaction("ref-abandoned", 10750)
+    body = _verify(api, run, customer, order, "ref-abandoned")
+    assert body["success"] is True and body["order"]["payment_status"] == "paid"
+
+def test_final_failure_marks_order_failed(api, db, run, gateway, customer):
+    order = _order(db, run, customer)
+    gateway.add_transaction("ref-declined", 10750, successful=False)
+
+    assert _verify(api, run, customer, order, "ref-declined")["success"] is False
+    assert run(db.orders.find_one({"_id": order["_id"]}))["payment_status"] == "failed"
+
+def test_paid_order_is_never_downgraded(server, db, run, customer):
+    order = _order(db, run, customer, payment_status="paid")
+
+    # e.g. a failed verify of a stale reference finishing after the webhook marked it paid
+    assert run(server.update_order_payment_status(order["_id"], "failed")) is None
+    assert run(db.orders.find_one({"_id": order["_id"]}))["payment_status"] == "paid"
+    # A second "paid" reports the order as it stands instead of failing
+    assert run(server.update_order_payment_status(order["_id"], "paid", "processing")).payment_status == "paid"
+
+def test_gateway_client_requires_the_gateway_methods():
+    with pytest.raises(TypeError):
+        GatewayClient("secret", None, base_url="https://gateway.test")
+
+def test_idempotent_retry_sees_a_payment_completed_meanwhile(api, db, run, gateway, customer):
+    order = _order(db, run, customer)
+    gateway.add_transaction("ref-pending", 10750, successful=False, status="ongoing")
+    request = {"transaction_reference": "ref-pending", "order_id": str(order["_id"])}
+    headers = {**customer["headers"], "Idempotency-Key": "verify-1"}
+
+    response = run(api.post("/api/payments/verify/paystack", headers=headers, json=request))
+    assert response.status_code == 200 and response.json()["success"] is False
+    assert response.headers["cache-control"] == "no-store"
+
+    # The interim answer wasn't stored, so the retry asks the gateway again
+    gateway.add_transaction("ref-pending", 10750)
+    response = run(api.post("/api/payments/verify/paystack", headers=headers, json=request))
+    assert response.json()["success"] is True and "idempotent-replayed" not in response.headers
+    # The final answer is
+    response = run(api.post("/api/payments/verify/paystack", headers=headers, json=request))
+    assert response.json()["success"] is True and response.headers["idempotent-replayed"] == "true"
+
+@pytest.mark.parametrize("signature", ["", "not-the-signature", "é" * 128, "\udcff"])
+def test_bad_webhook_signatures_are_rejected(signature):
+    body = b'{"event":"charge.success"}'
+    paystack = PaystackClient("sk_test", None, base_url="http://paystack.test")
+    flutterwave = FlutterwaveClient("sk_test", None, base_url="http://flutterwave.test", webhook_hash="hash-secret")
+    assert not paystack.verify_signature(body, {"x-paystack-signature": signature})
+    assert not flutterwave.verify_signature(body, {"verif-hash": signature})
+
+    # Sanity: the genuine signatures still pass
+    expected = hmac.new(b"sk_test", body, hashlib.sha512).hexdigest()
+    assert paystack.verify_signature(body, {"x-paystack-signature": expected})
+    assert flutterwave.verify_signature(body, {"verif-hash": "hash-secret"})
+
+def test_non_ascii_signature_header_is_a_401(api, run, gateway):
+    # Starlette decodes header bytes as latin-1, so this reaches verify_signature as non-ASCII text
+    response = run(api.post("/api/payments/webhooks/paystack", content=b'{"event":"charge.success"}',
+                            headers=[(b"content-type", b"application/json"), (b"x-paystack-signature", "é".encode())]))
+    assert response.status_code == 401
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import principal_cache as principal_cache_module
+from utils.principal_cache import PrincipalCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(principal_cache_module, "time", clock)
+    return clock
+
+def _claims(minutes=30):
+    return {"sub": "ada@example.com", "exp": (datetime.utcnow() + timedelta(minutes=minutes)).timestamp()}
+
+def test_cached_token_hits_until_the_ttl(clock):
+    cache = PrincipalCache(ttl=30)
+    cache.set("header.payload.sig", _claims(), "ada", "ada@example.com")
+
+    claims, user = cache.get("header.payload.sig")
+    assert user == "ada" and claims["sub"] == "ada@example.com"
+    # Same signature with a different payload must not borrow the entry
+    assert cache.get("header.forged.sig") is None
+
+    clock.now += 31
+    assert cache.get("header.payload.sig") is None
+    assert cache.get_stats() == {"size": 0, "hits": 1, "misses": 2, "watching": False}
+
+def test_entries_never_outlive_the_token(clock):
+    cache = PrincipalCache(ttl=30)
+    cache.set("a.b.expired", _claims(minutes=-1), "ada", "ada@example.com")
+    assert cache.get("a.b.expired") is None
+
+    cache.set("a.b.soon", _claims(minutes=0.1), "ada", "ada@example.com")
+    clock.now += 7
+    assert cache.get("a.b.soon") is None
+
+def test_invalidate_user_drops_only_their_tokens(clock):
+    cache = PrincipalCache(ttl=30, max_entries=3)
+    cache.set("a.b.ada1", _claims(), "ada", "ada@example.com")
+    cache.set("a.b.ada2", _claims(), "ada", "ada@example.com")
+    cache.set("a.b.bola", _claims(), "bola", "bola@example.com")
+
+    cache.invalidate_user("ada@example.com")
+    assert cache.get("a.b.ada1") is None and cache.get("a.b.ada2") is None
+    assert cache.get("a.b.bola") is not None
+
+    # Least recently used entries go first past max_entries
+    for n in range(3):
+        cache.set(f"a.b.new{n}", _claims(), "chidi", "chidi@example.com")
+    assert cache.get("a.b.bola") is None and cache.get_stats()["size"] == 3
+
+def _session(api, run, email="ada@example.com"):
+    response = run(api.post("/api/auth/register", json={"email": email, "password": "correct horse"}))
+    assert response.status_code == 201, response.text
+    tokens = run(api.post("/api/auth/login", data={"username": email, "password": "correct horse"})).json()
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
+
+def _me(api, run, headers):
+    return run(api.get("/api/auth/me", headers=headers))
+
+def test_authenticated_requests_reuse_the_cached_user(server, api, run, monkeypatch):
+    headers = _session(api, run)
+    assert _me(api, run, headers).status_code == 200
+
+    async def no_lookup(email):
+        raise AssertionError("users lookup on a cache hit")
+    monkeypatch.setattr(server, "get_user_by_email", no_lookup)
+    hits = server.principal_cache.hits
+    response = _me(api, run, headers)
+    assert response.status_code == 200 and response.json()["email"] == "ada@example.com"
+    assert server.principal_cache.hits == hits + 1
+
+def test_role_change_drops_cached_principals(server, api, run):
+    headers = _session(api, run)
+    assert _me(api, run, headers).json()["isAdmin"] is False
+    assert server.principal_cache.get(headers["Authorization"].split()[1]) is not None
+
+    assert run(api.post("/api/dev/make-admin/ada@example.com")).status_code == 200
+    assert server.principal_cache.get(headers["Authorization"].split()[1]) is None
+    assert _me(api, run, headers).status_code == 401
+
+def test_revoked_sessions_are_not_served_from_the_cache(server, api, run):
+    headers = _session(api, run)
+    other = _session(api, run, "bola@example.com")
+    assert _me(api, run, headers).status_code == 200
+    assert _me(api, run, other).status_code == 200
+
+    assert run(api.post("/api/auth/logout-all", headers=headers)).status_code == 204
+    assert _me(api, run, headers).status_code == 401
+    assert _me(api, run, other).status_code == 200
+
+def test_logout_revokes_a_cached_token(api, run):
+    headers = _session(api, run)
+    assert _me(api, run, headers).status_code == 200
+
+    assert run(api.post("/api/auth/logout", headers=headers)).status_code == 204
+    assert _me(api, run, headers).status_code == 401
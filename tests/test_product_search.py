@@ -0,0 +1,37 @@
+import uuid
+from datetime import datetime
+
+def _product(name: str, price: float, stock: int, category_id=None):
+    now = datetime.utcnow()
+    return {"_id": uuid.uuid4(), "name": name, "description": f"{name} for homes and offices", "price": price,
+            "stock_quantity": stock, "category_id": category_id, "images": [], "createdAt": now, "updatedAt": now}
+
+def test_faceted_search_falls_back_to_regex(server, api, db, run, monkeypatch):
+    category_id = uuid.uuid4()
+    run(db.categories.insert_one({"_id": category_id, "name": "Water Heaters", "createdAt": datetime.utcnow()}))
+    run(db.products.insert_many([
+        _product("Storage water heater 50L", 85000, 3, category_id),
+        _product("Instant water heater", 42000, 0, category_id),
+        _product("Solar inverter 5kVA", 650000, 2),
+    ]))
+    server.product_facet_cache.clear()
+    monkeypatch.setattr(server, "PRODUCT_SEARCH_ENGINE", "text")
+
+    # mongomock has no $text; fail it the way MongoDB does without a text index
+    collection_type = type(db.products)
+    aggregate = collection_type.aggregate
+    def aggregate_without_text(self, pipeline, *args, **kwargs):
+        if "$text" in pipeline[0].get("$match", {}):
+            raise server.OperationFailure("text index required for $text query", code=27)
+        return aggregate(self, pipeline, *args, **kwargs)
+    monkeypatch.setattr(collection_type, "aggregate", aggregate_without_text)
+
+    response = run(api.get("/api/products/search/facets", params={"q": "water heater", "in_stock": "true"}))
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert [hit["name"] for hit in body["hits"]] == ["Storage water heater 50L"]
+    assert body["hits"][0]["_id"] and body["hits"][0]["category"]["name"] == "Water Heaters"
+    # Facets count the base match, not the in_stock refinement
+    assert body["total"] == 1
+    assert body["facets"]["availability"] == {"in_stock": 1, "out_of_stock": 1}
+    assert body["facets"]["categories"] == [{"category_id": str(category_id), "name": "Water Heaters", "count": 2}]
@@ -0,0 +1,154 @@
+import pytest
+
+from middleware import rate_limit
+from middleware.rate_limit import (
+    GCRA, MemoryRateLimitBackend, RateLimiter, RedisRateLimitBackend, SQLiteRateLimitBackend,
+)
+
+class FakeClock:
+    """Stands in for the `time` module inside middleware.rate_limit"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+def test_gcra_admits_a_full_burst_then_one_per_interval():
+    gcra = GCRA(limit=10, period=60)
+    assert [gcra.hit("ip", now=0) for _ in range(10)] == [0.0] * 10
+    assert gcra.hit("ip", now=0) == pytest.approx(6)
+    # Rejections don't consume capacity: one emission interval later exactly one more fits
+    assert gcra.hit("ip", now=5.9) == pytest.approx(0.1)
+    assert gcra.hit("ip", now=6) == 0.0
+    assert gcra.hit("ip", now=6) == pytest.approx(6)
+    # Idle for a whole period: the full burst is available again
+    assert [gcra.hit("ip", now=66) for _ in range(10)] == [0.0] * 10
+
+def test_gcra_evicts_expired_and_least_recent_keys():
+    gcra = GCRA(limit=10, period=60, max_keys=2)
+    gcra.hit("a", now=0)
+    gcra.hit("b", now=0)
+    gcra.hit("c", now=1)
+    assert len(gcra) == 2 and gcra.peek("a", now=1)[0] == pytest.approx(7)
+    gcra.hit("d", now=100) # Every older TAT has passed
+    assert len(gcra) == 1
+
+def test_memory_backend_takes_from_every_rule_or_none(run, clock):
+    backend = MemoryRateLimitBackend()
+    rules = [(10, 60), (3, 3600)]
+    assert [run(backend.acquire("ip", rules)) for _ in range(3)] == [0.0] * 3
+    assert run(backend.acquire("ip", rules)) == pytest.approx(1200)
+    # The hour rule's denial left the minute rule untouched
+    assert run(backend.acquire("ip", [(10, 60)], 7)) == 0.0
+
+def test_limiter_burst_and_retry_after(run, clock):
+    limiter = RateLimiter(per_minute=5, block_duration=900)
+    assert [run(limiter.check("ip"))[0] for _ in range(5)] == [True] * 5
+    allowed, retry_after, blocked = run(limiter.check("ip"))
+    assert (allowed, blocked) == (False, False) and retry_after == pytest.approx(12)
+    # Other keys have their own budget
+    assert run(limiter.check("other"))[0] is True
+
+    clock.advance(12)
+    assert run(limiter.check("ip"))[0] is True
+    assert run(limiter.check("ip"))[0] is False
+
+def test_denials_are_served_locally_until_retry_after(run, clock):
+    limiter = RateLimiter(per_minute=5)
+    for _ in range(6):
+        run(limiter.check("ip"))
+    calls = limiter.backend_calls
+
+    clock.advance(5)
+    allowed, retry_after, _ = run(limiter.check("ip"))
+    assert allowed is False and retry_after == pytest.approx(7)
+    assert limiter.local_hits == 1
+
+    clock.advance(7)
+    assert run(limiter.check("ip"))[0] is True
+    assert limiter.backend_calls > calls
+
+def test_persistent_offender_is_blocked(run, clock):
+    limiter = RateLimiter(per_minute=5, block_duration=900)
+    for _ in range(5):
+        run(limiter.check("ip"))
+
+    # Hammering during retry_after: every denial counts, including the locally cached ones
+    results = []
+    for _ in range(10):
+        results.append(run(limiter.check("ip")))
+        clock.advance(0.1)
+    assert [blocked for _, _, blocked in results] == [False] * 5 + [True] * 5
+    assert limiter.blocks == 1
+    assert results[-1][1] == pytest.approx(900 - 0.4)
+
+    # The block outlasts the request limit's own retry_after, then expires
+    clock.advance(60)
+    assert run(limiter.check("ip")) == (False, pytest.approx(900 - 60.5), True)
+    clock.advance(900)
+    assert run(limiter.check("ip"))[0] is True
+
+def test_client_within_its_limit_is_never_blocked(run, clock):
+    limiter = RateLimiter(per_minute=60)
+    for _ in range(600):
+        assert run(limiter.check("ip"))[0] is True
+        clock.advance(1)
+    assert limiter.blocks == 0 and limiter.limited == 0
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path, monkeypatch, run, clock):
+    if request.param == "memory":
+        backend = MemoryRateLimitBackend()
+    elif request.param == "sqlite":
+        backend = SQLiteRateLimitBackend(str(tmp_path / "rate_limits.db"))
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa") # The GCRA script runs as Lua
+        import redis.asyncio
+
+        # Redis keeps its own clock (TIME), so these scenarios don't advance the fake one
+        monkeypatch.setattr(redis.asyncio, "from_url", lambda url: fakeredis.FakeAsyncRedis())
+        backend = RedisRateLimitBackend("redis://fake")
+    yield backend
+    run(backend.close())
+
+def test_backend_takes_from_every_rule_or_none(run, backend):
+    rules = [(10, 60), (3, 3600)]
+    assert [run(backend.acquire("ip", rules)) for _ in range(3)] == [0.0] * 3
+    assert run(backend.acquire("ip", rules)) == pytest.approx(1200, abs=0.01)
+    assert run(backend.acquire("ip", [(10, 60)], 7)) == 0.0
+    assert run(backend.acquire("ip", [(10, 60)])) == pytest.approx(6, abs=0.01)
+
+def test_workers_share_one_budget(run, backend):
+    # Two limiters over one backend stand in for two uvicorn workers
+    first, second = RateLimiter(per_minute=5, backend=backend), RateLimiter(per_minute=5, backend=backend)
+    assert [run(limiter.check("ip"))[0] for limiter in (first, second, first, second, first)] == [True] * 5
+    for limiter in (first, second):
+        allowed, retry_after, blocked = run(limiter.check("ip"))
+        assert (allowed, blocked) == (False, False) and retry_after == pytest.approx(12, abs=0.01)
+
+def test_block_applies_on_every_worker(run, backend):
+    offender, other_worker = RateLimiter(per_minute=5, backend=backend), RateLimiter(per_minute=5, backend=backend)
+    results = [run(offender.check("ip")) for _ in range(11)]
+    assert results[-1][2] is True and offender.blocks == 1
+    assert run(backend.blocked_for("ip")) == pytest.approx(900, abs=0.01)
+
+    allowed, retry_after, blocked = run(other_worker.check("ip"))
+    assert (allowed, blocked) == (False, True) and retry_after == pytest.approx(900, abs=0.01)
+    assert run(other_worker.check("someone-else"))[0] is True
@@ -0,0 +1,143 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+from utils.payment_gateways import FakeGateway, PaystackClient
+from utils.reconciliation import PaymentReconciler
+
+STALE = datetime.utcnow() - timedelta(hours=1)
+
+@pytest.fixture
+def fake_gateway():
+    return FakeGateway()
+
+@pytest.fixture
+def paystack(fake_gateway, run):
+    http = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_gateway))
+    yield PaystackClient("sk_test", http, base_url="http://paystack.test", retries=0)
+    run(http.aclose())
+
+@pytest.fixture
+def paid_batches():
+    return []
+
+@pytest.fixture
+def reconciler(db, paystack, paid_batches):
+    async def on_paid(order_ids):
+        # Runs before bulk_write flips the orders, so their stock is committed first
+        statuses = [order["payment_status"] async for order in db.orders.find({"_id": {"$in": order_ids}})]
+        paid_batches.append((sorted(order_ids), statuses))
+
+    return PaymentReconciler(db.orders, {"paystack": paystack}, on_paid=on_paid, rate=0, min_age=600, max_attempts=3)
+
+def _order(db, run, reference, payment_status="pending", total=10750.0, updated_at=STALE, **fields):
+    order = {"_id": uuid.uuid4(), "total_amount": total, "status": "pending", "payment_status": payment_status,
+             "payment_provider": "paystack", "payment_reference": reference, "updatedAt": updated_at, **fields}
+    run(db.orders.insert_one(order))
+    return order["_id"]
+
+def _status(db, run, order_id):
+    return run(db.orders.find_one({"_id": order_id}))
+
+def test_paid_order_is_committed_then_marked_paid(db, run, reconciler, fake_gateway, paid_batches):
+    order_id = _order(db, run, "ref-paid", payment_status="error")
+    fake_gateway.add_transaction("ref-paid", 10750)
+
+    assert run(reconciler.run_once()) == 1
+    order = _status(db, run, order_id)
+    assert (order["payment_status"], order["status"]) == ("paid", "processing")
+    assert paid_batches == [([order_id], ["error"])]
+    assert reconciler.get_stats()["paid"] == 1
+
+def test_amount_mismatch_and_final_failure_fail_the_order(db, run, reconciler, fake_gateway, paid_batches):
+    short = _order(db, run, "ref-short")
+    fake_gateway.add_transaction("ref-short", 5000)
+    declined = _order(db, run, "ref-declined")
+    fake_gateway.add_transaction("ref-declined", 10750, successful=False, status="failed")
+
+    assert run(reconciler.run_once()) == 2
+    assert _status(db, run, short)["payment_status"] == "failed"
+    assert _status(db, run, declined)["payment_status"] == "failed"
+    assert paid_batches == [] and reconciler.failed == 2
+
+def test_undecided_orders_are_retried_until_max_attempts(db, run, reconciler, fake_gateway):
+    order_id = _order(db, run, "ref-abandoned")
+    fake_gateway.add_transaction("ref-abandoned", 10750, successful=False, status="abandoned")
+
+    for attempt in range(1, 4):
+        now = datetime.utcnow() + timedelta(seconds=601 * attempt)
+        assert run(reconciler.reconcile_batch(now)) == 1
+        order = _status(db, run, order_id)
+        assert order["payment_status"] == "pending" and order["reconcile_attempts"] == attempt
+        # Pushed back: not due again until min_age has passed
+        assert run(reconciler.reconcile_batch(now)) == 0
+
+    assert run(reconciler.reconcile_batch(datetime.utcnow() + timedelta(days=1))) == 0
+    assert reconciler.unresolved == 3
+
+def test_recent_orders_and_gateway_errors(db, run, reconciler, fake_gateway):
+    _order(db, run, "ref-recent", updated_at=datetime.utcnow())
+    unknown = _order(db, run, "ref-unknown")
+    fake_gateway.fail_next(5)
+
+    assert run(reconciler.run_once()) == 1
+    assert reconciler.gateway_errors == 1
+    assert _status(db, run, unknown)["reconcile_attempts"] == 1
+
+def test_webhook_landing_mid_batch_wins(db, run, reconciler, paystack, fake_gateway):
+    order_id = _order(db, run, "ref-race")
+    fake_gateway.add_transaction("ref-race", 10750, successful=False, status="failed")
+    verify = paystack.verify
+
+    async def verify_while_webhook_arrives(reference):
+        result = await verify(reference)
+        # The webhook consumer marks the order paid while we wait for the gateway
+        await db.orders.update_one({"_id": order_id}, {"$set": {"payment_status": "paid"}})
+        return result
+
+    paystack.verify = verify_while_webhook_arrives
+    run(reconciler.run_once())
+    assert _status(db, run, order_id)["payment_status"] == "paid"
+
+def test_loop_survives_unexpected_errors(db, run, reconciler, monkeypatch):
+    calls = []
+
+    async def flaky_run_once():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise AttributeError("'str' object has no attribute 'get'") # e.g. a malformed gateway payload
+        return 0
+
+    monkeypatch.setattr(reconciler, "run_once", flaky_run_once)
+    reconciler.interval = 0.01
+
+    async def run_briefly():
+        reconciler.start()
+        await asyncio.sleep(0.1)
+        running = reconciler.get_stats()["running"]
+        await reconciler.stop()
+        return running
+
+    assert run(run_briefly()) is True
+    assert len(calls) > 1
+
+def test_only_the_lease_holder_reconciles(db, run, paystack):
+    first = PaymentReconciler(db.orders, {"paystack": paystack}, leases=db.leases, interval=300)
+    second = PaymentReconciler(db.orders, {"paystack": paystack}, leases=db.leases, interval=300)
+
+    assert run(first.hold_lease()) is True
+    assert run(second.hold_lease()) is False
+    assert run(first.hold_lease()) is True # Renewal
+    assert (first.get_stats()["leader"], second.get_stats()["leader"]) == (True, False)
+
+    # A lapsed lease (its holder died) is taken over
+    run(db.leases.update_one({}, {"$set": {"leaseUntil": datetime.utcnow() - timedelta(seconds=1)}}))
+    assert run(second.hold_lease()) is True
+    assert run(first.hold_lease()) is False
+
+    # Stopping hands it over straight away
+    run(second.release_lease())
+    assert run(first.hold_lease()) is True
@@ -0,0 +1,95 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.reservations import COMMITTED, RELEASED, StockReservations
+from utils.stock import InsufficientStock, StockLedger
+
+@pytest.fixture
+def reservations(db):
+    ledger = StockLedger(None, db.products)
+    ledger.transactions = False # mongomock has no sessions
+    return StockReservations(ledger, db.stock_reservations, ttl=1800, batch_size=2)
+
+def _product(db, run, stock=10):
+    product_id = uuid.uuid4()
+    run(db.products.insert_one({"_id": product_id, "name": f"Valve {product_id.hex[:6]}", "price": 1000.0,
+                                "stock_quantity": stock}))
+    return product_id
+
+def _stock(db, run, product_id):
+    return run(db.products.find_one({"_id": product_id}))["stock_quantity"]
+
+def _reserve(reservations, run, quantities):
+    order_id = uuid.uuid4()
+
+    async def on_reserved(session):
+        pass
+
+    run(reservations.reserve(order_id, quantities, on_reserved))
+    return order_id
+
+def test_commit_is_idempotent(db, run, reservations):
+    valve = _product(db, run)
+    order_id = _reserve(reservations, run, {valve: 3})
+    assert _stock(db, run, valve) == 7
+
+    assert run(reservations.commit(order_id)) is True
+    assert run(reservations.commit(order_id)) is False
+    assert _stock(db, run, valve) == 7
+    assert run(db.stock_reservations.find_one({"_id": order_id}))["status"] == COMMITTED
+    # An order placed before reservations existed has nothing to commit
+    assert run(reservations.commit(uuid.uuid4())) is False
+
+def test_sweep_releases_expired_holds_only(db, run, reservations):
+    valve = _product(db, run)
+    expired = [_reserve(reservations, run, {valve: 2}) for _ in range(3)]
+    paid = _reserve(reservations, run, {valve: 1})
+    run(reservations.commit(paid))
+    assert _stock(db, run, valve) == 3
+
+    assert run(reservations.sweep(datetime.utcnow())) == 0 # Nothing has expired yet
+    # Three holds, swept in batches of two; the committed one stays taken
+    assert run(reservations.sweep(datetime.utcnow() + timedelta(seconds=1801))) == 3
+    assert _stock(db, run, valve) == 9
+    statuses = {r["_id"]: r["status"] for r in run(db.stock_reservations.find().to_list(length=None))}
+    assert [statuses[order_id] for order_id in expired] == [RELEASED] * 3
+    assert statuses[paid] == COMMITTED
+    # Sweeping again restores nothing twice
+    assert run(reservations.sweep(datetime.utcnow() + timedelta(seconds=3600))) == 0
+    assert _stock(db, run, valve) == 9
+
+def test_payment_after_release_reacquires_stock(db, run, reservations):
+    valve = _product(db, run, stock=2)
+    order_id = _reserve(reservations, run, {valve: 2})
+    run(reservations.sweep(datetime.utcnow() + timedelta(seconds=1801)))
+    assert _stock(db, run, valve) == 2
+
+    assert run(reservations.commit(order_id)) is True
+    assert _stock(db, run, valve) == 0 and reservations.reacquired == 1
+    assert run(reservations.commit(order_id)) is False
+
+    # Sold to someone else meanwhile: the late payment can't be filled
+    late = _reserve(reservations, run, {_product(db, run, stock=1): 1})
+    run(db.stock_reservations.update_one({"_id": late}, {"$set": {"status": RELEASED}}))
+    run(db.products.update_many({}, {"$set": {"stock_quantity": 0}}))
+    with pytest.raises(InsufficientStock):
+        run(reservations.commit(late))
+
+def test_commit_many(db, run, reservations):
+    valve = _product(db, run)
+    held = [_reserve(reservations, run, {valve: 1}) for _ in range(3)]
+    released = _reserve(reservations, run, {valve: 2})
+    run(db.stock_reservations.update_one({"_id": released}, {"$set": {"expiresAt": datetime.utcnow() - timedelta(seconds=1)}}))
+    run(reservations.sweep())
+    assert _stock(db, run, valve) == 7
+
+    assert run(reservations.commit_many(held + [released, uuid.uuid4()])) == 4
+    assert _stock(db, run, valve) == 5
+    statuses = [r["status"] for r in run(db.stock_reservations.find().to_list(length=None))]
+    assert statuses == [COMMITTED] * 4
+    # Repeating the batch (e.g. a redelivered webhook batch) changes nothing
+    assert run(reservations.commit_many(held + [released])) == 0
+    assert _stock(db, run, valve) == 5
+    assert run(reservations.commit_many([])) == 0
@@ -0,0 +1,22 @@
+from utils.response_cache import MEMORY_CACHE_MAX_TTL, CachedResponse, MemoryCacheBackend, create_response_cache
+
+PREFIXES = {"/api/products": "products"}
+
+def test_memory_backend_ttl_is_capped():
+    # Another worker's purge never reaches this process, so its entries must age out quickly
+    cache = create_response_cache(None, ttl=3600, prefixes=PREFIXES)
+    assert isinstance(cache.backend, MemoryCacheBackend)
+    assert cache.ttl == MEMORY_CACHE_MAX_TTL
+
+def test_purge_invalidates_namespace(run):
+    cache = create_response_cache(None, ttl=3600, prefixes=PREFIXES)
+
+    async def scenario():
+        key, cached = await cache.get("products", "/api/products/", b"limit=10")
+        assert cached is None
+        await cache.set(key, CachedResponse(200, [], b"[]", b'"etag"'))
+        assert (await cache.get("products", "/api/products/", b"limit=10"))[1] is not None
+        await cache.purge("products")
+        return await cache.get("products", "/api/products/", b"limit=10")
+
+    assert run(scenario())[1] is None
@@ -0,0 +1,136 @@
+"""Product search benchmark: regex scan vs Mongo text index vs the in-memory index
+
+Runs against a synthetic catalog (SEARCH_BENCHMARK_SIZE products, 100k by default).
+The Mongo comparison needs TEST_MONGO_URL and the in-memory timing RUN_BENCHMARKS=1;
+timings print with `pytest -s`. The default run only checks the index's ranking.
+"""
+import os
+import random
+import re
+import statistics
+import time
+import uuid
+
+import pytest
+
+from utils.search_index import InvertedIndex
+
+CATALOG_SIZE = int(os.environ.get("SEARCH_BENCHMARK_SIZE", "100000"))
+QUERIES = ["brass valve", "copper pipe", "solar inverter", "water heater", "pressure pump", "ppr elbow"]
+
+MATERIALS = ["brass", "copper", "steel", "pvc", "ppr", "cast iron", "galvanized", "stainless"]
+ITEMS = ["valve", "pipe", "elbow", "tee", "union", "pump", "heater", "inverter", "panel", "tank", "fitting", "meter"]
+QUALIFIERS = ["pressure", "solar", "water", "gas", "ball", "gate", "check", "float", "booster", "submersible"]
+SIZES = ["1/2 inch", "3/4 inch", "1 inch", "2 inch", "20mm", "25mm", "32mm", "50mm"]
+BRANDS = ["Einspot", "Rheem", "Grundfos", "Pedrollo", "Ariston", "Luminous"]
+
+def synthetic_catalog(size: int, seed: int = 42):
+    rng = random.Random(seed)
+    categories = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(20)]
+    for n in range(size):
+        name = f"{rng.choice(BRANDS)} {rng.choice(QUALIFIERS)} {rng.choice(MATERIALS)} {rng.choice(ITEMS)} {rng.choice(SIZES)}"
+        description = (f"{rng.choice(MATERIALS).title()} {rng.choice(ITEMS)} rated for {rng.choice(QUALIFIERS)} "
+                       f"service, model {n}. Suitable for {rng.choice(QUALIFIERS)} {rng.choice(ITEMS)} installations.")
+        yield {
+            "_id": uuid.UUID(int=rng.getrandbits(128)),
+            "name": name,
+            "description": description,
+            "price": round(rng.uniform(1000, 500000), 2),
+            "stock_quantity": rng.randint(0, 50),
+            "category_id": rng.choice(categories),
+            "createdAt": None,
+        }
+
+def median_ms(fn, *args) -> float:
+    timings = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return statistics.median(timings)
+
+def regex_scan(products, query: str, limit: int = 20):
+    # What $regex does server-side: test every document. Ranking or counting the matches
+    # (as faceted search does) means the scan can't stop at the first `limit` hits.
+    pattern = re.compile(re.escape(query), re.IGNORECASE)
+    hits = [product for product in products if pattern.search(product["name"]) or pattern.search(product["description"])]
+    return hits[:limit]
+
+def _index(products) -> InvertedIndex:
+    index = InvertedIndex()
+    started_at = time.perf_counter()
+    for product in products:
+        index.upsert(product)
+    print(f"\nIndexed {len(index)} products in {time.perf_counter() - started_at:.1f}s")
+    return index
+
+def _check_ranking(index: InvertedIndex, products, query: str):
+    ranked = index.search(query, limit=20)
+    assert len(ranked) == 20, query
+    assert ranked == index.search(query)[:20], query
+    # Every term of the query appears in the best hit
+    top = next(product for product in products if product["_id"] == ranked[0][0])
+    text = f"{top['name']} {top['description']}".lower()
+    assert all(term in text for term in query.split()), (query, text)
+
+def test_memory_index_top_hits():
+    products = list(synthetic_catalog(5_000))
+    index = _index(products)
+    for query in QUERIES:
+        _check_ranking(index, products, query)
+
+@pytest.mark.benchmark
+def test_memory_index_beats_regex_scan():
+    products = list(synthetic_catalog(CATALOG_SIZE))
+    index = _index(products)
+
+    timings = {}
+    for query in QUERIES:
+        _check_ranking(index, products, query)
+        timings[query] = {"memory": median_ms(index.search, query, None, 20), "regex": median_ms(regex_scan, products, query)}
+        print(f"{query!r}: memory {timings[query]['memory']:.1f}ms, regex scan {timings[query]['regex']:.1f}ms")
+    # Summed over the queries so one noisy sample doesn't decide it
+    assert sum(t["memory"] for t in timings.values()) < sum(t["regex"] for t in timings.values())
+
+def test_text_index_vs_regex_on_mongo(real_db, run):
+    async def measure():
+        for batch_start in range(0, CATALOG_SIZE, 10_000):
+            batch = list(synthetic_catalog(min(10_000, CATALOG_SIZE - batch_start), seed=batch_start))
+            await real_db.products.insert_many(batch)
+        await real_db.products.create_index([("name", "text"), ("description", "text")],
+                                            weights={"name": 3, "description": 1})
+
+        results = {}
+        for query in QUERIES:
+            pattern = re.escape(query)
+            shapes = {
+                "text": {"$text": {"$search": query}},
+                "regex": {"$or": [{"name": {"$regex": pattern, "$options": "i"}},
+                                  {"description": {"$regex": pattern, "$options": "i"}}]},
+            }
+            results[query] = {}
+            for engine, query_filter in shapes.items():
+                timings = []
+                for _ in range(5):
+                    # Counting, like faceted search's total, so neither can stop early
+                    started_at = time.perf_counter()
+                    count = await real_db.products.count_documents(query_filter)
+                    timings.append((time.perf_counter() - started_at) * 1000)
+                plan = await real_db.command("explain", {"find": "products", "filter": query_filter},
+                                             verbosity="executionStats")
+                results[query][engine] = {
+                    "ms": statistics.median(timings),
+                    "count": count,
+                    "examined": plan["executionStats"]["totalDocsExamined"],
+                }
+        return results
+
+    results = run(measure())
+    for query, engines in results.items():
+        text, regex = engines["text"], engines["regex"]
+        print(f"{query!r}: text {text['ms']:.1f}ms ({text['count']} hits, {text['examined']} examined), "
+              f"regex {regex['ms']:.1f}ms ({regex['count']} hits, {regex['examined']} examined)")
+        assert text["count"] >= regex["count"] > 0, query
+        # The regex always reads the whole collection; the text index only its matches
+        assert regex["examined"] == CATALOG_SIZE, query
+        assert text["examined"] <= text["count"], query
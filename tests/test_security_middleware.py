@@ -0,0 +1,96 @@
+import json
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from middleware.rate_limit import RateLimiter
+from middleware.security import SECURITY_HEADERS, SecurityASGIMiddleware, SecurityMiddleware, scope_client_ip
+
+async def _home(request):
+    return PlainTextResponse("ok", headers={"x-app": "home"})
+
+async def _stream(request):
+    async def chunks():
+        for n in range(3):
+            yield f"chunk {n}\n".encode()
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+@pytest.fixture
+def security():
+    security = SecurityMiddleware()
+    security.limiter = RateLimiter(per_minute=3, block_duration=900)
+    return security
+
+@pytest.fixture
+def client(security, run):
+    app = Starlette(routes=[Route("/", _home), Route("/stream", _stream)])
+    transport = httpx.ASGITransport(app=SecurityASGIMiddleware(app, security), client=("10.0.0.9", 4321))
+    client = httpx.AsyncClient(transport=transport, base_url="http://testserver")
+    yield client
+    run(client.aclose())
+
+def _headers(response: httpx.Response) -> dict:
+    return {name.decode(): response.headers.get(name.decode()) for name, _ in SECURITY_HEADERS}
+
+def test_security_headers_are_added_to_every_response(client, run):
+    response = run(client.get("/"))
+    assert response.status_code == 200 and response.text == "ok"
+    assert response.headers["x-app"] == "home"
+    assert _headers(response) == {name.decode(): value.decode() for name, value in SECURITY_HEADERS}
+
+    response = run(client.get("/stream"))
+    assert response.text == "chunk 0\nchunk 1\nchunk 2\n"
+    assert response.headers["x-frame-options"] == "DENY"
+
+def test_rate_limited_request_gets_429_with_retry_after(client, run):
+    for _ in range(3):
+        assert run(client.get("/")).status_code == 200
+
+    response = run(client.get("/"))
+    assert response.status_code == 429
+    assert response.json() == {"detail": "Rate limit exceeded"}
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["retry-after"] == "20" # One of 3 per minute
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+    # Limits are per forwarded client, not per proxy connection
+    assert run(client.get("/", headers={"X-Forwarded-For": "203.0.113.7, 10.0.0.1"})).status_code == 200
+
+def test_blocked_client_gets_the_block_body(client, security, run):
+    responses = [run(client.get("/")) for _ in range(10)]
+    assert security.limiter.blocks == 1
+    blocked = responses[-1]
+    assert blocked.status_code == 429
+    assert json.loads(blocked.content) == {"detail": "IP address blocked due to excessive requests"}
+    assert blocked.headers["retry-after"] == "900"
+
+@pytest.mark.parametrize("headers, client_addr, expected", [
+    ([(b"x-forwarded-for", b"203.0.113.7, 10.0.0.1")], ("10.0.0.1", 80), "203.0.113.7"),
+    ([(b"x-real-ip", b"198.51.100.2"), (b"x-forwarded-for", b" 203.0.113.7 ")], ("10.0.0.1", 80), "203.0.113.7"),
+    ([(b"x-real-ip", b"198.51.100.2")], ("10.0.0.1", 80), "198.51.100.2"),
+    ([(b"host", b"localhost")], ("10.0.0.1", 80), "10.0.0.1"),
+    ([], None, "unknown"),
+])
+def test_scope_client_ip(headers, client_addr, expected):
+    assert scope_client_ip({"type": "http", "headers": headers, "client": client_addr}) == expected
+
+@pytest.mark.parametrize("scope_type", ["lifespan", "websocket"])
+def test_non_http_scopes_pass_through(security, run, scope_type):
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(scope["type"])
+        await send({"type": "marker"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = SecurityASGIMiddleware(app, security)
+    run(middleware({"type": scope_type, "headers": [], "client": ("10.0.0.9", 1)}, None, send))
+    assert seen == [scope_type] and sent == [{"type": "marker"}]
+    assert security.limiter.backend_calls == 0
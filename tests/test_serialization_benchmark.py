@@ -0,0 +1,84 @@
+"""Per-item serialization cost: FastAPI's response_model path vs ModelSerializer
+
+The timings only run with RUN_BENCHMARKS=1; by default the two paths are just compared for equal output.
+"""
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import List
+
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+ITEMS = 500
+
+def _products(category):
+    now = datetime.utcnow()
+    return [{
+        "_id": uuid.uuid4(), "name": f"Storage water heater {n}", "description": "Enamelled tank, 50L, 2kW element",
+        "price": 85000.0 + n, "stock_quantity": n % 7, "category_id": category["_id"], "category": category,
+        "images": [f"/images/heater-{n}.jpg", f"/images/heater-{n}-side.jpg"], "createdAt": now, "updatedAt": now,
+    } for n in range(ITEMS)]
+
+def _orders():
+    now = datetime.utcnow()
+    return [{
+        "_id": uuid.uuid4(), "customer_id": uuid.uuid4(), "shipping_address": "12 Marina Road, Lagos",
+        "total_amount": 170000.0, "status": "pending", "payment_method": "paystack", "payment_status": "pending",
+        "items": [{"product_id": uuid.uuid4(), "quantity": 2, "price_at_purchase": 85000.0} for _ in range(3)],
+        "createdAt": now, "updatedAt": now,
+    } for n in range(ITEMS)]
+
+def _per_item_us(*fns, repeat: int = 9) -> List[float]:
+    # Alternated so a burst of machine load can't land on just one side of the comparison
+    timings = [[] for _ in fns]
+    for _ in range(repeat):
+        for fn, fn_timings in zip(fns, timings):
+            started_at = time.perf_counter()
+            fn()
+            fn_timings.append(time.perf_counter() - started_at)
+    return [min(fn_timings) / ITEMS * 1_000_000 for fn_timings in timings]
+
+def _paths(run, model, serializer, documents):
+    field = create_response_field(name="Response", type_=List[model])
+
+    def response_model_path():
+        # What the endpoints did before: build models, then FastAPI re-validates, encodes and json.dumps
+        models = [model(**{**document, "id": document["_id"]}) for document in documents]
+        return JSONResponse(run(serialize_response(field=field, response_content=models))).body
+
+    def serializer_path():
+        return serializer.response_many(documents).body
+
+    return response_model_path, serializer_path
+
+def _compare(run, model, serializer, documents):
+    response_model_path, serializer_path = _paths(run, model, serializer, documents)
+    assert json.loads(serializer_path()) == json.loads(response_model_path())
+    before, after = _per_item_us(response_model_path, serializer_path)
+    print(f"\n{model.__name__}: {before:.1f}us/item before, {after:.1f}us/item after ({before / after:.1f}x)")
+    assert after < before
+
+def _category():
+    return {"_id": uuid.uuid4(), "name": "Water Heaters", "description": None,
+            "createdAt": datetime.utcnow(), "updatedAt": datetime.utcnow()}
+
+@pytest.mark.parametrize("kind", ["product", "order"])
+def test_serializer_matches_response_model_output(server, run, kind):
+    if kind == "product":
+        model, serializer, documents = server.ProductPublic, server.product_public_serializer, _products(_category())
+    else:
+        model, serializer, documents = server.OrderPublic, server.order_public_serializer, _orders()
+    response_model_path, serializer_path = _paths(run, model, serializer, documents)
+    assert json.loads(serializer_path()) == json.loads(response_model_path())
+
+@pytest.mark.benchmark
+def test_product_public_per_item_cost(server, run):
+    _compare(run, server.ProductPublic, server.product_public_serializer, _products(_category()))
+
+@pytest.mark.benchmark
+def test_order_public_per_item_cost(server, run):
+    _compare(run, server.OrderPublic, server.order_public_serializer, _orders())
@@ -0,0 +1,100 @@
+"""Concurrent orders against limited stock must never oversell"""
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+
+from utils.stock import InsufficientStock, StockLedger
+
+BUYERS = 25
+STOCK = 5
+
+class InterleavingCollection:
+    """Yields to the event loop around every write, as a networked driver would
+
+    mongomock runs each call inline, so without this concurrent orders would never interleave.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in ("bulk_write", "update_one", "update_many", "find_one", "insert_one"):
+            return attribute
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            result = await attribute(*args, **kwargs)
+            await asyncio.sleep(0)
+            return result
+        return call
+
+def _product(name: str, stock: int):
+    now = datetime.utcnow()
+    return {"_id": uuid.uuid4(), "name": name, "price": 1000.0, "stock_quantity": stock, "images": [],
+            "createdAt": now, "updatedAt": now}
+
+def test_ledger_never_oversells(db, run):
+    valve, pipe = _product("Valve", STOCK), _product("Pipe", STOCK * 2)
+    run(db.products.insert_many([valve, pipe]))
+    ledger = StockLedger(None, InterleavingCollection(db.products))
+    ledger.transactions = False
+
+    async def buy(n):
+        # Half the carts also want two pipes, so some fail on the second product and roll back the first
+        quantities = {valve["_id"]: 1, pipe["_id"]: 2} if n % 2 else {valve["_id"]: 1}
+        products = await ledger.load_products(quantities)
+        ledger.check_available(products, quantities) # Stale for most buyers by the time they decrement
+        try:
+            await ledger.decrement(uuid.uuid4(), quantities, lambda session: asyncio.sleep(0))
+        except InsufficientStock:
+            return None
+        return quantities
+
+    async def buy_all():
+        return await asyncio.gather(*[buy(n) for n in range(BUYERS)], return_exceptions=True)
+
+    results = run(buy_all())
+    assert not [result for result in results if isinstance(result, BaseException)]
+    sold = [result for result in results if result]
+
+    stock = {product["_id"]: product for product in run(db.products.find().to_list(length=None))}
+    assert len(sold) <= STOCK
+    for product, initial in ((valve, STOCK), (pipe, STOCK * 2)):
+        remaining = stock[product["_id"]]["stock_quantity"]
+        assert remaining >= 0
+        assert remaining + sum(quantities.get(product["_id"], 0) for quantities in sold) == initial
+        # Every hold marker was cleared, whether the order went through or was compensated
+        assert not stock[product["_id"]].get("stock_holds")
+
+@pytest.mark.parametrize("quantity", [1, 2])
+def test_concurrent_orders_never_oversell(server, api, db, run, monkeypatch, quantity):
+    product = _product("Storage water heater", STOCK)
+    run(db.products.insert_one(product))
+    monkeypatch.setattr(server.stock_ledger, "products", InterleavingCollection(db.products))
+
+    response = run(api.post("/api/auth/register", json={"email": "buyer@example.com", "password": "pw-buyer-1"}))
+    assert response.status_code == 201
+    token = run(api.post("/api/auth/login", data={"username": "buyer@example.com", "password": "pw-buyer-1"})).json()["access_token"]
+
+    order = {"shipping_address": "12 Marina Road, Lagos", "total_amount": 0,
+             "items": [{"product_id": str(product["_id"]), "quantity": quantity, "price_at_purchase": 1000.0}]}
+    async def order_all():
+        return await asyncio.gather(*[
+            api.post("/api/orders/", json=order, headers={"Authorization": f"Bearer {token}"}) for _ in range(BUYERS)
+        ])
+
+    responses = run(order_all())
+
+    statuses = [response.status_code for response in responses]
+    assert set(statuses) <= {201, 400}, [response.text for response in responses if response.status_code not in (201, 400)]
+    successes = statuses.count(201)
+    remaining = run(db.products.find_one({"_id": product["_id"]}))["stock_quantity"]
+    assert remaining >= 0
+    assert successes * quantity <= STOCK
+    assert remaining == STOCK - successes * quantity
+    assert successes == STOCK // quantity # Nothing was turned away while stock remained
+    assert run(db.orders.count_documents({})) == successes
+    assert run(db.stock_reservations.count_documents({"status": "held"})) == successes
@@ -0,0 +1,100 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from utils import streaming
+from utils.streaming import NDJSON_MEDIA_TYPE, stream_cursor
+
+class TrackedCursor:
+    """Wraps a Motor cursor, recording how many documents were read and whether it was closed"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.read = 0
+        self.closed = False
+
+    def batch_size(self, batch_size):
+        self.cursor = self.cursor.batch_size(batch_size)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        document = await self.cursor.__anext__()
+        self.read += 1
+        return document
+
+    async def close(self):
+        self.closed = True
+        await self.cursor.close()
+
+def _status_checks(db, run, count):
+    documents = [{"id": f"check-{n}", "client_name": f"client {n}", "timestamp": datetime(2024, 1, 1)} for n in range(count)]
+    if documents:
+        run(db.status_checks.insert_many(documents))
+    return [document["id"] for document in documents]
+
+@pytest.mark.parametrize("count", [0, 1, 250])
+def test_json_array(api, db, run, monkeypatch, count):
+    monkeypatch.setattr(streaming, "FLUSH_SIZE", 1024) # Several chunks for the larger case
+    ids = _status_checks(db, run, count)
+
+    response = run(api.get("/api/status"))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert [check["id"] for check in json.loads(response.content)] == ids
+
+@pytest.mark.parametrize("count", [0, 1, 250])
+def test_ndjson(api, db, run, monkeypatch, count):
+    monkeypatch.setattr(streaming, "FLUSH_SIZE", 1024)
+    ids = _status_checks(db, run, count)
+
+    response = run(api.get("/api/status", headers={"Accept": NDJSON_MEDIA_TYPE}))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == NDJSON_MEDIA_TYPE
+    assert response.text.endswith("\n") or count == 0
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ids
+
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_cursor_is_closed_when_the_stream_ends(db, run, ndjson):
+    _status_checks(db, run, 3)
+    cursor = TrackedCursor(db.status_checks.find())
+    response = stream_cursor(cursor, lambda check: json.dumps(check["id"]), ndjson=ndjson)
+
+    async def consume():
+        return b"".join([chunk async for chunk in response.body_iterator]).decode()
+
+    body = run(consume())
+    ids = [json.loads(line) for line in body.splitlines()] if ndjson else json.loads(body)
+    assert ids == ["check-0", "check-1", "check-2"]
+    assert cursor.closed and cursor.read == 3
+
+def test_cursor_is_closed_when_the_client_disconnects(db, run, monkeypatch):
+    monkeypatch.setattr(streaming, "FLUSH_SIZE", 1)
+    _status_checks(db, run, 50)
+    cursor = TrackedCursor(db.status_checks.find())
+    response = stream_cursor(cursor, lambda check: json.dumps(check["id"]))
+
+    async def scenario():
+        first_chunk = asyncio.Event()
+        sent = []
+
+        async def receive():
+            await first_chunk.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                sent.append(message["body"])
+                first_chunk.set()
+                await asyncio.Event().wait() # A client that stopped reading
+
+        await asyncio.wait_for(response({"type": "http"}, receive, send), timeout=5)
+        return sent
+
+    sent = run(scenario())
+    assert len(sent) == 1 and cursor.read < 50
+    assert cursor.closed
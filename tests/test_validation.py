@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from utils.validation import MESSAGE_MAX_LENGTH, Message, sanitize_string
+
+def _baseline_sanitize(value: str, max_length: int) -> str:
+    # The per-character filter sanitize_string replaced
+    sanitized = ''.join(char for char in value if ord(char) >= 32 or char in '\n\r\t')
+    if len(sanitized) > max_length:
+        raise ValueError(f"Input too long. Maximum {max_length} characters allowed")
+    return sanitized.strip()
+
+def _best_ms(fn, *args, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - started_at) * 1000)
+    return min(timings)
+
+def _large_message(control_chars: bool) -> str:
+    paragraph = "We need 40 units of the 50L storage heater for the Lekki site.\n\tDelivery by March.\r\n"
+    if control_chars:
+        paragraph += "\x00\x07\x1b"
+    return paragraph * (1_400_000 // len(paragraph))
+
+@pytest.mark.parametrize("control_chars", [False, True])
+def test_sanitize_large_message_matches_baseline(control_chars):
+    body = _large_message(control_chars)
+    sanitized = sanitize_string(body, len(body))
+    assert sanitized == _baseline_sanitize(body, len(body))
+    assert ("\x00" in sanitized, "\t" in sanitized) == (False, True)
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("control_chars", [False, True])
+def test_sanitize_large_message_benchmark(control_chars):
+    body = _large_message(control_chars)
+    before, after = _best_ms(_baseline_sanitize, body, len(body)), _best_ms(sanitize_string, body, len(body))
+    print(f"\n{len(body) / 1e6:.1f}MB message{' with control characters' if control_chars else ''}: "
+          f"{before:.1f}ms before, {after:.1f}ms after")
+    assert after * 5 < before
+
+def test_overlong_message_is_rejected():
+    class Form(BaseModel):
+        message: Message
+
+    with pytest.raises(ValidationError, match="Input too long"):
+        Form(message="x" * (MESSAGE_MAX_LENGTH + 1))
+
+def test_contact_form_normalizes_phone_and_email(api, db, run):
+    response = run(api.post("/api/contact", json={
+        "name": "Ada\x00 Obi", "email": " Ada@Example.com", "phone": "+234 (803) 123-4567", "message": "Quote please",
+    }))
+    assert response.status_code == 201, response.text
+    submission = run(db.contact_submissions.find_one({}))
+    assert (submission["name"], submission["email"], submission["phone"]) == ("Ada Obi", "ada@example.com", "+2348031234567")
+
+@pytest.mark.parametrize("phone, stored", [
+    ("08031234567", "+2348031234567"),
+    ("0803 123 4567", "+2348031234567"),
+    ("0803-123-4567", "+2348031234567"),
+    ("01 2345678", "+23412345678"),
+    ("2348031234567", "2348031234567"),
+])
+def test_contact_form_accepts_local_numbers(api, db, run, phone, stored):
+    response = run(api.post("/api/contact", json={"name": "Ada", "email": "ada@example.com", "phone": phone, "message": "Hi"}))
+    assert response.status_code == 201, response.text
+    assert run(db.contact_submissions.find_one({}))["phone"] == stored
+
+@pytest.mark.parametrize("phone", ["0", "080", "phone me"])
+def test_contact_form_rejects_malformed_phone(api, db, run, phone):
+    response = run(api.post("/api/contact", json={"name": "Ada", "email": "ada@example.com", "phone": phone, "message": "Hi"}))
+    assert response.status_code == 422
+    assert "Invalid phone number format" in response.text